@@ -0,0 +1,156 @@
+# admission.py
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict
+
+PARSE_MAX_IN_FLIGHT = int(os.getenv("PARSE_MAX_IN_FLIGHT", "32"))
+PARSE_QUEUE_MAX = int(os.getenv("PARSE_QUEUE_MAX", "64"))
+PARSE_QUEUE_TIMEOUT = float(os.getenv("PARSE_QUEUE_TIMEOUT", "2"))
+PARSE_PER_USER = int(os.getenv("PARSE_PER_USER", "2"))
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: status — 429 (лимит пользователя) или 503 (сервис насыщен)."""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Допуск к тяжёлым эндпоинтам: не больше max_in_flight одновременно, короткая очередь ожидания
+    (max_queue мест, queue_timeout секунд) и не больше per_user запросов от одного tg_id/IP.
+    Всё, что не помещается, отбивается сразу — ответ с Retry-After вместо зависшего соединения.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int = PARSE_MAX_IN_FLIGHT,
+        max_queue: int = PARSE_QUEUE_MAX,
+        queue_timeout: float = PARSE_QUEUE_TIMEOUT,
+        per_user: int = PARSE_PER_USER,
+    ):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.per_user = per_user
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._per_key: Dict[str, int] = {}
+        # среднее время обработки (EWMA) — для оценки Retry-After
+        self._service_time = 1.0
+        self.counters = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_user": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+        }
+        self.max_queue_depth = 0
+
+    @property
+    def waiting(self) -> int:
+        """Сколько запросов ждут слота в очереди."""
+        return len(self._waiters)
+
+    def _retry_after(self) -> int:
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self._service_time * backlog / self.max_in_flight))
+
+    def check(self, key: str):
+        """Отказ, который сейчас получил бы acquire(key), — без занятия слота и ожидания в очереди."""
+        if self.per_user and self._per_key.get(key, 0) >= self.per_user:
+            self.counters["rejected_user"] += 1
+            raise AdmissionRejected(429, "Слишком много одновременных запросов", max(1, math.ceil(self._service_time)))
+        if (self.in_flight >= self.max_in_flight or self._waiters) and len(self._waiters) >= self.max_queue:
+            self.counters["rejected_queue_full"] += 1
+            raise AdmissionRejected(503, "Сервис перегружен, попробуйте позже", self._retry_after())
+
+    async def acquire(self, key: str):
+        self.check(key)
+
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self.counters["queued"] += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+            try:
+                # слот передаётся напрямую из release: in_flight при этом не меняется
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+            except BaseException as e:
+                self._per_key_release(key)
+                if waiter.done() and not waiter.cancelled():
+                    # слот успели отдать в момент отказа — передаём его следующему
+                    self._hand_off()
+                else:
+                    waiter.cancel()
+                    self._drop_waiter(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counters["rejected_timeout"] += 1
+                    raise AdmissionRejected(503, "Сервис перегружен, попробуйте позже", self._retry_after()) from None
+                raise
+            self.counters["admitted"] += 1
+            return
+
+        self._per_key[key] = self._per_key.get(key, 0) + 1
+        self.counters["admitted"] += 1
+
+    def _drop_waiter(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _per_key_release(self, key: str):
+        left = self._per_key.get(key, 0) - 1
+        if left > 0:
+            self._per_key[key] = left
+        else:
+            self._per_key.pop(key, None)
+
+    def _hand_off(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def release(self, key: str, elapsed: float = None):
+        if elapsed is not None:
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+        self._per_key_release(key)
+        self._hand_off()
+
+    @asynccontextmanager
+    async def admit(self, key: str):
+        await self.acquire(key)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(key, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "users": len(self._per_key),
+            "avg_service_time": round(self._service_time, 3),
+            **self.counters,
+        }
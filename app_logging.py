@@ -0,0 +1,174 @@
+# app_logging.py
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен — без него обычный json
+    orjson = None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json — одна строка JSON на запись, text — прежний человекочитаемый вид
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Для частых сообщений (на каждый парсинг/запрос к WB) пишется одно из LOG_SAMPLE_EVERY
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "20"))
+
+# Телефоны, email, номера карт и значения «чувствительных» ключей в словарях/JSON
+_REDACT_PATTERNS = [
+    (re.compile(r"(?<![\w/])\+?[78][\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)"), "<phone>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"(?<!\d)\d{13,19}(?!\d)"), "<card>"),
+    (
+        re.compile(
+            r"""(["']?(?:phone|phone_number|email|card|card_type|first6|last4|payment_method|"""
+            r"""provider_payment_charge_id|telegram_payment_charge_id)["']?\s*[:=]\s*)(["']?)[^,"'}\s)]+\2""",
+            re.IGNORECASE,
+        ),
+        r"\1\2***\2",
+    ),
+]
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in _REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactingFilter(logging.Filter):
+    """Вычищает платёжные и телефонные данные из текста записи (работает в потоке записи, не в event loop)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Частые сообщения пишем выборочно: logger.info(..., extra={"sample": 100}) —
+    проходит каждое сотое с этого места в коде. Отброшенные записи даже не попадают в очередь.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._counters: Dict[Tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample", None)
+        if not every or every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        seen = self._counters.get(key, 0)
+        self._counters[key] = seen + 1
+        if seen % every:
+            return False
+        record.sampled = every
+        return True
+
+
+def _dumps(data: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))}.{int(record.msecs):03d}",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        sampled = getattr(record, "sampled", None)
+        if sampled:
+            data["sampled"] = sampled
+        if record.exc_info and not record.exc_text:
+            record.exc_text = redact(self.formatException(record.exc_info))
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return _dumps(data)
+
+
+class _LoopQueueHandler(logging.handlers.QueueHandler):
+    """В вызывающем потоке — подстановка аргументов и traceback и запись в очередь; JSON, вычистка и вывод — в фоне."""
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # как в QueueHandler.prepare: пока запись ждёт в очереди, event loop может менять словари из args,
+        # а exc_info держит кадры стека живыми — поэтому текст собираем сразу
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # переполнение не должно тормозить event loop — запись теряем
+            pass
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(service: str, level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """
+    Корневой логгер пишет через очередь: вызов logger.info() в event loop — это put_nowait,
+    а stdout, JSON и вычистка данных — в отдельном потоке QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter(service))
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    stream.addFilter(RedactingFilter())
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _LoopQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # httpx/aiohttp на INFO пишут строку на каждый запрос
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,69 @@
+# archive.py
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import AsyncSessionLocal
+from database.models import Product, ProductStatus
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+products = Product.__table__
+# Та же схема, что у products: архив читается теми же колонками
+archived_products = products.to_metadata(MetaData(), name=f"{products.name}_archive")
+
+
+def archive_cutoff() -> datetime:
+    """Посты, опубликованные раньше этого момента, живут в архиве."""
+    return datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+async def ensure_archive_table(session: AsyncSession):
+    # LIKE ... INCLUDING ALL копирует колонки, дефолты и индексы горячей таблицы
+    await session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{archived_products.name}" (LIKE "{products.name}" INCLUDING ALL)'
+    ))
+    await session.commit()
+
+
+async def archive_batch(session: AsyncSession, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Переносит одну пачку старых опубликованных постов одним запросом:
+    WITH moved AS (DELETE ... RETURNING *) INSERT INTO archive SELECT * FROM moved.
+    """
+    ids = (
+        select(products.c.id)
+        .where(products.c.status == ProductStatus.posted, products.c.scheduled_date < cutoff)
+        .order_by(products.c.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    moved = delete(products).where(products.c.id.in_(ids)).returning(*products.c).cte("moved")
+    columns = [c.name for c in products.c]
+    stmt = insert(archived_products).from_select(columns, select(*[moved.c[name] for name in columns]))
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.rowcount or 0
+
+
+async def run_archival(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Архивирует всё, что старше ARCHIVE_AFTER_DAYS, короткими транзакциями по batch_size строк."""
+    cutoff = archive_cutoff()
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            moved = await archive_batch(session, cutoff, batch_size)
+        total += moved
+        if moved < batch_size:
+            break
+        # отдаём event loop и пул соединений между пачками
+        await asyncio.sleep(0.1)
+    logger.info(f"🗄 Архивация: перенесено {total} постов старше {cutoff:%Y-%m-%d}")
+    return total
@@ -1,44 +1,146 @@
 from fastapi import FastAPI, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import OperationalError, InterfaceError
-from sqlalchemy import text
+from sqlalchemy import text, insert, update, func, union_all
 from datetime import datetime, timezone
-import httpx, uuid, hashlib, json
-from yookassa import Configuration, Payment
-from telegram import Bot
+import httpx, uuid, hashlib, json, hmac, csv, io, zlib
 import os
 import re
 from database.db import get_session, AsyncSessionLocal
 from database.models import Product, User, ProductStatus
-from backend.new_parser import parse_wb_product_api
+from backend.new_parser import get_parser, parser_caches, WBParser
+from backend.prewarm import readiness, start_prewarm, warm_db
+from backend.runtime import FastJSONResponse, json_dumps, uvicorn_options, describe as describe_runtime
+from backend.parse_snapshot import sign_snapshot, verify_snapshot, SNAPSHOT_MAX_AGE
+from backend.user_cache import user_cache, get_user_cached
+from backend.slot_allocator import SlotAllocator
+from backend.raw_store import ensure_raw_store, pack_raw, raw_ref, save_raw_snapshots, load_raw_snapshot
+from backend.archive import archived_products, archive_cutoff, ensure_archive_table, run_archival
+from backend.price_history import price_history, bucket_to_dict, ensure_price_history, flush_price_history, load_series
+from backend.watchlist import WatchlistEngine, ensure_watchlist_table, save_watch, delete_watch
+from backend.parse_worker import create_parse_queue
+from backend.admission import AdmissionController, AdmissionRejected
+from backend.webapp_auth import verify_init_data
+from backend.app_logging import setup_logging, LOG_SAMPLE_EVERY
+from backend.metrics import (
+    registry, timed, observe, cache_result, HTTP_LATENCY, HTTP_REQUESTS, YOOKASSA_LATENCY, TELEGRAM_LATENCY,
+    DB_LATENCY, POSTS, RETRIES,
+)
+from backend.profiling import profiler, span
+from backend.loop_monitor import LoopMonitor
+from backend.memory_diag import track, track_group, tracer, memory_report
 import html  
 from dotenv import load_dotenv
 import time
 import asyncio
+import logging
+from contextlib import asynccontextmanager
 
 
 load_dotenv()
 
+setup_logging("backend")
+logger = logging.getLogger("backend")
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-bot = Bot(BOT_TOKEN)
 
 CHANNEL_ID = "@ekzoskidki" 
 TELEGRAM_PROVIDER_TOKEN=os.getenv("TELEGRAM_PROVIDER_TOKEN")
 PENDING_MESSAGES: dict[str, dict] = {}
 YK_PENDING: dict[str, dict] = {}
 PROCESSED_PAYMENTS: dict[str, dict] = {} 
+# order_id -> (ts, snapshot_token): в metadata YooKassa длинный токен не помещается
+PARSE_SNAPSHOTS: dict[str, tuple[float, str]] = {}
+
+_bot = None
+_yookassa_client: httpx.AsyncClient | None = None
+
+
+def get_bot():
+    """Bot создаётся при первом обращении: импорт telegram не нужен, пока никому не пишем."""
+    global _bot
+    if _bot is None:
+        from telegram import Bot
+        _bot = Bot(token=BOT_TOKEN)
+    return _bot
+
+
+def get_yookassa_client() -> httpx.AsyncClient:
+    """Общий клиент к YooKassa: соединение с TLS переиспользуется между платежами."""
+    global _yookassa_client
+    if _yookassa_client is None:
+        _yookassa_client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+        )
+    return _yookassa_client
 
-bot = Bot(token=BOT_TOKEN)
 
-app = FastAPI() 
+# Ответы через json_dumps: в профиле RUNTIME_PROFILE=fast — orjson
+app = FastAPI(default_response_class=FastJSONResponse)
 
+# Запускается в start_background(), внутри работающего event loop
 scheduler = AsyncIOScheduler()
-scheduler.start()
+
+
+_background_started = False
+_background_lock = asyncio.Lock()
+
+
+async def start_background():
+    """
+    Всё, кроме HTTP: таблицы, индекс слотов, очередь парсинга, подписки, задачи планировщика и прогрев.
+    Вызывают startup_event и DirectBackendClient.setup() — при BACKEND_TRANSPORT=direct хуки FastAPI
+    не срабатывают. Повторный вызов ничего не делает.
+    """
+    global _background_started
+    async with _background_lock:
+        if _background_started:
+            return
+        await _start_background()
+        _background_started = True
+
+
+async def stop_background():
+    """Обратное к start_background(): для shutdown_event и DirectBackendClient.close()."""
+    global _background_started
+    async with _background_lock:
+        if not _background_started:
+            return
+        _background_started = False
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await watchlist.stop()
+        await parse_queue.close()
+
+# 🧵 Очередь парсинга: в процессе API или в отдельных воркерах (PARSE_BACKEND)
+parse_queue = create_parse_queue()
+
+# 🚦 Допуск к парсингу: общий лимит, короткая очередь и лимит на пользователя
+parse_admission = AdmissionController("parse")
+
+# 🩺 Задержка event loop API и стеки того, кто его держит
+loop_monitor = LoopMonitor("backend")
+
+# 🗓 Индекс слотов публикации канала (пересобирается из БД при старте)
+slot_allocator = SlotAllocator(CHANNEL_ID, posts_per_hour=int(os.getenv("POSTS_PER_HOUR", "4")))
+
+# 🧠 Глобальные словари и кэши процесса — для /api/admin/memory
+track("PENDING_MESSAGES", PENDING_MESSAGES)
+track("YK_PENDING", YK_PENDING)
+track("PROCESSED_PAYMENTS", PROCESSED_PAYMENTS)
+track("PARSE_SNAPSHOTS", PARSE_SNAPSHOTS)
+track("user_cache", user_cache)
+track("price_history", price_history)
+track("slot_allocator", slot_allocator)
+track("profiler.buffer", profiler.buffer)
+track("loop_monitor.stalls", loop_monitor.stalls)
+track_group(parser_caches)
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,6 +150,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # шаблон пути, а не сам путь — иначе /api/users/{tg_id} размножит серии
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_LATENCY.labels(request.method, path).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(request.method, path, status).inc()
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    # без X-Profile/__profile от админа и без сэмплирования — обычный запрос, профилировщик не включается
+    reason = profiler.trigger(request, _is_admin)
+    if reason is None:
+        return await call_next(request)
+    with profiler.profile(request.method, request.url.path, reason) as prof:
+        response = await call_next(request)
+        prof.status = response.status_code
+    response.headers["X-Profile-Id"] = prof.id
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@asynccontextmanager
+async def _db_hold(op: str):
+    with timed(DB_LATENCY, op):
+        yield
+
+def _is_admin(request: Request) -> bool:
+    """Админские эндпоинты закрыты, пока не задан ADMIN_API_TOKEN; токен передаётся в X-Admin-Token."""
+    token = os.getenv("ADMIN_API_TOKEN")
+    provided = request.headers.get("X-Admin-Token") or ""
+    return bool(token) and hmac.compare_digest(provided.encode(), token.encode())
+
+# Адреса своих прокси (nginx и т.п.): только от них принимаем X-Forwarded-For
+TRUSTED_PROXIES = {ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(",") if ip.strip()}
+
+def _client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    if peer not in TRUSTED_PROXIES:
+        return peer
+    # справа налево: последний адрес, добавленный не нашим прокси, подделать клиент не может
+    forwarded = [ip.strip() for ip in request.headers.get("X-Forwarded-For", "").split(",") if ip.strip()]
+    for ip in reversed(forwarded):
+        if ip not in TRUSTED_PROXIES:
+            return ip
+    return peer
+
+def _client_key(request: Request, tg_id=None, init_data: str = None) -> str:
+    """
+    Ключ для лимитов на пользователя: id из подписанного initData мини-приложения
+    (поле init_data или заголовок X-Telegram-Init-Data). Голый tg_id ничем не подтверждён —
+    его учитываем только от своих сервисов (X-Admin-Token); без подписи считаем по IP.
+    """
+    user_id = verify_init_data(init_data or request.headers.get("X-Telegram-Init-Data"), BOT_TOKEN)
+    if user_id:
+        return f"tg:{user_id}"
+    if tg_id and _is_admin(request):
+        return f"tg:{tg_id}"
+    return f"ip:{_client_ip(request)}"
+
+def _rejected_response(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=e.status,
+        content={"success": False, "error": e.reason, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 def _sanitize_meta_field(value: any, max_len: int = 128) -> str:
     if value is None:
         return ""
@@ -59,8 +237,204 @@ def _sanitize_meta_field(value: any, max_len: int = 128) -> str:
 
 @app.on_event("startup")
 async def startup_event():
+    logger.info(f"⚙️ Runtime: {describe_runtime()}")
+    loop_monitor.start()
+    await start_background()
+
+
+async def _start_background():
     from database.db import test_connection
     await test_connection()
+    async with AsyncSessionLocal() as session:
+        await ensure_raw_store(session)
+        await ensure_archive_table(session)
+        await ensure_price_history(session)
+        await ensure_watchlist_table(session)
+        await watchlist.load(session)
+    await rebuild_slot_index()
+    watchlist.start()
+    # этот процесс сбрасывает историю цен в БД — значит, и копит её только он
+    price_history.recording = True
+
+    # ♻️ Досчитанные в фоне парсинги дописываем в ещё не опубликованные товары
+    await parse_queue.start()
+    await parse_queue.add_backfill_listener(backfill_product_rows)
+
+    # 🗄 Перенос старых опубликованных постов в архив
+    scheduler.add_job(
+        run_archival,
+        trigger="interval",
+        hours=int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24")),
+        id="archive_posted_products",
+        replace_existing=True,
+        next_run_time=datetime.now() + timedelta(minutes=5),
+    )
+
+    # 📈 Накопленную в памяти историю цен сбрасываем в БД пачками
+    scheduler.add_job(
+        save_price_history,
+        trigger="interval",
+        seconds=int(os.getenv("PRICE_HISTORY_FLUSH_SECONDS", "60")),
+        id="flush_price_history",
+        replace_existing=True,
+    )
+    # задачи публикаций, добавленные до старта, планировщик подхватит здесь же
+    if not scheduler.running:
+        scheduler.start()
+
+    # 🔥 Соединения, за которые иначе заплатил бы первый запрос; до конца прогрева /readyz отвечает 503
+    targets = {
+        "db_pool": lambda: warm_db(AsyncSessionLocal, text("SELECT 1")),
+        "wb": _warm_parser,
+    }
+    if os.getenv("YOOKASSA_SHOP_ID"):
+        targets["yookassa"] = _warm_yookassa
+    if BOT_TOKEN:
+        targets["telegram"] = _warm_telegram
+    start_prewarm(targets, required=("db_pool",))
+
+
+async def _warm_parser():
+    parser = await get_parser()
+    await parser.prewarm()
+
+
+async def _warm_yookassa():
+    # любой ответ, хоть 401, значит, что DNS и TLS уже позади и соединение лежит в пуле
+    await get_yookassa_client().head("https://api.yookassa.ru/v3/")
+
+
+async def _warm_telegram():
+    await get_bot().get_me()
+
+
+@app.get("/readyz")
+async def readyz():
+    """Готовность к трафику: 200 после прогрева пула БД и внешних соединений, до этого 503."""
+    return JSONResponse(content=readiness.stats(), status_code=200 if readiness.ready else 503)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_background()
+    await loop_monitor.stop()
+    if _yookassa_client is not None:
+        await _yookassa_client.aclose()
+
+
+async def _watchlist_fetch(articuls: list[str]) -> dict:
+    parser = await get_parser()
+    return await parser.fetch_details_batch(articuls)
+
+
+async def notify_watchers(tg_ids: list[int], articul: int, event: str, old, new):
+    """Сообщает подписчикам об изменении отслеживаемого товара."""
+    url = f"https://www.wildberries.ru/catalog/{articul}/detail.aspx"
+    if event == "price_drop":
+        text = f"📉 Цена снизилась: {old:g} ₽ → {new:g} ₽\n{url}"
+    else:
+        text = f"📦 Товар снова в наличии ({new} шт.)\n{url}"
+    for tg_id in tg_ids:
+        try:
+            with timed(TELEGRAM_LATENCY, "send_message"):
+                await get_bot().send_message(chat_id=tg_id, text=text)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось уведомить {tg_id} об артикуле {articul}: {e}")
+        # лимит Telegram — около 30 сообщений в секунду на бота
+        await asyncio.sleep(0.05)
+
+
+# 👀 Отслеживание цен и наличия по подпискам пользователей
+watchlist = WatchlistEngine(_watchlist_fetch, notify_watchers)
+track("watchlist", watchlist)
+
+registry.gauge("parse_in_flight", "Парсинги в работе", lambda: parse_admission.in_flight)
+registry.gauge("parse_queue_depth", "Парсинги в очереди допуска", lambda: parse_admission.waiting)
+registry.gauge("parse_rejected", "Отказы в допуске к парсингу", lambda: [
+    ((reason,), count) for reason, count in parse_admission.counters.items() if reason.startswith("rejected")
+], ("reason",))
+registry.gauge("watchlist_items", "Отслеживаемые артикулы", lambda: len(watchlist))
+registry.gauge("scheduled_slots", "Запланированные посты в индексе слотов", lambda: len(slot_allocator))
+
+
+async def save_price_history():
+    async with AsyncSessionLocal() as session:
+        saved = await flush_price_history(session)
+    if saved:
+        logger.info(f"📈 История цен: сохранено {saved} артикулов")
+
+
+async def rebuild_slot_index():
+    """Загружает в индекс слотов ещё не опубликованные посты."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Product.scheduled_date).where(
+                Product.status == ProductStatus.pending,
+                Product.scheduled_date >= datetime.now(),
+            )
+        )
+        slot_allocator.load(result.scalars().all())
+    logger.info(f"🗓 Индекс слотов {slot_allocator.channel_id}: {len(slot_allocator)} постов")
+
+
+@app.get("/api/slots")
+async def get_free_slots(
+    start: str = Query(None, description="Не раньше этого момента (ISO), по умолчанию — сейчас"),
+    count: int = Query(10, ge=1, le=100),
+):
+    """Ближайшие свободные слоты публикации с учётом POSTS_PER_HOUR."""
+    start_dt = normalize_datetime(start) if start else None
+    slots = slot_allocator.suggest(start_dt, count)
+    return {
+        "success": True,
+        "channel_id": slot_allocator.channel_id,
+        "posts_per_hour": slot_allocator.posts_per_hour,
+        "slots": [dt.isoformat() for dt in slots],
+    }
+
+
+async def backfill_product_rows(articul: str, parsed: dict):
+    """Заполняет пустые поля pending-товаров с этим артикулом поздним результатом парсинга."""
+    images = parsed.get("images") or None
+    fields = {
+        "image_url": images[0] if images else None,
+        "images": images,
+        "description": parsed.get("description"),
+        "brand": parsed.get("brand"),
+        "seller": parsed.get("seller"),
+        "rating": parsed.get("rating"),
+        "feedbacks": parsed.get("feedbacks"),
+        "basic_price": parsed.get("basic_price"),
+        "discount": parsed.get("discount"),
+        "stocks": parsed.get("stocks"),
+        "stocks_by_size": parsed.get("stocks_by_size"),
+    }
+    values = {
+        name: func.coalesce(getattr(Product, name), value)
+        for name, value in fields.items()
+        if value is not None
+    }
+    if not values:
+        return
+
+    with timed(DB_LATENCY, "backfill"):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Product)
+                .where(Product.wb_id == int(articul), Product.status == ProductStatus.pending)
+                .values(**values)
+            )
+            await session.commit()
+    if result.rowcount:
+        logger.info(f"♻️ Досчитанный парсинг {articul} дописан в {result.rowcount} товар(ов)")
+
+
+def _take_slot(scheduled_dt: datetime, auto_slot: bool) -> datetime:
+    """Резервирует время поста в индексе; при auto_slot подбирает ближайший свободный слот."""
+    if auto_slot:
+        return slot_allocator.allocate(max(scheduled_dt, datetime.now()))
+    slot_allocator.reserve(scheduled_dt)
+    return scheduled_dt
 
 
 @app.post("/api/payments/create")
@@ -97,7 +471,16 @@ async def create_payment(request: Request):
         "category": _sanitize_meta_field(meta.get("category", ""), 64),
     }
 
-    print("🧾 SAFE META:", safe_meta)
+    logger.debug("🧾 SAFE META: %s", safe_meta)
+
+    # 📦 Снимок парсинга держим у себя до колбэка оплаты
+    now_ts = time.time()
+    for key, (ts, _) in list(PARSE_SNAPSHOTS.items()):
+        if now_ts - ts > SNAPSHOT_MAX_AGE:
+            PARSE_SNAPSHOTS.pop(key, None)
+    snapshot_token = meta.get("snapshot_token")
+    if snapshot_token and verify_snapshot(snapshot_token):
+        PARSE_SNAPSHOTS[order_id] = (now_ts, snapshot_token)
 
     # ⚙️ Создаём платёж в YooKassa (тест или боевой режим)
     yookassa_secret = os.getenv("YOOKASSA_SECRET_KEY")
@@ -109,10 +492,10 @@ async def create_payment(request: Request):
     yookassa_payment = {}
     
     if not yookassa_secret or not yookassa_account:
-        print("⚠️ Не удалось получить ключи YooKassa")
+        logger.warning("⚠️ Не удалось получить ключи YooKassa")
     else:
-        async with httpx.AsyncClient() as client:
-            yookassa_payment = await client.post(
+        with timed(YOOKASSA_LATENCY, "create_payment"):
+            yookassa_payment = await get_yookassa_client().post(
                 "https://api.yookassa.ru/v3/payments",
                 auth=(yookassa_account, yookassa_secret),
                 headers={"Idempotence-Key": order_id},
@@ -182,12 +565,13 @@ async def publish_product(product_id: int, max_retries: int = 3):
 
     for attempt in range(max_retries):
         try:
-            async with AsyncSessionLocal() as session:
+            # сессия держится и на время отправки в Telegram — это и меряем
+            async with AsyncSessionLocal() as session, _db_hold("publish"):
                 result = await session.execute(select(Product).where(Product.id == product_id))
                 product = result.scalar_one_or_none()
 
                 if not product:
-                    print(f"❌ Товар с id={product_id} не найден")
+                    logger.error(f"❌ Товар с id={product_id} не найден")
                     return
 
                 # 🧮 Извлекаем данные
@@ -214,43 +598,50 @@ async def publish_product(product_id: int, max_retries: int = 3):
                 # 📨 Отправляем пост
                 try:
                     if product.image_url:
-                        await bot.send_photo(
-                            chat_id=CHANNEL_ID,
-                            photo=product.image_url,
-                            caption=caption[:1024],
-                            parse_mode="HTML",
-                            has_spoiler=is_adult  # 👈 вот тут магия
-                        )
+                        with timed(TELEGRAM_LATENCY, "send_photo"):
+                            await get_bot().send_photo(
+                                chat_id=CHANNEL_ID,
+                                photo=product.image_url,
+                                caption=caption[:1024],
+                                parse_mode="HTML",
+                                has_spoiler=is_adult  # 👈 вот тут магия
+                            )
                     else:
-                        await bot.send_message(
-                            chat_id=CHANNEL_ID,
-                            text=caption[:1024],
-                            parse_mode="HTML",
-                        )
-
-                    print(f"✅ Сообщение о товаре {product.id} отправлено в Telegram")
+                        with timed(TELEGRAM_LATENCY, "send_message"):
+                            await get_bot().send_message(
+                                chat_id=CHANNEL_ID,
+                                text=caption[:1024],
+                                parse_mode="HTML",
+                            )
+
+                    logger.info(f"✅ Сообщение о товаре {product.id} отправлено в Telegram")
+                    POSTS.labels("published").inc()
                 except Exception as tg_err:
-                    print(f"⚠️ Ошибка Telegram API при публикации {product_id}: {tg_err}")
+                    POSTS.labels("failed").inc()
+                    logger.warning(f"⚠️ Ошибка Telegram API при публикации {product_id}: {tg_err}")
 
                 # 🧾 Обновляем статус
                 product.status = "posted"
                 await session.commit()
+                slot_allocator.release(product.scheduled_date)
 
-                print(f"✅ Товар опубликован: {product.name}")
+                logger.info(f"✅ Товар опубликован: {product.name}")
                 return
 
         except (OperationalError, InterfaceError) as db_err:
-            print(f"⚠️ Ошибка соединения с БД при публикации {product_id}: {db_err}")
+            logger.warning(f"⚠️ Ошибка соединения с БД при публикации {product_id}: {db_err}")
             if attempt < max_retries - 1:
+                RETRIES.labels("publish_db").inc()
                 await asyncio.sleep(3)
-                print(f"🔁 Повтор попытки ({attempt + 2}/{max_retries})...")
+                logger.info(f"🔁 Повтор попытки ({attempt + 2}/{max_retries})...")
                 continue
             else:
-                print(f"❌ Не удалось подключиться к БД после {max_retries} попыток")
+                POSTS.labels("failed").inc()
+                logger.error(f"❌ Не удалось подключиться к БД после {max_retries} попыток")
                 return
 
         except Exception as e:
-            print(f"❌ Неожиданная ошибка при публикации {product_id}: {e}")
+            logger.error(f"❌ Неожиданная ошибка при публикации {product_id}: {e}")
             return
 
        
@@ -261,142 +652,323 @@ async def parse_product(request: Request):
     """
     data = await request.json()
     url = data.get("url")
+    deadline_ms = data.get("deadline_ms") or os.getenv("PARSE_DEADLINE_MS")
 
     if not url:
         return {"success": False, "error": "Не передан url"}
 
-    print(f"📩 Запрос на парсинг товара: {url}")
-
-    # 🧩 Парсим карточку товара
-    product_data = await parse_wb_product_api(url)
+    try:
+        async with parse_admission.admit(_client_key(request, data.get("tg_id") or data.get("user_id"), data.get("init_data"))):
+            # готовый FastJSONResponse: FastAPI не гоняет большой результат (картинки, характеристики) через jsonable_encoder
+            return FastJSONResponse(content=await _parse_product(url, deadline_ms))
+    except AdmissionRejected as e:
+        logger.info(f"🚦 Парсинг отклонён ({e.status}): {url}", extra={"sample": LOG_SAMPLE_EVERY})
+        return _rejected_response(e)
+
+async def _parse_product(url: str, deadline_ms) -> dict:
+    logger.info(f"📩 Запрос на парсинг товара: {url}", extra={"sample": LOG_SAMPLE_EVERY})
+
+    # 🧩 Парсим карточку товара (с дедлайном — частичный результат, остальное досчитается в фоне)
+    deadline = float(deadline_ms) / 1000 if deadline_ms else None
+    product_data = await parse_queue.submit(url, deadline=deadline)
+    if product_data and product_data.get("partial") and not product_data.get("success"):
+        return product_data
     if not product_data or not product_data.get("success"):
-        print(f"⚠️ Не удалось распарсить товар: {url}")
+        logger.warning(f"⚠️ Не удалось распарсить товар: {url}")
         return {"success": False, "error": "Не удалось получить данные с Wildberries"}
 
-    print(f"✅ Товар успешно распарсен: {product_data.get('name')}")
+    logger.info(f"✅ Товар успешно распарсен: {product_data.get('name')}", extra={"sample": LOG_SAMPLE_EVERY})
+    # подписанный снимок: /api/products/add сможет не парсить товар повторно (для partial его нет — там перепарсим)
+    snapshot_token = sign_snapshot(product_data)
+    if snapshot_token:
+        product_data["snapshot_token"] = snapshot_token
     return product_data
 
+@app.get("/api/products/parse/stream")
+async def parse_product_stream(
+    request: Request,
+    url: str = Query(..., description="Ссылка на товар WB"),
+    tg_id: str = Query(None),
+    init_data: str = Query(None, description="Telegram.WebApp.initData — EventSource не умеет заголовки"),
+):
+    """
+    SSE-вариант /api/products/parse: события articul, card, price, stocks, images приходят по мере готовности,
+    последним — done (полный результат + snapshot_token) или error.
+    """
+    key = _client_key(request, tg_id, init_data)
+    try:
+        # очевидный отказ отдаём обычным 429/503 с Retry-After; сам слот занимает генератор
+        parse_admission.check(key)
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+    parser = await get_parser()
+
+    async def events():
+        # слот берём и отдаём внутри генератора: если тело так и не начали читать
+        # (клиент ушёл раньше, ответ упал до стрима), занимать и освобождать нечего
+        try:
+            await parse_admission.acquire(key)
+        except AdmissionRejected as e:
+            error = {"success": False, "error": e.reason, "retry_after": e.retry_after}
+            yield b"event: error\ndata: " + json_dumps(error) + b"\n\n"
+            return
+        started = time.monotonic()
+        try:
+            async for stage, data in parser.iter_parse_stages(url):
+                if stage == "done" and not data.get("partial"):
+                    data["snapshot_token"] = sign_snapshot(data)
+                yield b"event: " + stage.encode() + b"\ndata: " + json_dumps(data) + b"\n\n"
+        finally:
+            parse_admission.release(key, time.monotonic() - started)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/api/products/add")
 async def add_product(request: Request):
     data = await request.json()
+    return await add_product_service(data)
+
+async def add_product_service(data: dict) -> dict:
+    """Добавление товара в очередь; используется и эндпоинтом, и прямым вызовом из бота."""
     tg_id = data.get("user_id")
     url = data.get("url")
-    name = data.get("name")
-    description = data.get("description")
-    image_url = data.get("image_url")
-    price = data.get("price")
-    scheduled_date = data.get("scheduled_date")
-    category = data.get("category")
-    
-    print(f"📩 Запрос на добавление товара: {data}")
 
-    if not all([tg_id, url, name, scheduled_date]):
-        return {"success": False, "error": "Отсутствуют обязательные поля"}
+    logger.info(f"📩 Запрос на добавление товара: user={tg_id} url={url} date={data.get('scheduled_date')}")
 
-    async for session in get_session():
-        # Проверяем пользователя
-        result = await session.execute(select(User).where(User.tg_id == str(tg_id)))
-        user = result.scalar_one_or_none()
-        if not user:
-            return {"success": False, "error": "Пользователь не найден"}
-
-        # Проверяем и парсим дату
-        scheduled_dt = normalize_datetime(scheduled_date)
-        if not scheduled_dt:
-            return {"success": False, "error": "Некорректная дата (невозможно обработать)"}
-
-
-        # 🧩 Парсим товар
-        parsed = await parse_wb_product_api(url)
-        if not parsed or not parsed.get("success"):
-            parsed = {}
-            print(f"⚠️ Не удалось распарсить товар: {url}")
-        else:
-            print(f"✅ Товар распарсен: {parsed.get('name')}")
-
-        # 🖼 Основное изображение
-        main_image = image_url or (parsed.get("images") or [None])[0]
-
-        # 🏷 Категория (приоритет: фронт → парсер → запасное значение)
-        categoryTry = data.get("category") 
-        final_category = (
-            category
-            or parsed.get("category")
-            or parsed.get("subcategory")
-            or parsed.get("subject_name")
-            or "Не указана"
-        )
-        print(f"📦 CATEGORY SELECTED: {categoryTry}")
-
-        # 🧱 Создаём товар
-        product = Product(
-            user_id=str(tg_id),
-            url=url,
-            name=name or parsed.get("name"),
-            description=description or parsed.get("description"),
-            image_url=main_image,
-            price=float(price) if price else (parsed.get("price") or 0.0),
-
-            wb_id=int(parsed.get("id") or parsed.get("articul")) if parsed.get("id") or parsed.get("articul") else None,
-            brand=parsed.get("brand"),
-            seller=parsed.get("seller"),
-            rating=float(parsed.get("rating")) if parsed.get("rating") is not None else None,
-            feedbacks=int(parsed.get("feedbacks")) if parsed.get("feedbacks") is not None else None,
-            basic_price=float(parsed.get("basic_price")) if parsed.get("basic_price") is not None else None,
-            discount=int(parsed.get("discount")) if parsed.get("discount") is not None else None,
-            stocks=int(parsed.get("stocks")) if parsed.get("stocks") is not None else None,
-            stocks_by_size=parsed.get("stocks_by_size"),
-            images=parsed.get("images"),
-            info={"parsed_raw": parsed},
-            status=ProductStatus.pending,
-            category=final_category,  # ✅ теперь переменная определена
-            scheduled_date=scheduled_dt,
-        )
+    # из формы название приходит всегда — как и раньше, без него не добавляем
+    if not data.get("name"):
+        return {"success": False, "error": "Отсутствуют обязательные поля"}
 
-        # 💾 Сохраняем в БД
-        session.add(product)
-        await session.commit()
-        await session.refresh(product)
+    result = await ingest_product(
+        tg_id=tg_id,
+        url=url,
+        name=data.get("name"),
+        description=data.get("description"),
+        image_url=data.get("image_url"),
+        price=data.get("price"),
+        scheduled_date=data.get("scheduled_date"),
+        category=data.get("category"),
+        snapshot_token=data.get("snapshot_token"),
+        auto_slot=bool(data.get("auto_slot")),
+    )
+    if not result.get("success"):
+        return result
 
-        print(f"✅ Товар сохранён (ID={product.id}, Категория={product.category})")
+    return {
+        "success": True,
+        "message": "Товар добавлен в очередь на выкладку",
+        "product_id": result["product_id"],
+        "category": result["category"],
+        "scheduled_date": result["scheduled_date"],
+        "timings": result["timings"],
+    }
 
-        # ⏰ Планируем публикацию
-        print(f"🕒 Серверное время сейчас: {datetime.now()}")
-        print(f"🕒 scheduled_dt (для job): {scheduled_dt}")
 
-        try:
+def _build_product_values(
+    *,
+    tg_id,
+    url: str,
+    name: str,
+    description: str,
+    image_url: str,
+    price,
+    category: str,
+    scheduled_dt: datetime,
+    parsed: dict,
+    raw=None,
+) -> dict:
+    """
+    Собирает поля строки Product из данных запроса и результата парсинга (приоритет у запроса).
+    Сырой снимок парсинга в строку не кладём — только ссылку raw (см. raw_store).
+    """
+    # 🖼 Основное изображение
+    main_image = image_url or (parsed.get("images") or [None])[0] or parsed.get("image") or None
+
+    # 🏷 Категория (приоритет: фронт → парсер → запасное значение)
+    final_category = (
+        category
+        or parsed.get("category")
+        or parsed.get("subcategory")
+        or parsed.get("subject_name")
+        or "Не указана"
+    )
+
+    return dict(
+        user_id=str(tg_id),
+        url=url,
+        name=name or parsed.get("name"),
+        description=description or parsed.get("description"),
+        image_url=main_image,
+        price=float(price) if price is not None and price != "" else (parsed.get("price") or 0.0),
+
+        wb_id=int(parsed.get("id") or parsed.get("articul")) if parsed.get("id") or parsed.get("articul") else None,
+        brand=parsed.get("brand"),
+        seller=parsed.get("seller"),
+        rating=float(parsed.get("rating")) if parsed.get("rating") is not None else None,
+        feedbacks=int(parsed.get("feedbacks")) if parsed.get("feedbacks") is not None else None,
+        basic_price=float(parsed.get("basic_price")) if parsed.get("basic_price") is not None else None,
+        discount=int(parsed.get("discount")) if parsed.get("discount") is not None else None,
+        stocks=int(parsed.get("stocks")) if parsed.get("stocks") is not None else None,
+        stocks_by_size=parsed.get("stocks_by_size"),
+        images=parsed.get("images"),
+        info=raw_ref(raw),
+        status=ProductStatus.pending,
+        category=final_category,
+        scheduled_date=scheduled_dt,
+    )
+
+
+def _schedule_publication(product_id: int, scheduled_dt: datetime):
+    try:
+        with span("scheduler", "add_job"):
             scheduler.add_job(
                 publish_product,
                 trigger=DateTrigger(run_date=scheduled_dt),
-                args=[product.id],
-                id=f"publish_{product.id}",
+                args=[product_id],
+                id=f"publish_{product_id}",
                 replace_existing=True,  # 👈 чтобы не падало, если такая задача уже есть
                 misfire_grace_time=300,
             )
-            print(f"🗓 Задача добавлена: publish_{product.id}")
-        except Exception as e:
-            print(f"⚠️ Не удалось добавить задачу publish_{product.id}: {e}")
+        POSTS.labels("scheduled").inc()
+        logger.info(f"🗓 Задача publish_{product_id} запланирована на {scheduled_dt}")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось добавить задачу publish_{product_id}: {e}")
 
 
-        print(f"🗓 Публикация запланирована на {scheduled_dt}")
+async def _resolve_user(tg_id):
+    """Пользователь из кэша; сессия открывается только при промахе."""
+    user = user_cache.get(tg_id)
+    if user is None:
+        async with AsyncSessionLocal() as session:
+            user = await get_user_cached(session, tg_id)
+    return user
+
+
+async def _parse_for_ingest(url: str, snapshot_token: str = None) -> tuple[dict, bool]:
+    """Возвращает (parsed, from_snapshot); при неудаче парсинга — пустой dict."""
+    parsed = verify_snapshot(snapshot_token, articul=WBParser.extract_articul(url))
+    if snapshot_token:
+        cache_result("parse_snapshot", parsed is not None)
+    if parsed is not None:
+        return parsed, True
+
+    parsed = await parse_queue.submit(url)
+    if not parsed or not parsed.get("success"):
+        logger.warning(f"⚠️ Не удалось распарсить товар: {url}")
+        return {}, False
+    return parsed, False
+
+
+async def ingest_product(
+    *,
+    tg_id,
+    url: str,
+    name: str,
+    scheduled_date,
+    description: str = None,
+    image_url: str = None,
+    price=None,
+    category: str = None,
+    snapshot_token: str = None,
+    auto_slot: bool = False,
+) -> dict:
+    """
+    Единый конвейер добавления товара для /api/products/add и оплаты через YooKassa:
+    1) валидация и поиск пользователя (кэш, короткая сессия только при промахе);
+    2) парсинг WB без открытого соединения с БД (или свежий подписанный снимок из /api/products/parse);
+    3) короткая транзакция на вставку и планирование публикации.
+    scheduled_date="auto" или auto_slot=True — время берётся из индекса свободных слотов.
+    Возвращает timings с временем парсинга и временем удержания соединения из пула.
+    """
+    # name не обязателен: в колбэке оплаты он может прийти пустым после очистки metadata — берём из парсинга
+    if not all([tg_id, url, scheduled_date]):
+        return {"success": False, "error": "Отсутствуют обязательные поля"}
+
+    # Проверяем и парсим дату
+    if scheduled_date == "auto":
+        auto_slot = True
+        scheduled_dt = datetime.now()
+    else:
+        scheduled_dt = normalize_datetime(scheduled_date)
+    if not scheduled_dt:
+        logger.error(f"❌ Некорректная дата: {scheduled_date}")
+        return {"success": False, "error": "Некорректная дата (невозможно обработать)"}
+
+    # Проверяем пользователя
+    user = await _resolve_user(tg_id)
+    if not user:
+        logger.error(f"❌ Пользователь {tg_id} не найден при добавлении товара")
+        return {"success": False, "error": "Пользователь не найден"}
+
+    # 🧩 Парсим товар — соединение с БД в этот момент не занято
+    parse_started = time.perf_counter()
+    with span("parse", "ingest"):
+        parsed, from_snapshot = await _parse_for_ingest(url, snapshot_token)
+    parse_ms = (time.perf_counter() - parse_started) * 1000
+
+    scheduled_dt = _take_slot(scheduled_dt, auto_slot)
+    raw = pack_raw(parsed)
+    values = _build_product_values(
+        tg_id=user.tg_id,
+        url=url,
+        name=name,
+        description=description,
+        image_url=image_url,
+        price=price,
+        category=category,
+        scheduled_dt=scheduled_dt,
+        parsed=parsed,
+        raw=raw,
+    )
+
+    # 💾 Короткая транзакция: вставка и коммит
+    hold_started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as session:
+            await save_raw_snapshots(session, [raw])
+            product = Product(**values)
+            session.add(product)
+            await session.flush()
+            product_id, product_category = product.id, product.category
+            await session.commit()
+    except Exception:
+        slot_allocator.release(scheduled_dt)
+        raise
+    db_hold_ms = (time.perf_counter() - hold_started) * 1000
+    observe(DB_LATENCY, ("ingest",), db_hold_ms / 1000, hold_started)
+
+    # ⏰ Планируем публикацию
+    _schedule_publication(product_id, scheduled_dt)
+
+    logger.info(
+        f"✅ Товар сохранён (ID={product_id}, Категория={product_category}) "
+        f"⏱ parse={parse_ms:.0f}ms db_hold={db_hold_ms:.1f}ms"
+    )
+    return {
+        "success": True,
+        "product_id": product_id,
+        "category": product_category,
+        "scheduled_date": scheduled_dt.isoformat(),
+        "timings": {"parse_ms": round(parse_ms, 1), "db_hold_ms": round(db_hold_ms, 1), "from_snapshot": from_snapshot},
+    }
 
-        return {
-            "success": True,
-            "message": "Товар добавлен в очередь на выкладку",
-            "product_id": product.id,
-            "category": product.category,
-        }
 
 @app.post("/api/users/register")
 async def register_user(request: Request):
     data = await request.json()
-    tg_id = data.get("tg_id")
-    name = data.get("name")
-    phone = data.get("phone")
+    return await register_user_service(data.get("tg_id"), data.get("name"), data.get("phone"))
 
+async def register_user_service(tg_id, name, phone) -> dict:
     if not tg_id or not phone:
         return {"success": False, "error": "Не переданы tg_id или телефон"}
 
+    # регистрация меняет запись — сбрасываем кэш до и после
+    user_cache.invalidate(tg_id)
+
     async for session in get_session():
         # Проверяем, существует ли уже пользователь
         result = await session.execute(select(User).where(User.tg_id == str(tg_id)))
@@ -408,32 +980,98 @@ async def register_user(request: Request):
             session.add(user)
             await session.commit()
             await session.refresh(user)
-            print(f"✅ Новый пользователь зарегистрирован: {user.name} ({user.phone})")
+            logger.info(f"✅ Новый пользователь зарегистрирован: {user.name} ({user.phone})")
         else:
-            print(f"ℹ️ Пользователь уже есть: {user.name} ({user.phone})")
+            logger.info(f"ℹ️ Пользователь уже есть: {user.name} ({user.phone})")
 
+        user_cache.invalidate(tg_id)
         return {"success": True, "user_id": user.id}
     
     
 @app.get("/api/users/{tg_id}")
 async def check_user_exists(tg_id: str, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(User).where(User.tg_id == tg_id))
-    user = result.scalar_one_or_none()
-    return {"exists": user is not None}
+    return {"exists": await user_exists(session, tg_id)}
+
+async def user_exists(session: AsyncSession, tg_id: str) -> bool:
+    return await get_user_cached(session, tg_id) is not None
+
+@app.get("/api/products/raw/{product_id}")
+async def get_product_raw(product_id: int, session: AsyncSession = Depends(get_session)):
+    """Сырой снимок парсинга товара — читается из отдельной таблицы только по запросу."""
+    result = await session.execute(select(Product.info).where(Product.id == product_id))
+    info = result.scalar_one_or_none()
+    raw = await load_raw_snapshot(session, info)
+    if raw is None:
+        return {"success": False, "error": "Снимок парсинга не найден"}
+    return {"success": True, "product_id": product_id, "raw": raw}
+
+@app.get("/api/products/history/{articul}")
+async def get_price_history(
+    articul: int,
+    last: int = Query(20, ge=1, le=1000, description="Сколько последних точек вернуть"),
+    days: int = Query(None, ge=1, description="Вся история за последние N дней вместо last"),
+    session: AsyncSession = Depends(get_session),
+):
+    """История цены артикула: последние точки или период, плюс исторический минимум/максимум."""
+    series = await load_series(session, articul)
+    if series is None or not len(series):
+        return {"success": False, "error": "История цен не найдена"}
+
+    if days:
+        since = int(time.time()) - days * 86400
+        points = [bucket_to_dict(b) for b in series.points(since)]
+    else:
+        points = [bucket_to_dict(b) for b in reversed(series.last(last))]
+    return {"success": True, "articul": articul, **series.summary(), "history": points}
+
+@app.post("/api/watchlist")
+async def add_to_watchlist(request: Request):
+    """Подписка на снижение цены / появление в наличии: {tg_id, articul} или {tg_id, url}."""
+    data = await request.json()
+    tg_id = data.get("tg_id")
+    articul = data.get("articul") or WBParser.extract_articul(data.get("url") or "")
+    if not tg_id or not str(articul or "").isdigit():
+        return {"success": False, "error": "Нужны tg_id и артикул или ссылка на товар"}
+
+    async with AsyncSessionLocal() as session:
+        await save_watch(session, tg_id, articul)
+    watchlist.add(tg_id, articul)
+    return {"success": True, "articul": int(articul)}
+
+@app.delete("/api/watchlist/{tg_id}/{articul}")
+async def remove_from_watchlist(tg_id: int, articul: int):
+    async with AsyncSessionLocal() as session:
+        await delete_watch(session, tg_id, articul)
+    watchlist.remove(tg_id, articul)
+    return {"success": True}
+
+@app.get("/api/watchlist/{tg_id}")
+async def get_watchlist(tg_id: int):
+    return {"success": True, "items": watchlist.watched_by(tg_id)}
 
 @app.get("/api/products/{tg_id}")
-async def get_user_products(tg_id: str, session: AsyncSession = Depends(get_session)):
+async def get_user_products(
+    tg_id: str,
+    history: bool = Query(False, description="Добавить архивные (давно опубликованные) товары"),
+    session: AsyncSession = Depends(get_session),
+):
     """Возвращает список товаров пользователя по его Telegram ID"""
-    result = await session.execute(select(User).where(User.tg_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await get_user_cached(session, tg_id)
     if not user:
         return {"success": False, "error": "Пользователь не найден"}
 
     # ✅ теперь ищем по строковому user_id (tg_id)
-    result = await session.execute(select(Product).where(Product.user_id == user.tg_id))
-    products = result.scalars().all()
+    listing_columns = ("id", "name", "price", "url", "status", "created_at", "scheduled_date")
+    query = select(*[Product.__table__.c[c] for c in listing_columns]).where(Product.user_id == user.tg_id)
+    if history:
+        query = union_all(
+            query,
+            select(*[archived_products.c[c] for c in listing_columns]).where(archived_products.c.user_id == user.tg_id),
+        )
+    result = await session.execute(query)
+    products = result.all()
 
-    return {
+    return FastJSONResponse(content={
         "success": True,
         "tg_id": tg_id,
         "user_id": user.tg_id,  # тоже исправляем, чтобы всё было консистентно
@@ -449,7 +1087,7 @@ async def get_user_products(tg_id: str, session: AsyncSession = Depends(get_sess
             }
             for p in products
         ],
-    }
+    })
 
 @app.post("/api/payments/callback")
 async def yookassa_callback(request: Request):
@@ -460,21 +1098,21 @@ async def yookassa_callback(request: Request):
     event = payload.get("event")
     obj = payload.get("object", {})  
 
-    print("💳 YooKassa callback:", event)
-    print("💳 CALLBACK RAW:", json.dumps(payload, ensure_ascii=False))
-
     metadata = obj.get("metadata", {}) or {}
     user_id = metadata.get("user_id") or metadata.get("tg_id")
     order_id = metadata.get("order_id")
     pid = obj.get("id")
 
+    # весь payload не пишем: там платёжные данные, а json.dumps большого тела стоит времени event loop
+    logger.info(f"💳 YooKassa callback: {event} id={pid} status={obj.get('status')} order={order_id}")
+
     # Safety: если нет pid — просто ответим ok
     if not pid:
-        print("⚠️ Callback без id -> игнорируем")
+        logger.warning("⚠️ Callback без id -> игнорируем")
         return {"success": True}
     
     if pid in PROCESSED_PAYMENTS and PROCESSED_PAYMENTS[pid]["status"] == "succeeded":
-        print(f"⚠️ Payment {pid} already succeeded, ignoring cancellation")
+        logger.warning(f"⚠️ Payment {pid} already succeeded, ignoring cancellation")
         return {"success": True}
 
     # Если уже обработано — не делать лишних действий (идемпотентность)
@@ -482,12 +1120,12 @@ async def yookassa_callback(request: Request):
     if processed:
         # если уже помечено как succeeded и мы получили canceled — игнорируем cancel
         if event == "payment.canceled" and processed.get("status") == "succeeded":
-            print(f"ℹ️ Ignoring payment.canceled for {pid} because we've already processed succeeded")
+            logger.info(f"ℹ️ Ignoring payment.canceled for {pid} because we've already processed succeeded")
             return {"success": True}
         # если уже помечено как canceled и пришёл succeeded — всё ещё обрабатывать succeeded (в редких race-условиях),
         # но если уже succeeded — просто вернуть OK.
         if event in ("payment.succeeded", "payment.captured", "payment.paid") and processed.get("status") == "succeeded":
-            print(f"ℹ️ Duplicate succeeded callback for {pid} — игнорируем")
+            logger.info(f"ℹ️ Duplicate succeeded callback for {pid} — игнорируем")
             return {"success": True}
 
 
@@ -524,7 +1162,7 @@ async def yookassa_callback(request: Request):
 
     # ==== Обработка успешной оплаты ====
     if event in ("payment.succeeded", "payment.captured", "payment.paid"):
-        print(f"✅ Payment succeeded for id={pid}")
+        logger.info(f"✅ Payment succeeded for id={pid}")
         # пометим как успешно обработанный
         PROCESSED_PAYMENTS[pid] = {"status": "succeeded", "ts": time.time()}
 
@@ -542,22 +1180,24 @@ async def yookassa_callback(request: Request):
         # уведомляем пользователя
         if user_id:
             try:
-                await bot.send_message(
-                    chat_id=int(user_id),
-                    text="✅ <b>Оплата получена</b>\nТовар добавлен в очередь на выкладку.",
-                    parse_mode="HTML"
-                )
+                with timed(TELEGRAM_LATENCY, "send_message"):
+                    await get_bot().send_message(
+                        chat_id=int(user_id),
+                        text="✅ <b>Оплата получена</b>\nТовар добавлен в очередь на выкладку.",
+                        parse_mode="HTML"
+                    )
             except Exception as e:
-                print("⚠️ Не получилось уведомить пользователя:", e)
+                logger.warning("⚠️ Не получилось уведомить пользователя: %s", e)
 
         # удаляем кнопку оплаты (если есть)
         if order_id and order_id in PENDING_MESSAGES:
             info = PENDING_MESSAGES.pop(order_id, None)
             if info:
                 try:
-                    await bot.delete_message(chat_id=info["chat_id"], message_id=info["message_id"])
+                    with timed(TELEGRAM_LATENCY, "delete_message"):
+                        await get_bot().delete_message(chat_id=info["chat_id"], message_id=info["message_id"])
                 except Exception as e:
-                    print("⚠️ Ошибка удаления pending message:", e)
+                    logger.warning("⚠️ Ошибка удаления pending message: %s", e)
 
         # добавляем товар в базу асинхронно
         if metadata:
@@ -572,10 +1212,11 @@ async def yookassa_callback(request: Request):
                         price=float(metadata.get("price") or 0),
                         scheduled_date=metadata.get("scheduled_date"),
                         category=metadata.get("category"),
+                        snapshot_token=(PARSE_SNAPSHOTS.pop(order_id, None) or (None, None))[1],
                     )
                 )
             except Exception as e:
-                print("⚠️ Ошибка при планировании add_product_to_db:", e)
+                logger.warning("⚠️ Ошибка при планировании add_product_to_db: %s", e)
 
         return {"success": True}
 
@@ -591,78 +1232,150 @@ async def add_product_to_db(
     price: float,
     scheduled_date: str,
     category: str = None, 
+    snapshot_token: str = None,
 ):
-    from backend.new_parser import parse_wb_product_api  # локальный импорт
+    result = await ingest_product(
+        tg_id=user_id,
+        url=url,
+        name=name,
+        description=description,
+        image_url=image_url,
+        price=price,
+        scheduled_date=scheduled_date,
+        category=category,
+        snapshot_token=snapshot_token,
+    )
+    if not result.get("success"):
+        return result
+    return {"success": True, "product_id": result["product_id"], "timings": result["timings"]}
+
+
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "200"))
+BULK_PARSE_CONCURRENCY = int(os.getenv("BULK_PARSE_CONCURRENCY", "8"))
+
+
+@app.post("/api/products/add/bulk")
+async def add_products_bulk(request: Request):
+    """
+    Пакетное планирование: {"user_id": ..., "items": [{"url", "scheduled_date", "name"?, "description"?,
+    "image_url"?, "price"?, "category"?, "snapshot_token"?, "auto_slot"?}, ...]}.
+    scheduled_date="auto" раскладывает посты по свободным слотам канала.
+    Возвращает результат по каждому элементу в том же порядке.
+    """
+    data = await request.json()
+    return await add_products_bulk_service(data)
 
-    async for session in get_session():
-        result = await session.execute(select(User).where(User.tg_id == str(user_id)))
-        user = result.scalar_one_or_none()
-        if not user:
-            print(f"❌ Пользователь {user_id} не найден при добавлении товара в DB")
-            return {"success": False, "error": "Пользователь не найден"}
 
-        scheduled_dt = normalize_datetime(scheduled_date)
-        if not scheduled_dt:
-            print(f"❌ Некорректная дата: {scheduled_date}")
-            return {"success": False, "error": "Некорректная дата"}
+async def add_products_bulk_service(data: dict) -> dict:
+    tg_id = data.get("user_id")
+    items = data.get("items")
 
+    if not tg_id or not isinstance(items, list) or not items:
+        return {"success": False, "error": "Отсутствуют обязательные поля"}
+    if len(items) > BULK_MAX_ITEMS:
+        return {"success": False, "error": f"Не больше {BULK_MAX_ITEMS} товаров за запрос"}
 
-        # Парсим ещё раз, чтобы получить все поля (или можно принимать parsed из frontend)
-        parsed = await parse_wb_product_api(url)
-        if not parsed or not parsed.get("success"):
-            print(f"⚠️ Не удалось дополнительно распарсить товар {url}")
-            parsed = {}
+    user = await _resolve_user(tg_id)
+    if not user:
+        return {"success": False, "error": "Пользователь не найден"}
 
-        # Берём основную картинку - приоритет: image_url (переданный) -> parsed.images[0] -> parsed['images'] -> None
-        main_image = image_url or (parsed.get("images") or [None])[0] or parsed.get("image") or None
+    results: list[dict] = [{} for _ in items]
+    accepted: list[tuple[int, dict, datetime]] = []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("url") or not item.get("scheduled_date"):
+            results[idx] = {"index": idx, "success": False, "error": "Отсутствуют обязательные поля"}
+            continue
+        if item.get("scheduled_date") == "auto":
+            item = {**item, "auto_slot": True}
+            scheduled_dt = datetime.now()
+        else:
+            scheduled_dt = normalize_datetime(item.get("scheduled_date"))
+        if not scheduled_dt:
+            results[idx] = {"index": idx, "success": False, "error": "Некорректная дата (невозможно обработать)"}
+            continue
+        accepted.append((idx, item, scheduled_dt))
 
-        # Собираем extra info (оставляем копию parsed в info)
-        extra_info = {
-            "parsed_raw": parsed,  # можно убрать/сжать при желании
-        }
+    # 🧩 Парсим с ограниченной конкурентностью, без соединения с БД
+    parse_started = time.perf_counter()
+    semaphore = asyncio.Semaphore(BULK_PARSE_CONCURRENCY)
 
-        product = Product(
-            user_id=str(user.tg_id),
-            url=url,
-            name=name or parsed.get("name"),
-            description=description or parsed.get("description"),
-            image_url=main_image,
-            price=float(price) if price is not None else (parsed.get("price") or 0.0),
-
-            # Новые поля
-            wb_id=int(parsed.get("id") or parsed.get("articul")) if parsed.get("id") or parsed.get("articul") else None,
-            brand=parsed.get("brand"),
-            seller=parsed.get("seller"),
-            rating=float(parsed.get("rating")) if parsed.get("rating") is not None else None,
-            feedbacks=int(parsed.get("feedbacks")) if parsed.get("feedbacks") is not None else None,
-            basic_price=float(parsed.get("basic_price")) if parsed.get("basic_price") is not None else None,
-            discount=int(parsed.get("discount")) if parsed.get("discount") is not None else None,
-            stocks=int(parsed.get("stocks")) if parsed.get("stocks") is not None else None,
-            stocks_by_size=parsed.get("stocks_by_size"),
-            images=parsed.get("images"),
-            category=category,
-            info=extra_info,
-            status=ProductStatus.pending,
-            scheduled_date=scheduled_dt,
+    async def parse_one(item: dict) -> tuple[dict, bool]:
+        async with semaphore:
+            try:
+                return await _parse_for_ingest(item["url"], item.get("snapshot_token"))
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка парсинга {item['url']}: {e}")
+                return {}, False
+
+    parsed_list = await asyncio.gather(*(parse_one(item) for _, item, _ in accepted))
+    parse_ms = (time.perf_counter() - parse_started) * 1000
+
+    rows: list[dict] = []
+    raws: list = []
+    row_owners: list[tuple[int, datetime]] = []
+    for (idx, item, scheduled_dt), (parsed, _) in zip(accepted, parsed_list):
+        raw = pack_raw(parsed)
+        values = _build_product_values(
+            tg_id=user.tg_id,
+            url=item["url"],
+            name=item.get("name"),
+            description=item.get("description"),
+            image_url=item.get("image_url"),
+            price=item.get("price"),
+            category=item.get("category"),
+            scheduled_dt=scheduled_dt,
+            parsed=parsed,
+            raw=raw,
         )
-
-        session.add(product)
-        await session.commit()
-        await session.refresh(product)
-
-        # Планируем публикацию
+        if not values["name"]:
+            results[idx] = {"index": idx, "success": False, "error": "Не удалось получить название товара"}
+            continue
+        scheduled_dt = _take_slot(scheduled_dt, bool(item.get("auto_slot")))
+        values["scheduled_date"] = scheduled_dt
+        rows.append(values)
+        raws.append(raw)
+        row_owners.append((idx, scheduled_dt))
+
+    # 💾 Одна транзакция и один INSERT ... RETURNING на все строки
+    db_hold_ms = 0.0
+    if rows:
+        hold_started = time.perf_counter()
         try:
-            scheduler.add_job(
-                publish_product,
-                trigger=DateTrigger(run_date=scheduled_dt),
-                args=[product.id],
-                id=f"publish_{product.id}",
-            )
-        except Exception as e:
-            print(f"⚠️ Не удалось добавить задачу в scheduler: {e}")
+            async with AsyncSessionLocal() as session:
+                await save_raw_snapshots(session, raws)
+                inserted = await session.execute(
+                    insert(Product).returning(Product.id, Product.category, sort_by_parameter_order=True),
+                    rows,
+                )
+                inserted_rows = inserted.all()
+                await session.commit()
+        except Exception:
+            for _, scheduled_dt in row_owners:
+                slot_allocator.release(scheduled_dt)
+            raise
+        db_hold_ms = (time.perf_counter() - hold_started) * 1000
+        observe(DB_LATENCY, ("ingest_bulk",), db_hold_ms / 1000, hold_started)
+
+        # ⏰ Планируем публикации одним проходом
+        for (idx, scheduled_dt), (product_id, product_category) in zip(row_owners, inserted_rows):
+            _schedule_publication(product_id, scheduled_dt)
+            results[idx] = {
+                "index": idx,
+                "success": True,
+                "product_id": product_id,
+                "category": product_category,
+                "scheduled_date": scheduled_dt.isoformat(),
+            }
 
-        print(f"✅ Товар '{product.name}' сохранён и запланирован на {scheduled_dt}")
-        return {"success": True, "product_id": product.id}
+    added = sum(1 for r in results if r.get("success"))
+    logger.info(f"✅ Пакет: добавлено {added}/{len(items)} ⏱ parse={parse_ms:.0f}ms db_hold={db_hold_ms:.1f}ms")
+    return {
+        "success": added > 0,
+        "added": added,
+        "failed": len(items) - added,
+        "results": results,
+        "timings": {"parse_ms": round(parse_ms, 1), "db_hold_ms": round(db_hold_ms, 1)},
+    }
 
 
 from datetime import timedelta
@@ -675,6 +1388,7 @@ async def admin_stats(
     year: int = Query(None, description="Год (например, 2025)"),
     month: int = Query(None, description="Месяц (1-12)"),
     week: int = Query(None, description="Номер недели (1–5 внутри месяца)"),
+    include_archive: bool = Query(False, description="Учитывать архив даже для свежих периодов"),
 ):
     """
     📊 Возвращает статистику по постам:
@@ -682,70 +1396,107 @@ async def admin_stats(
     - type=month&year=2025&month=1 → за январь 2025
     - type=week&year=2025&month=1&week=2 → за вторую неделю января 2025
     - type=all → за всё время
+    Архив подключается сам, если период заходит за границу архивации.
     """
-    try:
-        tz = pytz.timezone("Europe/Moscow")
-        now = datetime.now(tz)
-
-        # 🧮 Определяем временные границы
-        if type == "day":
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = start_date + timedelta(days=1)
-
-        elif type == "month" and year and month:
-            start_date = datetime(year, month, 1, tzinfo=tz)
-            # следующий месяц минус 1 секунда
-            if month == 12:
-                end_date = datetime(year + 1, 1, 1, tzinfo=tz)
-            else:
-                end_date = datetime(year, month + 1, 1, tzinfo=tz)
+    status_code, content = await compute_admin_stats(session, type, year, month, week, include_archive)
+    return JSONResponse(content=content, status_code=status_code)
+
 
-        elif type == "week" and year and month and week:
-            month_start = datetime(year, month, 1, tzinfo=tz)
-            # считаем недельные интервалы от начала месяца
-            week_start = month_start + timedelta(days=(week - 1) * 7)
-            week_end = week_start + timedelta(days=7)
-            start_date, end_date = week_start, week_end
+def _period_bounds(type: str, year: int = None, month: int = None, week: int = None):
+    """Границы периода статистики в МСК: (start, end); (None, None) — за всё время. Ошибка параметров — ValueError."""
+    tz = pytz.timezone("Europe/Moscow")
+    now = datetime.now(tz)
 
-        elif type == "all":
-            start_date, end_date = None, None
+    # 🧮 Определяем временные границы
+    if type == "day":
+        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_date = start_date + timedelta(days=1)
 
+    elif type == "month" and year and month:
+        start_date = datetime(year, month, 1, tzinfo=tz)
+        # следующий месяц минус 1 секунда
+        if month == 12:
+            end_date = datetime(year + 1, 1, 1, tzinfo=tz)
         else:
-            return JSONResponse(
-                content={"success": False, "error": "Некорректные параметры периода"},
-                status_code=400,
-            )
+            end_date = datetime(year, month + 1, 1, tzinfo=tz)
+
+    elif type == "week" and year and month and week:
+        month_start = datetime(year, month, 1, tzinfo=tz)
+        # считаем недельные интервалы от начала месяца
+        week_start = month_start + timedelta(days=(week - 1) * 7)
+        week_end = week_start + timedelta(days=7)
+        start_date, end_date = week_start, week_end
 
-        # 🧩 Запрос к БД
-        query = select(Product)
-        if start_date and end_date:
-            query = query.where(Product.created_at >= start_date, Product.created_at < end_date)
-        elif start_date:
-            query = query.where(Product.created_at >= start_date)
+    elif type == "all":
+        start_date, end_date = None, None
 
-        result = await session.execute(query)
-        products = result.scalars().all()
+    else:
+        raise ValueError("Некорректные параметры периода")
 
-        posted = [p for p in products if str(p.status) in ("posted", "ProductStatus.posted")]
-        pending = [p for p in products if str(p.status) in ("pending", "ProductStatus.pending")]
+    return start_date, end_date
+
+
+def _reaches_archive(start_date) -> bool:
+    """Период заходит в архив, если начинается раньше границы архивации."""
+    return start_date is None or normalize_datetime(start_date) < archive_cutoff()
+
+
+def _status_counts_query(table, start_date, end_date):
+    query = select(table.c.status, func.count()).group_by(table.c.status)
+    if start_date and end_date:
+        query = query.where(table.c.created_at >= start_date, table.c.created_at < end_date)
+    elif start_date:
+        query = query.where(table.c.created_at >= start_date)
+    return query
+
+
+async def compute_admin_stats(
+    session: AsyncSession,
+    type: str,
+    year: int = None,
+    month: int = None,
+    week: int = None,
+    include_archive: bool = False,
+) -> tuple[int, dict]:
+    """Считает статистику по постам и возвращает (status_code, content)."""
+    try:
+        try:
+            start_date, end_date = _period_bounds(type, year, month, week)
+        except ValueError as e:
+            return 400, {"success": False, "error": str(e)}
+
+        # 🧩 Считаем на стороне БД, строки в память не тянем
+        tables = [Product.__table__]
+        if include_archive or _reaches_archive(start_date):
+            tables.append(archived_products)
+
+        counts: dict[str, int] = {}
+        for table in tables:
+            result = await session.execute(_status_counts_query(table, start_date, end_date))
+            for status, count in result.all():
+                key = str(getattr(status, "value", status))
+                counts[key] = counts.get(key, 0) + count
+
+        posted_count = counts.get("posted", 0)
+        pending_count = counts.get("pending", 0)
 
         stats = {
             "type": type,
             "year": year,
             "month": month,
             "week": week,
-            "total_posts": len(products),
-            "posted_count": len(posted),
-            "pending_count": len(pending),
-            "posted_amount": len(posted) * 300,
-            "pending_amount": len(pending) * 300,
+            "total_posts": sum(counts.values()),
+            "posted_count": posted_count,
+            "pending_count": pending_count,
+            "posted_amount": posted_count * 300,
+            "pending_amount": pending_count * 300,
         }
 
-        return JSONResponse(content={"success": True, "stats": stats})
+        return 200, {"success": True, "stats": stats}
 
     except Exception as e:
-        print(f"❌ Ошибка при вычислении статистики: {e}")
-        return JSONResponse(content={"success": False, "error": str(e)}, status_code=500)
+        logger.error(f"❌ Ошибка при вычислении статистики: {e}")
+        return 500, {"success": False, "error": str(e)}
 
 
 def normalize_datetime(value):
@@ -755,7 +1506,7 @@ def normalize_datetime(value):
         try:
             value = datetime.fromisoformat(value)
         except Exception:
-            print(f"⚠️ Невозможно распарсить дату: {value}")
+            logger.warning(f"⚠️ Невозможно распарсить дату: {value}")
             return None
     if isinstance(value, datetime):
         if value.tzinfo is None:
@@ -763,3 +1514,159 @@ def normalize_datetime(value):
         else:
             return value.astimezone().replace(tzinfo=None)
     return value
+
+
+EXPORT_DEFAULT_COLUMNS = (
+    "id", "user_id", "wb_id", "name", "brand", "price", "basic_price", "discount", "stocks",
+    "category", "status", "url", "created_at", "scheduled_date",
+)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
+def _export_value(value):
+    value = getattr(value, "value", value)  # Enum → строка
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+@app.get("/api/admin/admission")
+async def admin_admission(request: Request):
+    """Очередь и отказы допуска к парсингу, плюс состояние очереди воркеров."""
+    if not _is_admin(request):
+        return JSONResponse(content={"success": False, "error": "Доступ запрещён"}, status_code=403)
+    return {"success": True, "parse": parse_admission.stats(), "parse_queue": parse_queue.stats()}
+
+@app.get("/api/debug/loop")
+async def debug_loop(request: Request, stacks: bool = True):
+    """Перцентили задержки event loop и последние блокировки со стеком виновника."""
+    if not _is_admin(request):
+        return JSONResponse(content={"success": False, "error": "Доступ запрещён"}, status_code=403)
+    return {"success": True, "loop": loop_monitor.stats(with_stacks=stacks)}
+
+@app.get("/api/admin/memory")
+async def admin_memory(request: Request, trace: bool = False, stop: bool = False, top: int = Query(25, ge=1, le=200)):
+    """
+    Размер и число записей глобальных словарей и кэшей с приростом с прошлого вызова.
+    trace=1 — снимок tracemalloc и разница с предыдущим (первый вызов только включает трассировку), stop=1 — выключить.
+    """
+    if not _is_admin(request):
+        return JSONResponse(content={"success": False, "error": "Доступ запрещён"}, status_code=403)
+    if stop:
+        return {"success": True, "tracemalloc": tracer.stop()}
+    return {"success": True, **(await memory_report(trace=trace, top=top))}
+
+@app.get("/api/debug/profiles")
+async def debug_profiles(request: Request):
+    """Последние профили запросов (кольцевой буфер): сводка по времени в DB/WB/YooKassa/Telegram."""
+    if not _is_admin(request):
+        return JSONResponse(content={"success": False, "error": "Доступ запрещён"}, status_code=403)
+    return {"success": True, "sample_rate": profiler.sample_rate, "profiles": profiler.list()}
+
+@app.get("/api/debug/profiles/{profile_id}")
+async def debug_profile(profile_id: str, request: Request):
+    """Полный профиль: спаны по порядку и самые частые стеки event loop."""
+    if not _is_admin(request):
+        return JSONResponse(content={"success": False, "error": "Доступ запрещён"}, status_code=403)
+    prof = profiler.get(profile_id)
+    if prof is None:
+        return JSONResponse(content={"success": False, "error": "Профиль не найден"}, status_code=404)
+    return {"success": True, "profile": prof.to_dict()}
+
+@app.get("/api/admin/export")
+async def admin_export(
+    request: Request,
+    type: str = Query("all", description="Тип периода: day|week|month|all"),
+    year: int = Query(None),
+    month: int = Query(None),
+    week: int = Query(None),
+    format: str = Query("csv", description="csv|jsonl"),
+    columns: str = Query(None, description="Колонки через запятую"),
+    gzip: bool = Query(False, description="Сжимать поток gzip на лету"),
+    include_archive: bool = Query(False),
+):
+    """
+    Потоковая выгрузка товаров за период в CSV/JSONL.
+    Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE — память не зависит от объёма.
+    """
+    if not _is_admin(request):
+        return JSONResponse(content={"success": False, "error": "Доступ запрещён"}, status_code=403)
+    if format not in ("csv", "jsonl"):
+        return JSONResponse(content={"success": False, "error": "format: csv или jsonl"}, status_code=400)
+    try:
+        start_date, end_date = _period_bounds(type, year, month, week)
+    except ValueError as e:
+        return JSONResponse(content={"success": False, "error": str(e)}, status_code=400)
+
+    tables = [Product.__table__]
+    if include_archive or _reaches_archive(start_date):
+        tables.append(archived_products)
+
+    # колонки проверяем по каждой таблице, из которой будем читать: схема архива может отставать от products
+    names = [c.strip() for c in columns.split(",") if c.strip()] if columns else list(EXPORT_DEFAULT_COLUMNS)
+    for table in tables:
+        unknown = [c for c in names if c not in table.c]
+        if unknown:
+            return JSONResponse(
+                content={"success": False, "error": f"Неизвестные колонки в {table.name}: {', '.join(unknown)}"},
+                status_code=400,
+            )
+
+    async def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # JSONL — сразу bytes из json_dumps, как и остальные ответы API
+        lines: list[bytes] = []
+
+        def flush() -> bytes:
+            chunk = buffer.getvalue().encode("utf-8") + b"".join(lines)
+            buffer.seek(0)
+            buffer.truncate(0)
+            lines.clear()
+            return compressor.compress(chunk) if compressor else chunk
+
+        if format == "csv":
+            writer.writerow(names)
+
+        async with AsyncSessionLocal() as session:
+            for table in tables:
+                query = select(*[table.c[name] for name in names]).order_by(table.c.id)
+                if start_date and end_date:
+                    query = query.where(table.c.created_at >= start_date, table.c.created_at < end_date)
+                elif start_date:
+                    query = query.where(table.c.created_at >= start_date)
+
+                stream = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+                async for rows in stream.partitions():
+                    for row in rows:
+                        values = [_export_value(v) for v in row]
+                        if format == "csv":
+                            writer.writerow(values)
+                        else:
+                            lines.append(json_dumps(dict(zip(names, values))))
+                            lines.append(b"\n")
+                    chunk = flush()
+                    if chunk:
+                        yield chunk
+
+        chunk = flush()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+
+    filename = f"products_{type}.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+if __name__ == "__main__":
+    # python -m backend.backend — uvicorn с --loop/--http из RUNTIME_PROFILE
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")), **uvicorn_options())
@@ -0,0 +1,286 @@
+# backend_client.py
+import asyncio
+import importlib
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+if __package__:
+    from .metrics import BACKEND_CALLS, RETRIES
+    from .runtime import json_loads
+else:
+    from metrics import BACKEND_CALLS, RETRIES
+    from runtime import json_loads
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationCache:
+    """
+    Положительный кэш проверки регистрации на стороне бота.
+    Храним только «зарегистрирован»: отказ не кэшируем, чтобы пользователь сразу прошёл после отправки контакта.
+    """
+
+    def __init__(self, ttl: float = 6 * 3600.0, max_size: int = 100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen: Dict[str, float] = {}
+
+    def hit(self, tg_id) -> bool:
+        ts = self._seen.get(str(tg_id))
+        if ts is None:
+            return False
+        if time.monotonic() - ts > self.ttl:
+            self._seen.pop(str(tg_id), None)
+            return False
+        return True
+
+    def mark(self, tg_id):
+        if len(self._seen) >= self.max_size:
+            # простая защита от разрастания: выкидываем самую старую запись
+            self._seen.pop(next(iter(self._seen)), None)
+        self._seen[str(tg_id)] = time.monotonic()
+
+    def invalidate(self, tg_id):
+        self._seen.pop(str(tg_id), None)
+
+
+registered_users = RegistrationCache()
+
+
+class BackendClient:
+    """
+    Клиент бота к нашему бэкенду (BACKEND_URL).
+    Держит одну aiohttp-сессию с keep-alive пулом соединений, поэтому TLS-рукопожатие
+    к api.hikinamuri.ru делается один раз, а не на каждый апдейт.
+    Если задан unix_socket — ходит в локальный uvicorn (--uds) через Unix-сокет, минуя TCP/TLS.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 10.0,
+        retries: int = 2,
+        retry_backoff: float = 0.3,
+        pool_size: int = 20,
+        keepalive_timeout: float = 60.0,
+        unix_socket: Optional[str] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.unix_socket = unix_socket
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def setup(self):
+        if self.session is None or self.session.closed:
+            if self.unix_socket:
+                connector = aiohttp.UnixConnector(
+                    path=self.unix_socket,
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+            else:
+                connector = aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=300,
+                )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            logger.info(f"✅ Сессия к бэкенду создана: {self.unix_socket or self.base_url}")
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info("🛑 Сессия к бэкенду закрыта")
+        self.session = None
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        retry: bool = True,
+    ) -> Tuple[int, Dict[str, Any]]:
+        """
+        Выполняет запрос и возвращает (status, json). Повторяет только сетевые ошибки и 5xx:
+        для неидемпотентных POST ретраи выключаются через retry=False.
+        """
+        await self.setup()
+        attempts = (self.retries + 1) if retry else 1
+        last_exc: Optional[BaseException] = None
+        # /api/users/123 -> /api/users/{id}: одна серия на маршрут
+        timing = BACKEND_CALLS.labels(re.sub(r"/\d+", "/{id}", path))
+        started = time.perf_counter()
+
+        for attempt in range(attempts):
+            if attempt:
+                RETRIES.labels("backend_client").inc()
+            try:
+                async with self.session.request(method, f"{self.base_url}{path}", params=params, json=json) as resp:
+                    if resp.status >= 500 and attempt < attempts - 1:
+                        logger.warning(f"⚠️ Бэкенд вернул {resp.status} на {method} {path}, повтор {attempt + 2}/{attempts}")
+                    else:
+                        try:
+                            data = await resp.json(content_type=None, loads=json_loads)
+                        except Exception:
+                            data = {}
+                        timing.observe(time.perf_counter() - started)
+                        return resp.status, data if isinstance(data, dict) else {}
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_exc = e
+                if attempt < attempts - 1:
+                    logger.warning(f"⚠️ Ошибка запроса {method} {path}: {e!r}, повтор {attempt + 2}/{attempts}")
+                else:
+                    break
+            await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+        raise last_exc or aiohttp.ClientError(f"{method} {path} failed")
+
+    # --- Пользователи ---
+    async def user_exists(self, tg_id: int) -> bool:
+        if registered_users.hit(tg_id):
+            return True
+        status, data = await self._request("GET", f"/api/users/{tg_id}")
+        exists = status == 200 and bool(data.get("exists", False))
+        if exists:
+            registered_users.mark(tg_id)
+        return exists
+
+    async def register_user(self, tg_id: int, name: str, phone: str) -> Dict[str, Any]:
+        registered_users.invalidate(tg_id)
+        _, data = await self._request(
+            "POST",
+            "/api/users/register",
+            json={"tg_id": tg_id, "name": name, "phone": phone},
+        )
+        if data.get("success"):
+            registered_users.mark(tg_id)
+        return data
+
+    # --- Товары ---
+    async def add_product(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # добавление товара не идемпотентно — повтор может создать дубль
+        _, data = await self._request("POST", "/api/products/add", json=payload, retry=False)
+        return data
+
+    # --- Статистика ---
+    async def admin_stats(self, **params: Any) -> Optional[Dict[str, Any]]:
+        """Возвращает ответ /api/admin/stats или None, если бэкенд ответил не 200."""
+        query = {k: v for k, v in params.items() if v is not None}
+        status, data = await self._request("GET", "/api/admin/stats", params=query)
+        if status != 200:
+            return None
+        return data
+
+
+class DirectBackendClient:
+    """
+    Транспорт для совместного деплоя: бот и бэкенд в одном процессе и одном event loop.
+    Вместо HTTP вызывает сервисные функции backend напрямую — тот же интерфейс, что у BackendClient.
+    Бот должен быть запущен как пакет (python -m backend.main): backend.py импортирует модули как backend.xxx,
+    и при голых именах в процессе оказалось бы по два реестра метрик, кэша парсера и истории цен.
+    """
+
+    def __init__(self, module_name: str = f"{__package__}.backend"):
+        self.module_name = module_name
+        self._backend = None
+        self._lock = asyncio.Lock()
+
+    async def setup(self):
+        if self._backend is not None:
+            return
+        async with self._lock:
+            if self._backend is None:
+                # импорт ленивый: модуль бэкенда тянет БД; фоновые задачи запускаем уже внутри работающего loop
+                backend = importlib.import_module(self.module_name)
+                await backend.start_background()
+                self._backend = backend
+                logger.info(f"✅ Прямой транспорт к бэкенду: {self.module_name}")
+
+    async def close(self):
+        async with self._lock:
+            if self._backend is not None:
+                await self._backend.stop_background()
+            self._backend = None
+
+    async def user_exists(self, tg_id: int) -> bool:
+        if registered_users.hit(tg_id):
+            return True
+        await self.setup()
+        async with self._backend.AsyncSessionLocal() as session:
+            exists = await self._backend.user_exists(session, str(tg_id))
+        if exists:
+            registered_users.mark(tg_id)
+        return exists
+
+    async def register_user(self, tg_id: int, name: str, phone: str) -> Dict[str, Any]:
+        registered_users.invalidate(tg_id)
+        await self.setup()
+        data = await self._backend.register_user_service(tg_id, name, phone)
+        if data.get("success"):
+            registered_users.mark(tg_id)
+        return data
+
+    async def add_product(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        await self.setup()
+        return await self._backend.add_product_service(dict(payload))
+
+    async def admin_stats(self, **params: Any) -> Optional[Dict[str, Any]]:
+        await self.setup()
+        async with self._backend.AsyncSessionLocal() as session:
+            status, data = await self._backend.compute_admin_stats(
+                session,
+                params.get("type", "day"),
+                params.get("year"),
+                params.get("month"),
+                params.get("week"),
+            )
+        if status != 200:
+            return None
+        return data
+
+
+def create_backend_client(base_url: str):
+    """
+    Выбирает транспорт по BACKEND_TRANSPORT:
+    - http (по умолчанию) — HTTP(S) на base_url, для раздельного деплоя;
+    - unix — HTTP через Unix-сокет BACKEND_UNIX_SOCKET на том же хосте;
+    - direct — прямые вызовы функций бэкенда (модуль BACKEND_APP_MODULE) в том же event loop;
+      бот при этом запускается как пакет: python -m backend.main.
+    """
+    transport = os.getenv("BACKEND_TRANSPORT", "http").lower()
+    if transport == "direct":
+        if not __package__:
+            raise RuntimeError("BACKEND_TRANSPORT=direct требует запуска бота как пакета: python -m backend.main")
+        return DirectBackendClient(os.getenv("BACKEND_APP_MODULE", f"{__package__}.backend"))
+    if transport == "unix":
+        return BackendClient("http://backend", unix_socket=os.getenv("BACKEND_UNIX_SOCKET", "/tmp/wb-backend.sock"))
+    return BackendClient(base_url)
+
+
+_client: Optional[BackendClient] = None
+
+
+async def get_backend_client(base_url: str) -> BackendClient:
+    global _client
+    if _client is None:
+        _client = create_backend_client(base_url)
+    await _client.setup()
+    return _client
+
+
+async def close_backend_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,147 @@
+# bench_runtime.py
+"""
+Сравнение RUNTIME_PROFILE=default и RUNTIME_PROFILE=fast на одной нагрузке:
+JSON ответа /api/products/parse и списка товаров пользователя, разбор JSON WB detail и event loop.
+
+    python bench_runtime.py             # оба профиля, каждый в отдельном процессе
+    python bench_runtime.py --runs 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_result() -> dict:
+    return {
+        "success": True,
+        "articul": "123456789",
+        "name": "Кроссовки мужские беговые лёгкие дышащие",
+        "brand": "Brand",
+        "price": 2599.0,
+        "basic_price": 4999.0,
+        "discount": 48,
+        "rating": 4.8,
+        "feedbacks": 15234,
+        "stocks": 412,
+        "stocks_by_size": {str(size): size * 3 for size in range(36, 47)},
+        "description": "Лёгкие кроссовки для бега и прогулок. " * 40,
+        "characteristics": {f"Характеристика {i}": f"Значение {i}" for i in range(40)},
+        "images": [
+            f"https://basket-12.wbbasket.ru/vol1234/part123456/123456789/images/c516x688/{i}.webp" for i in range(1, 16)
+        ],
+        "regions": {str(dest): {"price": 2599.0 + dest % 7, "stocks": dest % 50} for dest in range(-1257786, -1257776)},
+    }
+
+
+def user_products(n: int = 500) -> dict:
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    return {
+        "success": True,
+        "tg_id": "123456",
+        "user_id": "123456",
+        "products": [
+            {
+                "id": i,
+                "name": f"Товар {i}",
+                "price": 1000 + i,
+                "url": f"https://www.wildberries.ru/catalog/{10_000_000 + i}/detail.aspx",
+                "status": "pending",
+                "created_at": now - timedelta(hours=i),
+                "scheduled_date": now + timedelta(hours=i),
+            }
+            for i in range(n)
+        ],
+    }
+
+
+def wb_detail() -> bytes:
+    product = {
+        "id": 123456789, "name": "Кроссовки", "brand": "Brand", "supplier": "ООО Поставщик", "rating": 5,
+        "reviewRating": 4.8, "feedbacks": 15234, "pics": 15, "subjectId": 105, "subjectParentId": 1,
+        "sizes": [
+            {"name": str(size), "origName": str(size), "price": {"basic": 499900, "product": 259900},
+             "stocks": [{"wh": 507 + w, "qty": w * 3} for w in range(12)]}
+            for size in range(36, 47)
+        ],
+    }
+    return json.dumps({"state": 0, "data": {"products": [product]}}, ensure_ascii=False).encode("utf-8")
+
+
+def _best(fn, runs: int) -> float:
+    # лучший из 5 замеров по runs итераций — меньше шума от соседей по машине
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        best = min(best, (time.perf_counter() - started) / runs)
+    return best * 1e6
+
+
+async def _loop_roundtrips(n: int):
+    loop = asyncio.get_running_loop()
+    for _ in range(n):
+        future = loop.create_future()
+        loop.call_soon(future.set_result, None)
+        await future
+    await asyncio.gather(*(asyncio.sleep(0) for _ in range(n)))
+
+
+def run_profile(runs: int) -> dict:
+    """Выполняется в дочернем процессе с заданным RUNTIME_PROFILE."""
+    sys.path.insert(0, HERE)
+    import runtime
+
+    parsed, products, detail = parse_result(), user_products(), wb_detail()
+    results = {
+        "profile": runtime.describe(),
+        "parse_result_dumps_us": _best(lambda: runtime.json_dumps(parsed), runs),
+        "user_products_dumps_us": _best(lambda: runtime.json_dumps(products), max(1, runs // 10)),
+        "wb_detail_loads_us": _best(lambda: runtime.json_loads(detail), runs),
+    }
+
+    runtime.install_event_loop()
+    n = 20_000
+    started = time.perf_counter()
+    asyncio.run(_loop_roundtrips(n))
+    results["loop_roundtrip_us"] = (time.perf_counter() - started) / (2 * n) * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_profile(args.runs)))
+        return
+
+    results = {}
+    for profile in ("default", "fast"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--runs", str(args.runs)],
+            env={**os.environ, "RUNTIME_PROFILE": profile},
+            capture_output=True, text=True, check=True,
+        )
+        results[profile] = json.loads(out.stdout)
+
+    default, fast = results["default"], results["fast"]
+    print(f"default: {default['profile']}")
+    print(f"fast:    {fast['profile']}\n")
+    print(f"{'нагрузка':<26}{'default, мкс':>14}{'fast, мкс':>12}{'ускорение':>12}")
+    for key in ("parse_result_dumps_us", "user_products_dumps_us", "wb_detail_loads_us", "loop_roundtrip_us"):
+        speedup = default[key] / fast[key] if fast[key] else float("nan")
+        print(f"{key[:-3]:<26}{default[key]:>14.1f}{fast[key]:>12.1f}{speedup:>11.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench_startup.py
+"""
+Замер старта API.
+
+    python bench_startup.py                   # время импорта backend.backend (медиана по запускам)
+    python bench_startup.py --imports         # + самые дорогие импорты по -X importtime
+    python bench_startup.py --serve           # + uvicorn: время до ответа /readyz и до 200 (прогрев)
+    PREWARM=0 python bench_startup.py --serve # то же без прогрева, для сравнения
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# backend.py импортирует модули как backend.xxx — запускаем из каталога над пакетом
+PARENT = os.path.dirname(HERE)
+PACKAGE = os.path.basename(HERE)
+MODULE = f"{PACKAGE}.backend"
+
+
+def bench_import(runs: int) -> list:
+    code = f"import time; t = time.perf_counter(); import {MODULE}; print(time.perf_counter() - t)"
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=PARENT, capture_output=True, text=True)
+        if out.returncode != 0:
+            sys.exit(f"Импорт {MODULE} упал:\n{out.stderr[-2000:]}")
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def top_imports(limit: int) -> list:
+    """Прямые импорты backend.backend по суммарному времени (из -X importtime)."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        cwd=PARENT, capture_output=True, text=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip(" "))
+        rows.append((depth, int(cumulative_us), name.strip()))
+
+    # importtime печатает детей перед родителем: берём строки уровнем ниже до строки самого модуля
+    module_at = next((i for i, row in enumerate(rows) if row[2] == MODULE), None)
+    if module_at is None:
+        return []
+    depth = rows[module_at][0]
+    children = []
+    for row_depth, cumulative_us, name in reversed(rows[:module_at]):
+        if row_depth <= depth:
+            break
+        if row_depth == depth + 2:
+            children.append((cumulative_us, name))
+    return sorted(children, reverse=True)[:limit]
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def bench_serve(port: int, timeout: float) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{MODULE}:app", "--port", str(port), "--log-level", "warning"],
+        cwd=PARENT,
+    )
+    listening = ready = None
+    body = {}
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                status, body = _get(f"http://127.0.0.1:{port}/readyz")
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.02)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - started
+            if status == 200:
+                ready = time.perf_counter() - started
+                break
+            time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"listening_s": listening, "ready_s": ready, "readyz": body}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--imports", action="store_true")
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    times = bench_import(args.runs)
+    print(f"📦 import {MODULE}: медиана {statistics.median(times) * 1000:.0f}ms, "
+          f"мин {min(times) * 1000:.0f}ms, макс {max(times) * 1000:.0f}ms, запусков: {args.runs}")
+
+    if args.imports:
+        print("\n🐢 Самые дорогие импорты backend.py (cumulative):")
+        for cumulative_us, name in top_imports(15):
+            print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+
+    if args.serve:
+        result = bench_serve(args.port, args.timeout)
+        print(f"\n🚀 uvicorn (PREWARM={os.getenv('PREWARM', '1')}): принимает запросы через "
+              f"{result['listening_s'] or float('nan'):.2f}s, готов (/readyz 200) через {result['ready_s'] or float('nan'):.2f}s")
+        for name, check in (result["readyz"].get("checks") or {}).items():
+            print(f"  {name}: {check.get('status')} {check.get('ms', '')}ms {check.get('error', '')}")
+
+
+if __name__ == "__main__":
+    main()
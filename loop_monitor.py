@@ -0,0 +1,153 @@
+# loop_monitor.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from array import array
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+if __package__:
+    from .metrics import LOOP_LAG, LOOP_STALLS
+else:
+    from metrics import LOOP_LAG, LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+# Как часто меряем задержку планирования, секунды
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+# С какой задержки считаем, что цикл заблокирован, и снимаем стек
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.1"))
+# Окно для перцентилей (последние N замеров) и сколько блокировок помним
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "3000"))
+LOOP_STALLS_KEEP = int(os.getenv("LOOP_STALLS_KEEP", "20"))
+LOOP_STACK_LIMIT = 25
+
+
+class LoopMonitor:
+    """
+    Задержка event loop: корутина каждые LOOP_LAG_INTERVAL засыпает и меряет, насколько позже проснулась.
+    Сторожевой поток следит за отметкой этой корутины: если цикл не отвечает дольше LOOP_STALL_THRESHOLD,
+    он снимает стек потока event loop через sys._current_frames() — это и есть тот, кто держит цикл.
+    """
+
+    def __init__(
+        self,
+        process: str,
+        interval: float = LOOP_LAG_INTERVAL,
+        threshold: float = LOOP_STALL_THRESHOLD,
+        window: int = LOOP_LAG_WINDOW,
+    ):
+        self.process = process
+        self.interval = interval
+        self.threshold = threshold
+        self.window = window
+        # кольцевой буфер последних задержек (секунды)
+        self._lags = array("d", [0.0] * window)
+        self._pos = 0
+        self._count = 0
+        self._max = 0.0
+        self._histogram = LOOP_LAG.labels(process)
+        self._stall_counter = LOOP_STALLS.labels(process)
+        self.stalls: deque = deque(maxlen=LOOP_STALLS_KEEP)
+        self._pending_stall: Optional[Dict[str, Any]] = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name=f"loop-watchdog-{self.process}", daemon=True)
+        self._watchdog.start()
+        logger.info(f"🩺 Мониторинг event loop ({self.process}): шаг {self.interval * 1000:.0f}ms, порог {self.threshold * 1000:.0f}ms")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self._record(max(0.0, now - expected))
+
+    def _record(self, lag: float):
+        self._lags[self._pos] = lag
+        self._pos = (self._pos + 1) % self.window
+        self._count += 1
+        if lag > self._max:
+            self._max = lag
+        self._histogram.observe(lag)
+        if lag >= self.threshold:
+            self._stall_counter.inc()
+            stall = self._pending_stall
+            self._pending_stall = None
+            if stall is None:
+                # блокировка короче шага сторожа — стек не успели снять
+                stall = {"at": time.time(), "stack": None}
+                self.stalls.append(stall)
+            stall["lag_ms"] = round(lag * 1000, 1)
+            logger.warning(f"🐢 Event loop ({self.process}) был занят {lag * 1000:.0f}ms", extra={"sample": 10})
+
+    def _watch(self):
+        step = max(self.threshold / 4, 0.005)
+        captured_for = None
+        while not self._stopped.wait(step):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if stalled_for < self.threshold or captured_for == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            captured_for = heartbeat
+            stack = traceback.format_stack(frame, limit=LOOP_STACK_LIMIT)
+            stall = {"at": time.time(), "stack": [line.rstrip() for line in stack], "lag_ms": None}
+            # словарь целиком готов до публикации — поток event loop увидит его уже заполненным
+            self.stalls.append(stall)
+            self._pending_stall = stall
+            logger.warning(
+                f"🧱 Event loop ({self.process}) заблокирован >{stalled_for * 1000:.0f}ms: {stack[-1].strip() if stack else '?'}"
+            )
+
+    def percentiles(self) -> Dict[str, float]:
+        n = min(self._count, self.window)
+        if not n:
+            return {"p50_ms": 0.0, "p90_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        values = sorted(self._lags[:n] if n < self.window else self._lags)
+
+        def pick(q: float) -> float:
+            return round(values[min(n - 1, int(q * n))] * 1000, 2)
+
+        return {"p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "max_ms": round(self._max * 1000, 2)}
+
+    def stats(self, with_stacks: bool = True) -> Dict[str, Any]:
+        stalls: List[Dict[str, Any]] = list(self.stalls)
+        if not with_stacks:
+            stalls = [{k: v for k, v in s.items() if k != "stack"} for s in stalls]
+        return {
+            "process": self.process,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "samples": self._count,
+            **self.percentiles(),
+            "stalls": list(reversed(stalls)),
+        }
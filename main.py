@@ -4,7 +4,23 @@ import asyncio
 from dotenv import load_dotenv
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, PreCheckoutQueryHandler, CallbackQueryHandler
-from new_parser import parse_wb_product_api
+# python -m backend.main — пакетные имена, те же модули, что импортирует backend.py (нужно для BACKEND_TRANSPORT=direct)
+if __package__:
+    from .new_parser import parse_wb_product_api, parser_caches
+    from .backend_client import get_backend_client, close_backend_client, registered_users
+    from .metrics import start_metrics_server
+    from .app_logging import setup_logging
+    from .loop_monitor import LoopMonitor
+    from .memory_diag import track, track_group, memory_report, tracer, format_bytes
+    from .runtime import install_event_loop
+else:
+    from new_parser import parse_wb_product_api, parser_caches
+    from backend_client import get_backend_client, close_backend_client, registered_users
+    from metrics import start_metrics_server
+    from app_logging import setup_logging
+    from loop_monitor import LoopMonitor
+    from memory_diag import track, track_group, memory_report, tracer, format_bytes
+    from runtime import install_event_loop
 import aiohttp
 from telegram import LabeledPrice
 from datetime import datetime, timedelta, timezone
@@ -18,6 +34,9 @@ import logging
 
 load_dotenv()
 
+setup_logging("bot")
+logger = logging.getLogger("bot")
+
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 WEB_APP_URL = "https://wb-seller.vercel.app/"
 # WEB_APP_URL = "https://wb-miniapp-demo.loca.lt"
@@ -34,6 +53,13 @@ ADMIN_IDS = {933791537, 455197004, 810503099, 535437088}  # замени на с
 
 # Кэш для хранения результатов парсинга
 parsing_cache = {}
+# Порт /metrics бота (WB-запросы парсера, вызовы бэкенда, повторы); пусто — не поднимаем
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "0"))
+METRICS_RUNNER = None
+# Задержка event loop бота: долгий синхронный обработчик держит все апдейты, включая платежи
+LOOP_MONITOR = LoopMonitor("bot")
+# Бюджет на ответ в чате: что не успело — досчитается в фоне
+PARSE_DEADLINE_SECONDS = float(os.getenv("PARSE_DEADLINE_SECONDS", "0.8"))
 
 # --- Конфиг для YooKassa (из env) ---
 YOOKASSA_ACCOUNT = os.getenv("YOOKASSA_SHOP_ID")
@@ -42,6 +68,15 @@ YK_PENDING = {}
 BOT = None
 PROCESSED_PAYMENTS: dict[str, dict] = {}
 
+# 🧠 Глобальные словари и кэши бота — для /memory
+track("PENDING_MESSAGES", PENDING_MESSAGES)
+track("SENT_INVOICES", SENT_INVOICES)
+track("YK_PENDING", YK_PENDING)
+track("PROCESSED_PAYMENTS", PROCESSED_PAYMENTS)
+track("parsing_cache", parsing_cache)
+track("registered_users", registered_users)
+track_group(parser_caches)
+
 # Порог возраста YK-платежа (в секундах), старше которого мы пытаемся отменить чтобы избежать duplicate.
 YK_AGE_CANCEL_THRESHOLD = int(os.getenv("YK_AGE_CANCEL_THRESHOLD", "60"))  # дефолт 60s
 
@@ -58,9 +93,9 @@ async def fetch_yk_payment(payment_id: str) -> dict | None:
                     return await resp.json()
                 else:
                     text = await resp.text()
-                    print(f"⚠️ YooKassa fetch returned {resp.status}: {text}")
+                    logger.warning(f"⚠️ YooKassa fetch returned {resp.status}: {text}")
     except Exception as e:
-        print(f"❌ Ошибка fetch_yk_payment: {e}")
+        logger.error(f"❌ Ошибка fetch_yk_payment: {e}")
     return None
 
 async def cancel_yk_payment(payment_id: str) -> tuple[int, str]:
@@ -74,7 +109,7 @@ async def cancel_yk_payment(payment_id: str) -> tuple[int, str]:
                 text = await resp.text()
                 return (resp.status, text)
     except Exception as e:
-        print(f"❌ Ошибка cancel_yk_payment: {e}")
+        logger.error(f"❌ Ошибка cancel_yk_payment: {e}")
         return (0, str(e))
 
 # ---------- Конец вспомогательных функций ----------
@@ -137,7 +172,7 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     contact = update.message.contact
     user = update.effective_user
 
-    print(f"📞 Получен контакт: {contact.phone_number} от пользователя {user.id}")
+    logger.info(f"📞 Получен контакт: {contact.phone_number} от пользователя {user.id}")
 
     # Отправляем данные на бэкенд для регистрации
     payload = {
@@ -147,9 +182,8 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{BACKEND_URL}/api/users/register", json=payload) as resp:
-                result = await resp.json()
+        backend = await get_backend_client(BACKEND_URL)
+        result = await backend.register_user(**payload)
 
         if result.get("success"):
             await update.message.reply_text(
@@ -161,10 +195,10 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(
                 "❌ Ошибка при регистрации. Попробуйте позже."
             )
-            print("Ошибка при регистрации:", result)
+            logger.warning("⚠️ Ошибка при регистрации: %s", result)
 
     except Exception as e:
-        print(f"❌ Ошибка при обращении к бэкенду: {e}")
+        logger.error(f"❌ Ошибка при обращении к бэкенду: {e}")
         await update.message.reply_text("⚠️ Не удалось сохранить контакт в БД.")
 
 async def handle_product_parsing(update: Update, product_url: str):
@@ -174,11 +208,13 @@ async def handle_product_parsing(update: Update, product_url: str):
         parsing_msg = await update.message.reply_text("🔍 Парсим информацию о товаре через API...")
         
         # Используем API парсер
-        product_data = await parse_wb_product_api(product_url)
+        product_data = await parse_wb_product_api(product_url, deadline=PARSE_DEADLINE_SECONDS)
         
         if product_data.get('success'):
             # Форматируем сообщение с реальными данными
             message = format_api_product_message(product_data)
+            if product_data.get('partial'):
+                message += "\n\n⏳ Часть данных ещё загружается — откройте товар ещё раз чуть позже."
             await parsing_msg.edit_text(message, parse_mode='HTML')
             
             # Сохраняем в кэш для использования в приложении
@@ -193,7 +229,7 @@ async def handle_product_parsing(update: Update, product_url: str):
             )
             
     except Exception as e:
-        print(f"❌ Ошибка при парсинге: {e}")
+        logger.error(f"❌ Ошибка при парсинге: {e}")
         await update.message.reply_text(
             "❌ Произошла ошибка при получении информации о товаре"
         )
@@ -245,14 +281,14 @@ def format_api_product_message(product_data: dict) -> str:
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
-        print("⚠️ Обновление без текстового сообщения — пропускаем")
+        logger.warning("⚠️ Обновление без текстового сообщения — пропускаем")
         return
 
     text = update.message.text
     user_id = update.effective_user.id
 
     if text == "📱 Открыть приложение":
-        print(f"🔗 Пользователь {user_id} пытается открыть Web App")
+        logger.info(f"🔗 Пользователь {user_id} пытается открыть Web App")
 
         # Проверяем регистрацию
         registered = await is_user_registered(user_id)
@@ -290,13 +326,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def is_user_registered(tg_id: int) -> bool:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{BACKEND_URL}/api/users/{tg_id}") as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("exists", False)
+        backend = await get_backend_client(BACKEND_URL)
+        return await backend.user_exists(tg_id)
     except Exception as e:
-        print(f"⚠️ Ошибка проверки пользователя: {e}")
+        logger.warning(f"⚠️ Ошибка проверки пользователя: {e}")
     return False
 
 async def get_main_keyboard(user_id: int):
@@ -327,10 +360,10 @@ async def cancel_all_pending_invoices(context, chat_id):
                     chat_id=chat_id,
                     message_id=info["message_id"]
                 )
-                print(f"🗑 Removed pending invoice msg={info['message_id']} payload={payload}")
+                logger.info(f"🗑 Removed pending invoice msg={info['message_id']} payload={payload}")
                 to_remove.append(payload)
             except Exception as e:
-                print(f"⚠️ Could not remove invoice {payload}: {e}")
+                logger.warning(f"⚠️ Could not remove invoice {payload}: {e}")
 
     # Чистим словарь
     for payload in to_remove:
@@ -340,7 +373,7 @@ async def maybe_cancel_yk_after_delay(payment_id: str, chat_id: int, delay_secon
     await asyncio.sleep(delay_seconds)
     
     if payment_id in PROCESSED_PAYMENTS:
-        print(f"⚠️ Payment {payment_id } already processed, skipping cancel")
+        logger.warning(f"⚠️ Payment {payment_id } already processed, skipping cancel")
         return
 
 
@@ -348,18 +381,18 @@ async def maybe_cancel_yk_after_delay(payment_id: str, chat_id: int, delay_secon
         # если уже обработан как succeeded — не трогаем
         pinfo = PROCESSED_PAYMENTS.get(payment_id)
         if pinfo and pinfo.get("status") == "succeeded":
-            print(f"✅ Delayed check: платеж {payment_id} уже успешен, не отменяем")
+            logger.info(f"✅ Delayed check: платеж {payment_id} уже успешен, не отменяем")
             # очистим YK_PENDING если осталось
             YK_PENDING.pop(payment_id, None)
             return
 
         yk = await fetch_yk_payment(payment_id)
         if not yk:
-            print(f"ℹ️ cannot fetch yk payment {payment_id} after delay")
+            logger.info(f"ℹ️ cannot fetch yk payment {payment_id} after delay")
             return
 
         status = yk.get("status")
-        print(f"ℹ️ Post-delay YooKassa status for {payment_id}: {status}")
+        logger.info(f"ℹ️ Post-delay YooKassa status for {payment_id}: {status}")
 
         # если платеж уже успешен — помечаем и выходим
         if status in ("succeeded", "captured"):
@@ -371,13 +404,13 @@ async def maybe_cancel_yk_after_delay(payment_id: str, chat_id: int, delay_secon
                     pending["cancel_task"].cancel()
                 except Exception:
                     pass
-            print(f"✅ Delayed check: платеж {payment_id} завершён — не отменяем")
+            logger.info(f"✅ Delayed check: платеж {payment_id} завершён — не отменяем")
             return
 
         # отменяем только если он всё ещё в состоянии ожидается
         if status in ("pending", "waiting_for_capture"):
             code, text = await cancel_yk_payment(payment_id)
-            print(f"🗑 Auto-cancel attempt for {payment_id} -> {code} {text}")
+            logger.info(f"🗑 Auto-cancel attempt for {payment_id} -> {code} {text}")
 
             # уведомим пользователя и почистим локальные структуры, только если запись была в YK_PENDING
             pending = YK_PENDING.pop(payment_id, None)
@@ -391,25 +424,25 @@ async def maybe_cancel_yk_after_delay(payment_id: str, chat_id: int, delay_secon
                     #         parse_mode="HTML"
                     #     )
                 except Exception as e:
-                    print("Ошибка отправки сообщения после автo-отмены:", e)
+                    logger.warning("⚠️ Ошибка отправки сообщения после автo-отмены: %s", e)
 
                 # удалим отправленное ранее сообщение-кнопку (если известно)
                 try:
                     if pending.get("invoice_message_id") and BOT:
                         await BOT.delete_message(chat_id=pending["chat_id"], message_id=pending["invoice_message_id"])
                 except Exception as e:
-                    print("⚠️ Ошибка при удалении invoice message после автo-отмены:", e)
+                    logger.warning("⚠️ Ошибка при удалении invoice message после автo-отмены: %s", e)
 
             # пометим как canceled
             PROCESSED_PAYMENTS[payment_id] = {"status": "canceled", "ts": time.time()}
 
         else:
-            print(f"ℹ️ Delayed check: статус {status} — никаких действий")
+            logger.info(f"ℹ️ Delayed check: статус {status} — никаких действий")
     except asyncio.CancelledError:
         # задача могла быть отменена законно — игнорируем
         return
     except Exception as e:
-        print("Ошибка maybe_cancel_yk_after_delay:", e)
+        logger.error("❌ Ошибка maybe_cancel_yk_after_delay: %s", e)
 
 async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка данных из Web App — с подробным логированием invoice"""
@@ -418,7 +451,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     try:
         data = json.loads(update.message.web_app_data.data)
-        print("📦 WebApp data received:", data)
+        logger.debug("📦 WebApp data received: %s", data)
 
         # ==========================
         #  ОБРАБОТКА ОПЛАТЫ
@@ -431,16 +464,16 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
             payload = generate_unique_payload(raw_key)
             data["payload"] = payload
 
-            print(f"🔐 Generated payload via function: {payload}")
+            logger.info(f"🔐 Generated payload via function: {payload}")
 
             # удаляем старый message, если был
             old = PENDING_MESSAGES.get(raw_key)
             if old:
                 try:
                     await context.bot.delete_message(chat_id=old["chat_id"], message_id=old["message_id"])
-                    print(f"🗑 Deleted old invoice message {old['message_id']} for key {raw_key}")
+                    logger.info(f"🗑 Deleted old invoice message {old['message_id']} for key {raw_key}")
                 except Exception as e:
-                    print(f"⚠️ Could not delete old invoice {old}: {e}")
+                    logger.warning(f"⚠️ Could not delete old invoice {old}: {e}")
                 PENDING_MESSAGES.pop(raw_key, None)
 
             # проверяем incoming yookassa id (как раньше)
@@ -448,14 +481,14 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
             accepted_yk = None
             yk_info = None
             if incoming_yk:
-                print("ℹ️ WebApp provided yookassa_payment_id:", incoming_yk)
+                logger.info("ℹ️ WebApp provided yookassa_payment_id: %s", incoming_yk)
                 yk_info = await fetch_yk_payment(incoming_yk)
                 if not yk_info:
-                    print("⚠️ Не удалось получить данные по YooKassa платежу — игнорируем incoming id")
+                    logger.warning("⚠️ Не удалось получить данные по YooKassa платежу — игнорируем incoming id")
                 else:
                     yk_status = yk_info.get("status")
                     created_at = yk_info.get("created_at")
-                    print(f"ℹ️ YooKassa status={yk_status}, created_at={created_at} for id={incoming_yk}")
+                    logger.info(f"ℹ️ YooKassa status={yk_status}, created_at={created_at} for id={incoming_yk}")
 
                     age_seconds = None
                     if created_at:
@@ -467,23 +500,23 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
                                 created_dt = created_dt.replace(tzinfo=timezone.utc)
                             age_seconds = (now_utc - created_dt).total_seconds()
                         except Exception as e:
-                            print("⚠️ Не удалось распарсить created_at:", e)
+                            logger.warning("⚠️ Не удалось распарсить created_at: %s", e)
 
                     if yk_status in ("pending", "waiting_for_capture"):
                         if age_seconds is None:
-                            print("⚠️ Не удалось получить возраст платежа — игнорируем incoming id")
+                            logger.warning("⚠️ Не удалось получить возраст платежа — игнорируем incoming id")
                         else:
-                            print(f"ℹ️ YooKassa payment age={age_seconds:.1f}s (threshold={YK_AGE_CANCEL_THRESHOLD}s)")
+                            logger.info(f"ℹ️ YooKassa payment age={age_seconds:.1f}s (threshold={YK_AGE_CANCEL_THRESHOLD}s)")
                             if age_seconds > YK_AGE_CANCEL_THRESHOLD:
                                 code, text = await cancel_yk_payment(incoming_yk)
-                                print(f"🗑 Cancel attempt for {incoming_yk} -> {code} {text}")
+                                logger.info(f"🗑 Cancel attempt for {incoming_yk} -> {code} {text}")
                             else:
-                                print("⚠️ YooKassa payment is fresh but to avoid duplicates we will ignore incoming id and let Telegram create a new one.")
+                                logger.warning("⚠️ YooKassa payment is fresh but to avoid duplicates we will ignore incoming id and let Telegram create a new one.")
                     elif yk_status in ("succeeded", "succeeded_by_provider", "captured"):
                         accepted_yk = incoming_yk
-                        print("✅ YooKassa payment already succeeded — accepting incoming id.")
+                        logger.info("✅ YooKassa payment already succeeded — accepting incoming id.")
                     else:
-                        print("⚠️ YooKassa payment in unexpected status -> ignoring:", yk_status)
+                        logger.warning("⚠️ YooKassa payment in unexpected status -> ignoring: %s", yk_status)
 
             # receipt/provider_data формируем как раньше
             prices = [LabeledPrice(**p) for p in data["prices"]]
@@ -512,7 +545,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
                 pending_meta["yookassa_payment_id"] = accepted_yk
             else:
                 if data.get("yookassa_payment_id"):
-                    print("ℹ️ Ignoring incoming yookassa_payment_id to avoid duplicate submits.")
+                    logger.info("ℹ️ Ignoring incoming yookassa_payment_id to avoid duplicate submits.")
 
             # сохраняем meta по payload
             context.user_data.setdefault("pending_orders", {})[payload] = { **pending_meta, "raw_key": raw_key }
@@ -549,7 +582,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
                         "order_id": order_id,
                     }
                     # asyncio.create_task(maybe_cancel_yk_after_delay(yk_id_from_backend, int(tg_id), delay_seconds=25))
-                    print(f"🧾 Registered pending yk id from backend: {yk_id_from_backend}")
+                    logger.info(f"🧾 Registered pending yk id from backend: {yk_id_from_backend}")
 
                 # регистрируем PENDING_MESSAGES по order_id
                 info = {
@@ -563,12 +596,12 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
                 PENDING_MESSAGES[order_id] = info
                 SENT_INVOICES[payload] = info
 
-                print(f"✅ Sent payment button. payload={payload} chat={info['chat_id']} msg={info['message_id']}")
+                logger.info(f"✅ Sent payment button. payload={payload} chat={info['chat_id']} msg={info['message_id']}")
                 return
 
             # если нет confirmation_url — можно fallback на reply_invoice (опционально)
             # тут можно оставить прежний reply_invoice или вернуть ошибку
-            print("⚠️ confirmation_url not found — falling back to reply_invoice (or abort).")
+            logger.warning("⚠️ confirmation_url not found — falling back to reply_invoice (or abort).")
             # (опционально) отправим ошибочный ответ
             await update.message.reply_text("⚠️ Не удалось сформировать ссылку для оплаты. Попробуйте снова.")
             return
@@ -590,7 +623,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text("✅ Данные получены!")
 
     except Exception as e:
-        print(f"❌ Error handling WebApp data: {e}")
+        logger.error(f"❌ Error handling WebApp data: {e}")
         await update.message.reply_text("❌ Ошибка обработки данных от приложения")
 
 async def handle_successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -602,11 +635,11 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
     yk_id = pending_meta.get("yookassa_payment_id")
     
     if yk_id and yk_id in YK_PENDING:
-        print(f"💰 Payment succeeded, removing {yk_id} from YK_PENDING")
+        logger.info(f"💰 Payment succeeded, removing {yk_id} from YK_PENDING")
         YK_PENDING.pop(yk_id, None)
 
     if not yk_id:
-        print("⚠️ yookassa_payment_id не найден в context.user_data, пробуем provider_payment_charge_id как fallback")
+        logger.warning("⚠️ yookassa_payment_id не найден в context.user_data, пробуем provider_payment_charge_id как fallback")
         yk_id = payment.provider_payment_charge_id
 
     # Получаем ключи
@@ -616,11 +649,11 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
     message = update.message or \
         (update.callback_query.message if update.callback_query else None)
     if not message:
-        print("⚠️ successful_payment пришёл, но message нет!")
+        logger.warning("⚠️ successful_payment пришёл, но message нет!")
         return
 
     payment = message.successful_payment
-    print("🎉 PAYMENT DATA:", payment.to_dict())
+    logger.debug("🎉 PAYMENT DATA: %s", payment.to_dict())
         
     # Если есть yk_id и креды — делаем запрос в YooKassa, чтобы получить официальные metadata
     remote_meta = {}
@@ -631,13 +664,13 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
                 async with session.get(f"https://api.yookassa.ru/v3/payments/{yk_id}", auth=auth) as resp:
                     if resp.status == 200:
                         payment_data = await resp.json()
-                        print(f"📦 Ответ YooKassa: {json.dumps(payment_data, ensure_ascii=False, indent=2)}")
+                        logger.info(f"📦 Ответ YooKassa: id={payment_data.get('id')} status={payment_data.get('status')}")
                         remote_meta = payment_data.get("metadata", {}) or {}
                     else:
                         text = await resp.text()
-                        print(f"⚠️ YooKassa returned {resp.status}: {text}")
+                        logger.warning(f"⚠️ YooKassa returned {resp.status}: {text}")
         except Exception as e:
-            print(f"❌ Ошибка при запросе к YooKassa: {e}")
+            logger.error(f"❌ Ошибка при запросе к YooKassa: {e}")
 
     # Если remote_meta пустой — используем pending_meta, иначе используем remote_meta (точнее)
     meta = remote_meta or pending_meta or {}
@@ -654,27 +687,25 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
 
     if not (user_id and url and name and scheduled_date):
         await update.message.reply_text("⚠️ Не удалось получить все данные заказа из платежа. Обратитесь в поддержку.")
-        print("❌ Недостаточно данных для добавления товара:", meta)
+        logger.error("❌ Недостаточно данных для добавления товара: %s", meta)
         return
 
     # Отправляем на backend /api/products/add
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{BACKEND_URL}/api/products/add",
-                json={
-                    "user_id": user_id,
-                    "url": url,
-                    "name": name,
-                    "description": meta.get("description") or "",
-                    "image_url": meta.get("image_url") or None,
-                    "price": float(meta.get("price") or 0),
-                    "scheduled_date": scheduled_date,
-                    "category": category,
-                },
-            ) as resp:
-                result = await resp.json()
-                print(f"📦 Ответ от /api/products/add: {result}")
+        backend = await get_backend_client(BACKEND_URL)
+        result = await backend.add_product({
+            "user_id": user_id,
+            "url": url,
+            "name": name,
+            "description": meta.get("description") or "",
+            "image_url": meta.get("image_url") or None,
+            "price": float(meta.get("price") or 0),
+            "scheduled_date": scheduled_date,
+            "category": category,
+            # снимок парсинга из веб-приложения — бэкенд не будет парсить товар заново
+            "snapshot_token": meta.get("snapshot_token") or pending_meta.get("snapshot_token"),
+        })
+        logger.info(f"📦 Ответ от /api/products/add: {result}")
 
         if result.get("success"):
             await update.message.reply_text("✅ Оплата подтверждена! Товар добавлен в очередь на выкладку.")
@@ -683,7 +714,7 @@ async def handle_successful_payment(update: Update, context: ContextTypes.DEFAUL
         else:
             await update.message.reply_text(f"⚠️ Оплата прошла, но не удалось добавить товар: {result.get('error')}")
     except Exception as e:
-        print(f"❌ Ошибка при добавлении товара после оплаты: {e}")
+        logger.error(f"❌ Ошибка при добавлении товара после оплаты: {e}")
         await update.message.reply_text("❌ Ошибка при добавлении товара в базу.")
 
 async def pre_checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -693,7 +724,7 @@ async def pre_checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     payload = query.invoice_payload
     chat_id = query.from_user.id
 
-    print("💳 pre_checkout:", yk_id, payload)
+    logger.info("💳 pre_checkout: %s %s", yk_id, payload)
 
     # попытка найти message_id для данного payload (если уже отправляли invoice)
     invoice_info = SENT_INVOICES.get(payload)
@@ -706,7 +737,7 @@ async def pre_checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         #     "invoice_message_id": invoice_msg_id,
         #     "created_at": time.time(),
         # }
-        print(f"🧾 Registered pending yk id from precheckout: {yk_id} -> msg={invoice_msg_id}")
+        logger.info(f"🧾 Registered pending yk id from precheckout: {yk_id} -> msg={invoice_msg_id}")
 
         # (опционально) создаём кратковременную задачу-страховку
         asyncio.create_task(
@@ -738,15 +769,15 @@ async def auto_cancel_yookassa_loop():
                 # перепроверим реальный статус у YooKassa
                 yk_info = await fetch_yk_payment(payment_id )
                 if not yk_info:
-                    print(f"ℹ️ auto_cancel: не удалось fetch yk {payment_id }, пропускаем")
+                    logger.info(f"ℹ️ auto_cancel: не удалось fetch yk {payment_id }, пропускаем")
                     continue
                 status = yk_info.get("status")
-                print(f"ℹ️ auto_cancel: status for {payment_id } = {status} (age={age:.1f}s)")
+                logger.info(f"ℹ️ auto_cancel: status for {payment_id } = {status} (age={age:.1f}s)")
 
                 # отменяем только если реально в pending
                 if status in ("pending", "waiting_for_capture"):
                     code, text = await cancel_yk_payment(payment_id )
-                    print(f"🗑 YK cancel {payment_id } → {code} {text}")
+                    logger.info(f"🗑 YK cancel {payment_id } → {code} {text}")
 
                     # уведомим пользователя
                     # try:
@@ -764,63 +795,75 @@ async def auto_cancel_yookassa_loop():
                         if info.get("invoice_message_id") and BOT:
                             await BOT.delete_message(chat_id=info["chat_id"], message_id=info["invoice_message_id"])
                     except Exception as e:
-                        print("⚠️ Ошибка при удалении invoice message после автo-отмены:", e)
+                        logger.warning("⚠️ Ошибка при удалении invoice message после автo-отмены: %s", e)
 
                     PROCESSED_PAYMENTS[payment_id ] = {"status": "canceled", "ts": time.time()}
                     expired.append(payment_id )
                 else:
                     # если уже succeeded/captured — просто убираем pending и не шлём cancel уведомление
                     if status in ("succeeded", "captured"):
-                        print(f"✅ auto_cancel: {payment_id } уже {status} — убираем из очереди")
+                        logger.info(f"✅ auto_cancel: {payment_id } уже {status} — убираем из очереди")
                         expired.append(payment_id )
 
             except Exception as e:
-                print("⚠️ Ошибка в auto_cancel loop при обработке", payment_id , e)
+                logger.warning("⚠️ Ошибка в auto_cancel loop при обработке %s %s", payment_id, e)
 
         for payment_id  in expired:
             YK_PENDING.pop(payment_id , None)
 
         await asyncio.sleep(5)
 async def on_startup(application):
-    global BOT
+    global BOT, METRICS_RUNNER
     # application — это Application из python-telegram-bot; у него есть .bot
     BOT = application.bot
+    # общий клиент к бэкенду — одна сессия с keep-alive на все апдейты
+    await get_backend_client(BACKEND_URL)
+    LOOP_MONITOR.start()
+    if BOT_METRICS_PORT:
+        METRICS_RUNNER = await start_metrics_server(BOT_METRICS_PORT)
+        logger.info(f"📊 Метрики бота: :{BOT_METRICS_PORT}/metrics")
     # запускаем цикл авто-отмен
     # asyncio.create_task(auto_cancel_yookassa_loop())
-    print("🚀 Auto-cancel loop started — bot attached")
+    logger.info("🚀 Auto-cancel loop started — bot attached")
+
+async def on_shutdown(application):
+    await close_backend_client()
+    await LOOP_MONITOR.stop()
+    if METRICS_RUNNER:
+        await METRICS_RUNNER.cleanup()
 
 async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.pre_checkout_query
     try:
         invoice_payload = query.invoice_payload
-        print(f"➡️ PreCheckout received. invoice_payload={invoice_payload} from user={query.from_user.id}")
+        logger.info(f"➡️ PreCheckout received. invoice_payload={invoice_payload} from user={query.from_user.id}")
 
         # логируем соответствие сохранённых инвойсов
         sent = SENT_INVOICES.get(invoice_payload)
         if sent:
-            print(f"🔎 Matched sent invoice: {sent}")
+            logger.info(f"🔎 Matched sent invoice: {sent}")
             # можно дополнительно проверить возраст инвойса
             age = int(time.time()) - sent["ts"]
             if age > 60 * 11:  # 15 минут
-                print("⚠️ Invoice older than 15min, rejecting precheckout to force new flow.")
+                logger.warning("⚠️ Invoice older than 15min, rejecting precheckout to force new flow.")
                 await query.answer(ok=False, error_message="Срок формы оплаты истёк — откройте форму снова.")
                 return
 
             # всё ок — подтверждаем
             await query.answer(ok=True)
-            print(f"✅ PreCheckout confirmed: {invoice_payload}")
+            logger.info(f"✅ PreCheckout confirmed: {invoice_payload}")
         else:
             # Нет соответствия — логируем ВАЖНО и НЕ подтверждаем, чтобы не создавать неотслеживаемые оплаты
-            print(f"❌ PreCheckout payload NOT FOUND in SENT_INVOICES! payload={invoice_payload}")
+            logger.error(f"❌ PreCheckout payload NOT FOUND in SENT_INVOICES! payload={invoice_payload}")
             # Включаем подробное состояние pending keys
-            print("CURRENT PENDING_KEYS:", list(PENDING_MESSAGES.keys()))
-            print("CURRENT SENT_PAYLOADS:", list(SENT_INVOICES.keys())[:50])
+            logger.debug("CURRENT PENDING_KEYS: %s", list(PENDING_MESSAGES.keys()))
+            logger.debug("CURRENT SENT_PAYLOADS: %s", list(SENT_INVOICES.keys())[:50])
             # можно временно ответить false, чтобы клиент увидел ошибку и не продолжал
             await query.answer(ok=False, error_message="Не найдено соответствие инвойсу. Откройте оплату снова.")
             return
 
     except Exception as e:
-        print(f"❌ Ошибка precheckout: {e}")
+        logger.error(f"❌ Ошибка precheckout: {e}")
         try:
             await query.answer(ok=False, error_message="Ошибка при подготовке оплаты. Попробуйте снова.")
         except Exception:
@@ -853,6 +896,51 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+async def admin_loop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Задержка event loop бота и последние блокировки"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ У вас нет доступа.")
+        return
+
+    stats = LOOP_MONITOR.stats()
+    lines = [
+        f"🩺 Event loop: p50 {stats['p50_ms']}ms, p90 {stats['p90_ms']}ms, p99 {stats['p99_ms']}ms, max {stats['max_ms']}ms",
+        f"Блокировок > {stats['threshold_ms']:.0f}ms: {len(stats['stalls'])}",
+    ]
+    for stall in stats["stalls"][:3]:
+        where = stall["stack"][-1].strip().splitlines()[0] if stall.get("stack") else "стек не снят"
+        lines.append(f"• {stall.get('lag_ms') or '?'}ms — {where}")
+    await update.message.reply_text("\n".join(lines))
+
+async def admin_memory(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Память бота: глобальные словари и кэши; /memory trace — разница снимков tracemalloc, /memory stop — выключить"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ У вас нет доступа.")
+        return
+
+    mode = context.args[0] if context.args else ""
+    if mode == "stop":
+        tracer.stop()
+        await update.message.reply_text("🧠 tracemalloc выключен")
+        return
+
+    report = await memory_report(trace=(mode == "trace"), top=10)
+    lines = [f"🧠 RSS {format_bytes(report['rss_bytes'])}, счётчики GC: {'/'.join(map(str, report['gc_counts']))}"]
+    for row in report["tracked"]:
+        approx = "~" if row["approx"] else ""
+        lines.append(
+            f"• {row['name']}: {row['len']} зап., {approx}{format_bytes(row['bytes'])} "
+            f"({row['len_delta']:+d} / {format_bytes(row['bytes_delta'])})"
+        )
+    traced = report.get("tracemalloc")
+    if traced and traced.get("note"):
+        lines.append(f"\n{traced['note']}")
+    elif traced and traced.get("top"):
+        lines.append(f"\n📈 Прирост за {traced['since_seconds']}s:")
+        for stat in traced["top"]:
+            lines.append(f"{format_bytes(stat['size_delta'])} — {stat['where']}")
+    await update.message.reply_text("\n".join(lines))
+
 async def stats_months_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возвращает список месяцев"""
     query = update.callback_query
@@ -889,13 +977,11 @@ async def month_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Получаем статистику за месяц
-    async with aiohttp.ClientSession() as session:
-        url = f"{BACKEND_URL}/api/admin/stats?type=month&year={year}&month={month}"
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                await query.edit_message_text("⚠️ Ошибка при запросе статистики.")
-                return
-            data = await resp.json()
+    backend = await get_backend_client(BACKEND_URL)
+    data = await backend.admin_stats(type="month", year=year, month=month)
+    if data is None:
+        await query.edit_message_text("⚠️ Ошибка при запросе статистики.")
+        return
 
     if not data.get("success") or "stats" not in data:
         await query.edit_message_text("⚠️ Ошибка ответа от сервера.")
@@ -951,13 +1037,11 @@ async def week_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     start_day = 1 + (week - 1) * 7
     end_day = min(start_day + 6, days_in_month)
 
-    async with aiohttp.ClientSession() as session:
-        url = f"{BACKEND_URL}/api/admin/stats?type=week&year={year}&month={month}&week={week}"
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                await query.edit_message_text("⚠️ Ошибка при запросе статистики.")
-                return
-            data = await resp.json()
+    backend = await get_backend_client(BACKEND_URL)
+    data = await backend.admin_stats(type="week", year=year, month=month, week=week)
+    if data is None:
+        await query.edit_message_text("⚠️ Ошибка при запросе статистики.")
+        return
 
     if not data.get("success") or "stats" not in data:
         await query.edit_message_text("⚠️ Ошибка данных с сервера.")
@@ -982,13 +1066,11 @@ async def stats_today_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
 
-    async with aiohttp.ClientSession() as session:
-        url = f"{BACKEND_URL}/api/admin/stats?type=day"
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                await query.edit_message_text("⚠️ Ошибка при запросе статистики.")
-                return
-            data = await resp.json()
+    backend = await get_backend_client(BACKEND_URL)
+    data = await backend.admin_stats(type="day")
+    if data is None:
+        await query.edit_message_text("⚠️ Ошибка при запросе статистики.")
+        return
 
     if not data.get("success") or "stats" not in data:
         await query.edit_message_text("⚠️ Ошибка ответа от сервера.")
@@ -1041,13 +1123,14 @@ async def remove_webhook_before_start(application):
     await application.bot.delete_webhook(drop_pending_updates=True)
 
 if __name__ == "__main__":
-    print("🚀 Запускаю бота для Wildberries...")
-    print(f"🔑 Токен: {BOT_TOKEN[:10]}...")
-    print(f"🌐 Web App URL: {WEB_APP_URL}")
-    print(f"📞 Поддержка: {SUPPORT_USERNAME}")
+    logger.info("🚀 Запускаю бота для Wildberries...")
+    logger.info(f"🔑 Токен: {BOT_TOKEN[:10]}...")
+    logger.info(f"🌐 Web App URL: {WEB_APP_URL}")
+    logger.info(f"📞 Поддержка: {SUPPORT_USERNAME}")
+    logger.info(f"⚙️ Event loop: {install_event_loop()}")
     
     try:
-        app = Application.builder().token(BOT_TOKEN).post_init(on_startup).build()
+        app = Application.builder().token(BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
         
         # Обработчики
         app.add_handler(CommandHandler("start", start))
@@ -1059,14 +1142,15 @@ if __name__ == "__main__":
         app.add_handler(CommandHandler("stats", admin_stats))
         app.add_handler(CommandHandler("stats", admin_stats))
         app.add_handler(CommandHandler("debug_channel", debug_channel))
+        app.add_handler(CommandHandler("loop", admin_loop))
+        app.add_handler(CommandHandler("memory", admin_memory))
         app.add_handler(CallbackQueryHandler(stats_months_callback, pattern="^stats_months$"))
         app.add_handler(CallbackQueryHandler(stats_today_callback, pattern="^stats_today$"))
         app.add_handler(CallbackQueryHandler(month_callback, pattern=r"^month:\d{4}:\d{1,2}$"))
         app.add_handler(CallbackQueryHandler(week_callback, pattern=r"^week:\d{4}:\d{1,2}:\d+$"))
         app.add_handler(PreCheckoutQueryHandler(pre_checkout_handler))
         
-        print("✅ Бот запущен!")
-        logging.basicConfig(level=logging.DEBUG)
+        logger.info("✅ Бот запущен!")
         app.run_polling(allowed_updates=Update.ALL_TYPES, poll_interval=0.3)
     except Exception as e:
-        print(f"❌ Ошибка: {e}")
+        logger.error(f"❌ Ошибка: {e}")
@@ -0,0 +1,245 @@
+# memory_diag.py
+import asyncio
+import gc
+import itertools
+import linecache
+import os
+import sys
+import time
+import tracemalloc
+import types
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Сколько кадров стека хранит tracemalloc на каждое выделение (больше — точнее и дороже)
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+MEMORY_TOP = int(os.getenv("MEMORY_TOP", "25"))
+# У больших словарей меряем первые N записей и экстраполируем — иначе обход кэша держит event loop
+MEMORY_SAMPLE_ITEMS = int(os.getenv("MEMORY_SAMPLE_ITEMS", "500"))
+MEMORY_MAX_DEPTH = 6
+
+_ATOMIC = (str, bytes, int, float, bool, complex, type(None))
+# функции, классы и модули общие для всех — в размер кэша их не включаем
+_SKIP = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType)
+
+# имя -> отслеживаемый объект; лениво создаваемые — через track_group
+_tracked: Dict[str, Any] = {}
+_groups: List[Callable[[], Dict[str, Any]]] = []
+_previous: Dict[str, Tuple[int, int]] = {}
+
+
+def track(name: str, obj: Any):
+    """Регистрирует глобальный словарь/кэш для отчёта о памяти."""
+    _tracked[name] = obj
+
+
+def track_group(getter: Callable[[], Dict[str, Any]]):
+    """Набор объектов, известный только в момент отчёта (например, кэши ещё не созданного парсера)."""
+    _groups.append(getter)
+
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_own_types: Dict[type, bool] = {}
+
+
+def _is_own(cls: type) -> bool:
+    """Внутрь объектов заходим, только если класс из этого проекта — не в event loop, сессии и задачи."""
+    own = _own_types.get(cls)
+    if own is None:
+        module = sys.modules.get(cls.__module__)
+        path = getattr(module, "__file__", None) or ""
+        own = _own_types[cls] = os.path.dirname(os.path.abspath(path)) == _HERE if path else False
+    return own
+
+
+def _children(obj: Any):
+    if isinstance(obj, dict):
+        return itertools.chain.from_iterable(obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return iter(obj)
+    if not _is_own(type(obj)):
+        return iter(())
+    items = []
+    if hasattr(obj, "__dict__"):
+        items.append(vars(obj))
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if hasattr(obj, slot):
+                items.append(getattr(obj, slot))
+    return iter(items)
+
+
+def _size(obj: Any, seen: set, depth: int) -> int:
+    if id(obj) in seen or isinstance(obj, _SKIP):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, _ATOMIC) or depth >= MEMORY_MAX_DEPTH:
+        return size
+    for child in _children(obj):
+        size += _size(child, seen, depth + 1)
+    return size
+
+
+def deep_size(obj: Any, sample: int = MEMORY_SAMPLE_ITEMS) -> Tuple[int, bool]:
+    """
+    Примерный размер объекта вместе с содержимым (байты) и флаг «экстраполировано».
+    У контейнеров больше sample записей меряется начало, остальное досчитывается по среднему.
+    """
+    seen: set = set()
+    if not isinstance(obj, (dict, list, tuple, set, frozenset)) and hasattr(obj, "__dict__") and _is_own(type(obj)):
+        # объект-кэш: самый большой контейнер обычно лежит в его атрибутах — меряем их по отдельности
+        total = sys.getsizeof(obj, 0)
+        approx = False
+        seen.add(id(obj))
+        for value in vars(obj).values():
+            part, part_approx = deep_size(value, sample)
+            total += part
+            approx = approx or part_approx
+        return total, approx
+
+    count = _len(obj)
+    if count is None or count <= sample or not isinstance(obj, (dict, list, tuple, set, frozenset, deque)):
+        return _size(obj, seen, 0), False
+
+    seen.add(id(obj))
+    # ключи и значения по отдельности: временные кортежи items() переиспользуют id и сбили бы seen
+    head = itertools.islice(itertools.chain.from_iterable(obj.items()) if isinstance(obj, dict) else obj,
+                            2 * sample if isinstance(obj, dict) else sample)
+    measured = sum(_size(item, seen, 1) for item in head)
+    return sys.getsizeof(obj, 0) + measured * count // sample, True
+
+
+def _len(obj: Any) -> Optional[int]:
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+def tracked_report() -> List[Dict[str, Any]]:
+    """Размер и число записей каждого зарегистрированного объекта с приростом с прошлого вызова."""
+    objects: Dict[str, Any] = dict(_tracked)
+    for getter in _groups:
+        try:
+            objects.update(getter())
+        except Exception:
+            continue
+
+    rows = []
+    for name, obj in objects.items():
+        if obj is None:
+            continue
+        size, approx = deep_size(obj)
+        length = _len(obj)
+        prev_len, prev_size = _previous.get(name, (length or 0, size))
+        _previous[name] = (length or 0, size)
+        rows.append({
+            "name": name,
+            "type": type(obj).__name__,
+            "len": length,
+            "bytes": size,
+            "approx": approx,
+            "len_delta": (length or 0) - prev_len,
+            "bytes_delta": size - prev_size,
+        })
+    rows.sort(key=lambda row: row["bytes"], reverse=True)
+    return rows
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MallocTracer:
+    """
+    tracemalloc по запросу: первый вызов включает трассировку, каждый следующий снимает snapshot
+    и сравнивает с предыдущим — видно, какие строки кода набрали память между вызовами.
+    """
+
+    def __init__(self, frames: int = MEMORY_TRACE_FRAMES):
+        self.frames = frames
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._taken_at = 0.0
+
+    @staticmethod
+    def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def _diff(self, top: int, group_by: str) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._snapshot = self._filtered(tracemalloc.take_snapshot())
+            self._taken_at = time.time()
+            return {"tracing": True, "started": True, "note": "Трассировка включена — повторите запрос, чтобы увидеть прирост"}
+
+        snapshot = self._filtered(tracemalloc.take_snapshot())
+        previous, previous_at = self._snapshot, self._taken_at
+        self._snapshot, self._taken_at = snapshot, time.time()
+        current, peak = tracemalloc.get_traced_memory()
+        stats = snapshot.compare_to(previous, group_by) if previous is not None else snapshot.statistics(group_by)
+        return {
+            "tracing": True,
+            "started": False,
+            "since_seconds": round(self._taken_at - previous_at, 1),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "top": [
+                {
+                    "where": str(stat.traceback[0]) if stat.traceback else "?",
+                    "size_bytes": stat.size,
+                    "size_delta": getattr(stat, "size_diff", stat.size),
+                    "count": stat.count,
+                    "count_delta": getattr(stat, "count_diff", stat.count),
+                }
+                for stat in stats[:top]
+            ],
+        }
+
+    async def diff(self, top: int = MEMORY_TOP, group_by: str = "lineno") -> Dict[str, Any]:
+        # snapshot и сравнение — в потоке, чтобы event loop не стоял на сотнях тысяч трасс
+        return await asyncio.to_thread(self._diff, top, group_by)
+
+    def stop(self) -> Dict[str, Any]:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._snapshot = None
+        return {"tracing": False}
+
+
+tracer = MallocTracer()
+
+
+async def memory_report(trace: bool = False, top: int = MEMORY_TOP) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "rss_bytes": _rss_bytes(),
+        # только счётчики поколений: len(gc.get_objects()) обходит все живые объекты под GIL и держит event loop
+        "gc_counts": gc.get_count(),
+        "tracked": tracked_report(),
+    }
+    if trace:
+        report["tracemalloc"] = await tracer.diff(top)
+    elif tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"] = {"tracing": True, "traced_bytes": current, "traced_peak_bytes": peak}
+    return report
+
+
+def format_bytes(size: Optional[int]) -> str:
+    if size is None:
+        return "?"
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
@@ -0,0 +1,256 @@
+# metrics.py
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Границы корзин по умолчанию (секунды): от 1 мс до 30 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: Any):
+        """Дочерняя серия для набора меток — её стоит держать в переменной на горячем пути."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in self._children.items():
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    @abstractmethod
+    def _render_child(self, key, child) -> List[str]:
+        ...
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_labels_text(self.labelnames, key)} {_number(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя — +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            le = f'le="{_number(bound)}"'
+            lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """Значение считается в момент выдачи /metrics: fn() -> число или [(метки, число), ...]."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def labels(self, *values: Any):
+        raise TypeError(f"{self.name}: у GaugeFunc нет дочерних серий — метки задаёт fn()")
+
+    def _new_child(self):
+        raise TypeError(f"{self.name}: у GaugeFunc нет дочерних серий — метки задаёт fn()")
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_labels_text(self.labelnames, key)} {_number(child)}"]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        items: Iterable = value if self.labelnames else [((), value)]
+        for key, v in items:
+            lines.extend(self._render_child(key, v))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.get(name) or self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.get(name) or self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> GaugeFunc:
+        return self.register(GaugeFunc(name, help, fn, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Наблюдатели замеров (metric_name, labels, started, duration) — например, спаны профилировщика
+span_observers: List[Callable[[str, Tuple[Any, ...], Any, float], None]] = []
+
+
+def observe(metric: Histogram, labels: Tuple[Any, ...], duration: float, started: float = None):
+    """Замер, посчитанный вручную: то же, что timed, но без with-блока."""
+    metric.labels(*labels).observe(duration)
+    for observer in span_observers:
+        observer(metric.name, labels, started, duration)
+
+
+class timed:
+    """
+    with timed(WB_LATENCY, "detail"): ... — пишет длительность блока в гистограмму.
+    Записи — обычные операции с числами в одном потоке event loop, без блокировок.
+    """
+
+    __slots__ = ("metric", "labels", "child", "started")
+
+    def __init__(self, metric: Histogram, *labels: Any):
+        self.metric = metric
+        self.labels = labels
+        self.child = metric.labels(*labels)
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        self.child.observe(duration)
+        for observer in span_observers:
+            observer(self.metric.name, self.labels, self.started, duration)
+        return False
+
+
+registry = Registry()
+
+# --- Горячий путь ---
+HTTP_LATENCY = registry.histogram("http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route"))
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP-запросы по статусам", ("method", "route", "status"))
+WB_LATENCY = registry.histogram("wb_request_duration_seconds", "Запросы к WB: detail, card, image_probe, batch, subjects", ("call",))
+WB_ERRORS = registry.counter("wb_errors_total", "Неудачные запросы к WB", ("call",))
+YOOKASSA_LATENCY = registry.histogram("yookassa_request_duration_seconds", "Запросы к YooKassa", ("op",))
+TELEGRAM_LATENCY = registry.histogram("telegram_request_duration_seconds", "Вызовы Telegram Bot API", ("method",))
+DB_LATENCY = registry.histogram("db_session_duration_seconds", "Время удержания сессии БД", ("op",))
+BACKEND_CALLS = registry.histogram("backend_call_duration_seconds", "Вызовы бэкенда из бота", ("route",))
+CACHE = registry.counter("cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+RETRIES = registry.counter("retries_total", "Повторы запросов", ("op",))
+POSTS = registry.counter("posts_total", "Посты: scheduled, published, failed", ("event",))
+LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds",
+    "Задержка планирования event loop",
+    ("process",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = registry.counter("event_loop_stalls_total", "Блокировки event loop дольше порога", ("process",))
+
+
+def cache_result(cache: str, hit: bool):
+    CACHE.labels(cache, "hit" if hit else "miss").inc()
+
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Отдельный /metrics для процесса без HTTP-сервера (бот). Возвращает runner для остановки."""
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,14 +1,65 @@
 # new_parser.py
 import aiohttp
+import os
 import re
+import time
 import asyncio
 import logging
-from typing import Dict, Optional, List, Any
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, List, Any, AsyncIterator, Tuple, Callable, Awaitable
+
+if __package__:
+    from .subject_index import subject_index
+    from .wb_regions import RegionalPrices, PRIMARY_DEST
+    from .price_history import price_history
+    from .metrics import WB_LATENCY, WB_ERRORS, cache_result, timed
+    from .app_logging import LOG_SAMPLE_EVERY
+    from .runtime import json_loads
+else:
+    from subject_index import subject_index
+    from wb_regions import RegionalPrices, PRIMARY_DEST
+    from price_history import price_history
+    from metrics import WB_LATENCY, WB_ERRORS, cache_result, timed
+    from app_logging import LOG_SAMPLE_EVERY
+    from runtime import json_loads
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Какие поля итога зависят от какого этапа — для пометки недостающих при частичном результате
+STAGE_FIELDS = {
+    "card": ["description", "characteristics"],
+    "detail": ["price", "basic_price", "discount", "stocks", "stocks_by_size", "rating", "feedbacks", "seller"],
+    "images": ["images"],
+}
+
+BackfillListener = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Хосты, к которым идёт почти каждый парсинг: card.json, detail и первые корзины картинок
+WB_HOT_HOSTS = [
+    "https://card.wb.ru",
+    "https://sam-basket-cdn-01mt.geobasket.ru",
+    "https://sam-basket-cdn-03mt.geobasket.ru",
+    "https://basket-01.wbbasket.ru",
+]
+
+
 class WBParser:
+    def __init__(
+        self,
+        cache_ttl: float = float(os.getenv("PARSE_CACHE_TTL", "300")),
+        cache_size: int = int(os.getenv("PARSE_CACHE_SIZE", "2000")),
+    ):
+        self.session = None
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # articul -> (ts, полный результат парсинга); LRU, не больше cache_size записей
+        self._result_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._backfill_listeners: List[BackfillListener] = []
+        self._background: set = set()
+        self.regions = RegionalPrices(self.fetch_details_batch)
+
     async def setup(self):
         if not hasattr(self, 'session') or self.session is None:
             self.session = aiohttp.ClientSession()
@@ -20,6 +71,30 @@ class WBParser:
             self.session = None
             logger.info("🛑 Сессия aiohttp закрыта")
 
+    async def prewarm(self, hosts: List[str] = WB_HOT_HOSTS):
+        """DNS, TCP и TLS к горячим хостам WB заранее — соединения остаются в пуле сессии."""
+        await self.setup()
+
+        async def touch(host: str):
+            async with self.session.head(host + "/", timeout=aiohttp.ClientTimeout(total=5), allow_redirects=False) as resp:
+                await resp.release()
+
+        results = await asyncio.gather(*(touch(host) for host in hosts), return_exceptions=True)
+        failed = [host for host, result in zip(hosts, results) if isinstance(result, Exception)]
+        if len(failed) == len(hosts):
+            raise ConnectionError(f"WB недоступен: {', '.join(failed)}")
+
+    @asynccontextmanager
+    async def _wb_request(self, call: str, method: str, url: str, **kwargs):
+        """Запрос к WB с замером времени в wb_request_duration_seconds{call}."""
+        with timed(WB_LATENCY, call):
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    yield resp
+            except Exception:
+                WB_ERRORS.labels(call).inc()
+                raise
+
     @staticmethod
     def extract_articul(url: str) -> Optional[str]:
         m = re.search(r'/catalog/(\d+)/detail', url)
@@ -41,9 +116,9 @@ class WBParser:
         part = articul[:6]
         json_url = f"https://sam-basket-cdn-01mt.geobasket.ru/vol{vol}/part{part}/{articul}/info/ru/card.json"
         try:
-            async with self.session.get(json_url, timeout=10) as resp:
+            async with self._wb_request("card", "GET", json_url, timeout=10) as resp:
                 if resp.status == 200:
-                    data = await resp.json()
+                    data = await resp.json(loads=json_loads)
                     name = data.get("imt_name") or data.get("name") or ""
                     brand = data.get("selling", {}).get("brand_name") or data.get("brand") or ""
                     description = data.get("description") or data.get("shortDescription") or ""
@@ -97,7 +172,7 @@ class WBParser:
             await self.setup()
         try:
             # HEAD
-            async with self.session.head(url, timeout=timeout, allow_redirects=True) as resp:
+            async with self._wb_request("image_probe", "HEAD", url, timeout=timeout, allow_redirects=True) as resp:
                 if resp.status == 200:
                     ctype = resp.headers.get("Content-Type", "")
                     if ctype and ("image" in ctype or "webp" in ctype):
@@ -107,7 +182,7 @@ class WBParser:
         except Exception:
             # попробуем GET, но не читаем тело полностью
             try:
-                async with self.session.get(url, timeout=timeout, allow_redirects=True) as resp:
+                async with self._wb_request("image_probe", "GET", url, timeout=timeout, allow_redirects=True) as resp:
                     if resp.status == 200:
                         ctype = resp.headers.get("Content-Type", "")
                         if ctype and ("image" in ctype or "webp" in ctype or "jpeg" in ctype or "jpg" in ctype):
@@ -175,7 +250,8 @@ class WBParser:
             subdir_path = f"/{subdir}" if subdir else ""
             logger.info(
                 f"🖼️ Найден CDN для {articul}: {domain} "
-                f"(vol={vol}, part={part}, subdir='{subdir}', ext={ext})"
+                f"(vol={vol}, part={part}, subdir='{subdir}', ext={ext})",
+                extra={"sample": LOG_SAMPLE_EVERY},
             )
             return [
                 f"{domain}/vol{vol}/part{part}/{articul}/images{subdir_path}/{i}.{ext}"
@@ -196,18 +272,35 @@ class WBParser:
         Получение деталей товара через card.wb.ru (v2).
         Возвращает: id, name, price, basic_price, seller, rating, feedbacks, stocks, stocks_by_size, images.
         """
+        result = await self.fetch_api_detail(articul)
+        if not result:
+            return {}
+        pics_count = result.pop("_pics", 0)
+        result["images"] = await self._find_images_for_pics(articul, pics_count)
+        return result
+
+    async def _find_images_for_pics(self, articul: str, pics_count: int) -> List[str]:
+        if pics_count > 0:
+            return await self._find_valid_images(articul, candidate_idxs=list(range(1, min(pics_count, 3) + 1)))
+        return await self._find_valid_images(articul, candidate_idxs=[1, 2], max_images=2)
+
+    async def fetch_api_detail(self, articul: str) -> Dict[str, Any]:
+        """
+        Детали товара из card.wb.ru без поиска картинок (он самый долгий).
+        Количество фото возвращается в служебном поле _pics.
+        """
         if not self.session:
             await self.setup()
 
-        url = f"https://card.wb.ru/cards/v2/detail?appType=1&curr=rub&dest=-1257786&lang=ru&nm={articul}"
-        logger.info(f"📩 Запрос к WB API: {url}")
+        url = f"https://card.wb.ru/cards/v2/detail?appType=1&curr=rub&dest={PRIMARY_DEST}&lang=ru&nm={articul}"
+        logger.info(f"📩 Запрос к WB API: {url}", extra={"sample": LOG_SAMPLE_EVERY})
 
         try:
-            async with self.session.get(url, timeout=10) as resp:
+            async with self._wb_request("detail", "GET", url, timeout=10) as resp:
                 if resp.status != 200:
                     logger.error(f"❌ WB API вернул статус {resp.status} для артикула {articul}")
                     return {}
-                data = await resp.json()
+                data = await resp.json(loads=json_loads)
         except Exception as e:
             logger.error(f"❌ Ошибка запроса к WB API для артикула {articul}: {e}", exc_info=True)
             return {}
@@ -220,9 +313,42 @@ class WBParser:
         p = products[0]
         sizes = p.get("sizes") or []
 
-        logger.info(f"💰 WB RAW: salePriceU={p.get('salePriceU')}, priceU={p.get('priceU')} | sizes_count={len(sizes)}")
+        logger.debug(f"💰 WB RAW: salePriceU={p.get('salePriceU')}, priceU={p.get('priceU')} | sizes_count={len(sizes)}")
+
+        sale_price, basic_price, discount = self._extract_prices(p, sizes)
+        stocks_by_size, total_stocks = self._extract_stocks(sizes)
+
+        result = {
+            "id": p.get("id") or int(articul),
+            "name": p.get("name"),
+            "brand": p.get("brand"),
+            "supplier": p.get("supplierName") or p.get("supplier"),
+            "seller": p.get("supplierName") or p.get("supplier"),
+            "rating": p.get("reviewRating") or p.get("rating") or 0,
+            "feedbacks": p.get("feedbacks") or 0,
+            "price": round(sale_price, 2),
+            "basic_price": round(basic_price, 2),
+            "discount": discount,
+            "stocks": total_stocks,
+            "stocks_by_size": stocks_by_size,
+            "subject_id": p.get("subjectId"),
+            "subject_parent_id": p.get("subjectParentId"),
+            "_pics": int(p.get("pics") or 0),
+        }
+
+        logger.info(
+            f"✅ Итог для {articul}: price={result['price']} base={result['basic_price']} "
+            f"stocks={result['stocks']} pics={result['_pics']}",
+            extra={"sample": LOG_SAMPLE_EVERY},
+        )
 
-        # --- Цены ---
+        self.regions.store(PRIMARY_DEST, articul, result)
+        price_history.record(articul, result["price"], result["basic_price"], total_stocks)
+        return result
+
+    @staticmethod
+    def _extract_prices(p: Dict[str, Any], sizes: List[Dict[str, Any]]) -> Tuple[float, float, int]:
+        """(цена со скидкой, базовая цена, скидка %) из карточки detail."""
         sale_price = 0.0
         basic_price = 0.0
 
@@ -245,12 +371,14 @@ class WBParser:
                     sale_price = float(price_info.get("product", 0)) / 100.0
                     basic_price = float(price_info.get("basic", 0)) / 100.0
                     if sale_price:
-                        logger.info(f"💰 Fallback price from sizes: {sale_price}/{basic_price}")
+                        logger.info(f"💰 Fallback price from sizes: {sale_price}/{basic_price}", extra={"sample": LOG_SAMPLE_EVERY})
                         break
 
         discount = int(100 - (sale_price / basic_price * 100)) if basic_price else 0
+        return sale_price, basic_price, discount
 
-        # --- Остатки ---
+    @staticmethod
+    def _extract_stocks(sizes: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
         stocks_by_size: List[Dict[str, Any]] = []
         for s in sizes:
             qty = 0
@@ -264,53 +392,73 @@ class WBParser:
                 "qty": qty
             })
         total_stocks = sum(i["qty"] for i in stocks_by_size)
+        return stocks_by_size, total_stocks
 
-        # --- Изображения ---
-        images: List[str] = []
-        pics_count = int(p.get("pics") or 0)
-        if pics_count > 0:
-            images = await self._find_valid_images(articul, candidate_idxs=list(range(1, min(pics_count, 3) + 1)))
-        else:
-            images = await self._find_valid_images(articul, candidate_idxs=[1, 2], max_images=2)
-
-        result = {
-            "id": p.get("id") or int(articul),
-            "name": p.get("name"),
-            "brand": p.get("brand"),
-            "supplier": p.get("supplierName") or p.get("supplier"),
-            "seller": p.get("supplierName") or p.get("supplier"),
-            "rating": p.get("reviewRating") or p.get("rating") or 0,
-            "feedbacks": p.get("feedbacks") or 0,
-            "price": round(sale_price, 2),
-            "basic_price": round(basic_price, 2),
-            "discount": discount,
-            "stocks": total_stocks,
-            "stocks_by_size": stocks_by_size,
-            "images": images,
-        }
-
-        logger.info(
-            f"✅ Итог для {articul}: price={result['price']} base={result['basic_price']} "
-            f"stocks={result['stocks']} images={len(images)}"
-        )
+    async def fetch_details_batch(self, articuls: List[str], dest: int = PRIMARY_DEST) -> Dict[str, Dict[str, Any]]:
+        """
+        Цены и остатки сразу для нескольких артикулов одним запросом (nm=1;2;3) в регионе dest.
+        Возвращает {articul: {price, basic_price, discount, stocks, stocks_by_size}}.
+        """
+        if not articuls:
+            return {}
+        if not self.session:
+            await self.setup()
 
+        url = f"https://card.wb.ru/cards/v2/detail?appType=1&curr=rub&dest={dest}&lang=ru&nm={';'.join(articuls)}"
+        async with self._wb_request("batch", "GET", url, timeout=10) as resp:
+            if resp.status != 200:
+                logger.warning(f"⚠️ WB API вернул статус {resp.status} для пакета из {len(articuls)} (dest={dest})")
+                return {}
+            data = await resp.json(loads=json_loads)
+
+        result: Dict[str, Dict[str, Any]] = {}
+        for p in data.get("data", {}).get("products") or []:
+            sizes = p.get("sizes") or []
+            sale_price, basic_price, discount = self._extract_prices(p, sizes)
+            stocks_by_size, total_stocks = self._extract_stocks(sizes)
+            result[str(p.get("id"))] = {
+                "price": round(sale_price, 2),
+                "basic_price": round(basic_price, 2),
+                "discount": discount,
+                "stocks": total_stocks,
+                "stocks_by_size": stocks_by_size,
+            }
+            # история цен ведётся по основному региону
+            if dest == PRIMARY_DEST:
+                price_history.record(p.get("id"), sale_price, basic_price, total_stocks)
         return result
 
-    async def parse_product(self, url: str) -> Dict[str, Any]:
+    # --- Этапы парсинга ---
+    def _start_stages(self, articul: str) -> Dict[str, "asyncio.Task"]:
         """
-        Основной метод: объединяем card.json и API (api_data имеет приоритет).
+        Запускает этапы конкурентно: card.json и detail параллельно,
+        поиск картинок — сразу после detail (ему нужно число фото).
         """
-        articul = self.extract_articul(url)
-        if not articul:
-            return {"success": False, "error": "Не удалось извлечь артикул из URL", "url": url}
+        card_task = asyncio.create_task(self.parse_card_json(articul))
+        detail_task = asyncio.create_task(self.fetch_api_detail(articul))
+        # остальные регионы — фоном и пакетами, итог их не ждёт
+        self.regions.prefetch(articul)
 
-        await self.setup()
+        async def images_after_detail() -> List[str]:
+            detail = await detail_task
+            if not detail:
+                return []
+            return await self._find_images_for_pics(articul, detail.get("_pics", 0))
 
-        card_data = await self.parse_card_json(articul)
-        api_data = await self.parse_api_detail(articul)
+        images_task = asyncio.create_task(images_after_detail())
+        return {"card": card_task, "detail": detail_task, "images": images_task}
 
-        if not card_data and not api_data:
-            return {"success": False, "error": "Не удалось получить данные о товаре", "articul": articul}
+    @staticmethod
+    def _stage_result(task: "asyncio.Task", default):
+        if not task.done() or task.cancelled() or task.exception() is not None:
+            return default
+        return task.result()
+
+    def _merge(self, articul: str, url: str, card_data: Dict[str, Any], api_data: Dict[str, Any], images: List[str]) -> Dict[str, Any]:
+        """Объединяем card.json и API (api_data имеет приоритет)."""
+        api_data = {k: v for k, v in api_data.items() if k != "_pics"}
+        if api_data and images:
+            api_data["images"] = images
 
         merged: Dict[str, Any] = {**card_data, **api_data}
         merged.update({
@@ -327,9 +475,163 @@ class WBParser:
         if merged.get("supplier") and not merged.get("seller"):
             merged["seller"] = merged.get("supplier")
 
-        # можно удалить сырые данные, если не нужно
-        # merged.pop("raw_product", None)
+        regions = self.regions.snapshot(articul)
+        if regions:
+            merged["regions"] = regions
+
+        # 🏷 Категория из локального справочника предметов — без сетевых запросов
+        subject = subject_index.lookup(merged.get("subject_id"))
+        if subject:
+            subject_name, parent_name = subject
+            if not parent_name:
+                parent = subject_index.lookup(merged.get("subject_parent_id"))
+                parent_name = parent[0] if parent else None
+            merged.setdefault("subject_name", subject_name)
+            merged.setdefault("subcategory", subject_name)
+            merged.setdefault("category", parent_name or subject_name)
+
+        return merged
+
+    async def iter_parse_stages(self, url: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Отдаёт этапы парсинга по мере готовности: articul, card, price, stocks, images, done.
+        Последним всегда идёт done (итог как у parse_product) или error.
+        """
+        articul = self.extract_articul(url)
+        if not articul:
+            yield "error", {"success": False, "error": "Не удалось извлечь артикул из URL", "url": url}
+            return
+
+        await self.setup()
+        yield "articul", {"articul": articul, "url": url}
+
+        subject_index.ensure_fresh(self.session)
+        tasks = self._start_stages(articul)
+        stage_of = {task: name for name, task in tasks.items()}
+        pending = set(tasks.values())
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = stage_of[task]
+                    data = self._stage_result(task, {} if name != "images" else [])
+                    if name == "card" and data:
+                        yield "card", {k: data.get(k) for k in ("name", "brand", "description", "characteristics")}
+                    elif name == "detail" and data:
+                        yield "price", {k: data.get(k) for k in (
+                            "name", "brand", "seller", "supplier", "rating", "feedbacks", "price", "basic_price", "discount",
+                        )}
+                        yield "stocks", {"stocks": data.get("stocks"), "stocks_by_size": data.get("stocks_by_size")}
+                    elif name == "images" and data:
+                        yield "images", {"images": data}
+        finally:
+            # клиент мог отключиться посреди стрима — не оставляем висящие задачи
+            for task in pending:
+                task.cancel()
+
+        card_data = self._stage_result(tasks["card"], {})
+        api_data = self._stage_result(tasks["detail"], {})
+        if not card_data and not api_data:
+            yield "error", {"success": False, "error": "Не удалось получить данные о товаре", "articul": articul}
+            return
+        yield "done", self._merge(articul, url, card_data, api_data, self._stage_result(tasks["images"], []))
+
+    # --- Кэш результатов и досчёт в фоне ---
+    def _cache_get(self, articul: str) -> Optional[Dict[str, Any]]:
+        item = self._result_cache.get(articul)
+        if item and time.monotonic() - item[0] > self.cache_ttl:
+            self._result_cache.pop(articul, None)
+            item = None
+        elif item:
+            self._result_cache.move_to_end(articul)
+        cache_result("parse_result", item is not None)
+        return item[1] if item else None
+
+    def _cache_put(self, articul: str, data: Dict[str, Any]):
+        now = time.monotonic()
+        self._result_cache[articul] = (now, data)
+        self._result_cache.move_to_end(articul)
+        # с начала лежат давно не читанные: выкидываем протухшие, затем лишнее сверх лимита
+        while self._result_cache:
+            oldest_ts, _ = next(iter(self._result_cache.values()))
+            if now - oldest_ts <= self.cache_ttl and len(self._result_cache) <= self.cache_size:
+                break
+            self._result_cache.popitem(last=False)
+
+    def add_backfill_listener(self, listener: BackfillListener):
+        """Колбэк (articul, полный результат) — вызывается, когда досчитался парсинг, отданный частично."""
+        self._backfill_listeners.append(listener)
+
+    async def _notify_backfill(self, articul: str, merged: Dict[str, Any]):
+        for listener in self._backfill_listeners:
+            try:
+                await listener(articul, merged)
+            except Exception as e:
+                logger.error(f"❌ Ошибка backfill-обработчика для {articul}: {e}", exc_info=True)
+
+    async def _finish_in_background(self, articul: str, url: str, tasks: Dict[str, "asyncio.Task"]):
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        card_data = self._stage_result(tasks["card"], {})
+        api_data = self._stage_result(tasks["detail"], {})
+        if not card_data and not api_data:
+            logger.warning(f"⚠️ Фоновый досчёт {articul}: данных так и нет")
+            return
+        merged = self._merge(articul, url, card_data, api_data, self._stage_result(tasks["images"], []))
+        self._cache_put(articul, merged)
+        logger.info(f"✅ Фоновый досчёт {articul} завершён")
+        await self._notify_backfill(articul, merged)
+
+    async def parse_product(self, url: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Основной метод: объединяем card.json и API (api_data имеет приоритет).
+        deadline (секунды) — вернуть то, что успело собраться, с partial=True и списком missing;
+        оставшиеся этапы досчитываются в фоне, итог попадает в кэш и в backfill-обработчики.
+        """
+        articul = self.extract_articul(url)
+        if not articul:
+            return {"success": False, "error": "Не удалось извлечь артикул из URL", "url": url}
+
+        cached = self._cache_get(articul)
+        if cached:
+            return {**cached, "url": url}
+
+        await self.setup()
+        subject_index.ensure_fresh(self.session)
+
+        tasks = self._start_stages(articul)
+        if deadline is None:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            missing = []
+        else:
+            await asyncio.wait(tasks.values(), timeout=deadline)
+            missing = [name for name, task in tasks.items() if not task.done()]
+
+        card_data = self._stage_result(tasks["card"], {})
+        api_data = self._stage_result(tasks["detail"], {})
+
+        if missing:
+            task = asyncio.create_task(self._finish_in_background(articul, url, tasks))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
 
+        if not card_data and not api_data:
+            if missing:
+                return {
+                    "success": False,
+                    "partial": True,
+                    "missing": missing,
+                    "error": "Данные о товаре ещё загружаются",
+                    "articul": articul,
+                }
+            return {"success": False, "error": "Не удалось получить данные о товаре", "articul": articul}
+
+        merged = self._merge(articul, url, card_data, api_data, self._stage_result(tasks["images"], []))
+        if missing:
+            merged["partial"] = True
+            merged["missing"] = missing
+            merged["missing_fields"] = [f for name in missing for f in STAGE_FIELDS.get(name, [])]
+        else:
+            self._cache_put(articul, merged)
         return merged
 
 
@@ -343,6 +645,16 @@ async def get_parser() -> WBParser:
     await _parser.setup()
     return _parser
 
-async def parse_wb_product_api(url: str) -> Dict:
+async def parse_wb_product_api(url: str, deadline: Optional[float] = None) -> Dict:
     parser = await get_parser()
-    return await parser.parse_product(url)
+    return await parser.parse_product(url, deadline=deadline)
+
+def parser_caches() -> Dict[str, Any]:
+    """Кэши общего парсера для диагностики памяти (пусто, пока парсер не создан)."""
+    if _parser is None:
+        return {}
+    return {
+        "parser.result_cache": _parser._result_cache,
+        "parser.regions": _parser.regions,
+        "parser.background": _parser._background,
+    }
@@ -0,0 +1,89 @@
+# parse_snapshot.py
+import base64
+import hashlib
+import hmac
+import os
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+if __package__:
+    from .runtime import json_dumps, json_loads
+else:
+    from runtime import json_dumps, json_loads
+
+# Поля парсинга, которые нужны при добавлении товара; остальное в токен не кладём
+SNAPSHOT_FIELDS = (
+    "id", "articul", "url", "name", "brand", "description", "seller", "supplier",
+    "rating", "feedbacks", "price", "basic_price", "discount", "stocks", "stocks_by_size",
+    "images", "characteristics", "category", "subcategory", "subject_name",
+)
+
+SNAPSHOT_MAX_AGE = int(os.getenv("PARSE_SNAPSHOT_MAX_AGE", "900"))  # 15 минут
+
+_SIG_LEN = 16
+
+
+def _load_secret() -> bytes:
+    secret = os.getenv("PARSE_SNAPSHOT_SECRET")
+    if secret:
+        return secret.encode()
+    bot_token = os.getenv("BOT_TOKEN")
+    if bot_token:
+        return hashlib.sha256(b"parse-snapshot:" + bot_token.encode()).digest()
+    # без секрета в env токены живут только до перезапуска процесса
+    return os.urandom(32)
+
+
+_SECRET = _load_secret()
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _sign(raw: bytes) -> bytes:
+    return hmac.new(_SECRET, raw, hashlib.sha256).digest()[:_SIG_LEN]
+
+
+def sign_snapshot(parsed: Dict[str, Any]) -> Optional[str]:
+    """
+    Упаковывает результат парсинга в компактный подписанный токен:
+    base64url(zlib(json)) + "." + base64url(hmac-sha256[:16]).
+    Частичный результат (partial) не подписываем: товар без цены и картинок нельзя сохранять из снимка.
+    """
+    if parsed.get("partial"):
+        return None
+    data = {k: parsed[k] for k in SNAPSHOT_FIELDS if parsed.get(k) is not None}
+    raw = zlib.compress(json_dumps({"ts": int(time.time()), "d": data}), 6)
+    return f"{_b64encode(raw)}.{_b64encode(_sign(raw))}"
+
+
+def verify_snapshot(token: Optional[str], articul: Optional[str] = None, max_age: int = SNAPSHOT_MAX_AGE) -> Optional[Dict[str, Any]]:
+    """
+    Проверяет подпись и свежесть токена; возвращает снимок парсинга или None.
+    Если передан articul — снимок должен относиться к тому же товару.
+    """
+    if not token or not isinstance(token, str) or "." not in token:
+        return None
+    try:
+        body_b64, sig_b64 = token.split(".", 1)
+        raw = _b64decode(body_b64)
+        if not hmac.compare_digest(_sign(raw), _b64decode(sig_b64)):
+            return None
+        payload = json_loads(zlib.decompress(raw))
+    except Exception:
+        return None
+
+    if time.time() - payload.get("ts", 0) > max_age:
+        return None
+
+    data = payload.get("d") or {}
+    if articul and str(data.get("articul") or data.get("id")) != str(articul):
+        return None
+
+    return {**data, "success": True}
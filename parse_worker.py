@@ -0,0 +1,267 @@
+# parse_worker.py
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+if __package__:
+    from .price_history import price_history
+else:
+    from price_history import price_history
+
+logger = logging.getLogger(__name__)
+
+# inline — парсинг в процессе API (по умолчанию и для тестов), process — отдельные процессы-воркеры
+PARSE_BACKEND = os.getenv("PARSE_BACKEND", "inline")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or (os.cpu_count() or 1)
+# Сколько парсингов одновременно ведёт один воркер (они почти целиком ждут сеть)
+PARSE_WORKER_CONCURRENCY = int(os.getenv("PARSE_WORKER_CONCURRENCY", "16"))
+PARSE_QUEUE_SIZE = int(os.getenv("PARSE_QUEUE_SIZE", "1000"))
+PARSE_JOB_TIMEOUT = float(os.getenv("PARSE_JOB_TIMEOUT", "60"))
+
+BackfillListener = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+def _load_parser_module():
+    if __package__:
+        from . import new_parser
+    else:
+        import new_parser
+    return new_parser
+
+
+class InlineParseQueue:
+    """Парсинг прямо в event loop API — прежнее поведение; заодно локальная замена очереди в тестах."""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def add_backfill_listener(self, listener: BackfillListener):
+        parser = await _load_parser_module().get_parser()
+        parser.add_backfill_listener(listener)
+
+    async def submit(self, url: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        return await _load_parser_module().parse_wb_product_api(url, deadline=deadline)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "inline"}
+
+
+# --- Процесс-воркер ---
+def _worker_main(jobs, results, concurrency: int):
+    asyncio.run(_worker_loop(jobs, results, concurrency))
+
+
+async def _worker_loop(jobs, results, concurrency: int):
+    """Свой event loop и свой WBParser; берём задачу из общей очереди, только когда есть свободный слот."""
+    parser = _load_parser_module().WBParser()
+    await parser.setup()
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    running: set = set()
+
+    async def run_job(job_id: int, url: str):
+        try:
+            result = await parser.parse_product(url)
+        except Exception as e:
+            logger.error(f"❌ Воркер {os.getpid()}: ошибка парсинга {url}: {e}", exc_info=True)
+            result = {"success": False, "error": str(e)}
+        finally:
+            slots.release()
+        results.put((job_id, result))
+
+    try:
+        while True:
+            await slots.acquire()
+            job = await loop.run_in_executor(None, jobs.get)
+            if job is None:
+                break
+            task = asyncio.create_task(run_job(*job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    finally:
+        await parser.close()
+
+
+class ProcessPoolParseQueue:
+    """
+    Очередь заданий на парсинг для отдельных процессов (по умолчанию — по числу ядер).
+    API кладёт (job_id, url) в общую multiprocessing-очередь и ждёт future; результаты
+    читает фоновый поток и отдаёт обратно в event loop API. JSON WB, сотни проверок картинок
+    и сборка результата идут в воркерах, event loop API остаётся свободным для платежей и колбэков.
+    """
+
+    def __init__(
+        self,
+        workers: int = PARSE_WORKERS,
+        concurrency: int = PARSE_WORKER_CONCURRENCY,
+        max_pending: int = PARSE_QUEUE_SIZE,
+        job_timeout: float = PARSE_JOB_TIMEOUT,
+    ):
+        self.workers = max(1, workers)
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        # spawn: не тащим в дочерние процессы планировщик, потоки и открытые сокеты API
+        self._ctx = multiprocessing.get_context("spawn")
+        self._jobs = None
+        self._results = None
+        self._procs: List[multiprocessing.Process] = []
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._backfill_listeners: List[BackfillListener] = []
+        self._background: set = set()
+        self.rejected = 0
+        self.restarted = 0
+
+    def _spawn(self) -> multiprocessing.Process:
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(self._jobs, self._results, self.concurrency),
+            name="wb-parse-worker",
+            daemon=True,
+        )
+        proc.start()
+        return proc
+
+    async def start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._procs = [self._spawn() for _ in range(self.workers)]
+        self._reader = threading.Thread(target=self._read_results, name="wb-parse-results", daemon=True)
+        self._reader.start()
+        logger.info(f"🧵 Парсинг вынесен в {self.workers} процесс(ов), до {self.concurrency} задач в каждом")
+
+    async def close(self):
+        # не запускалась (упавший старт, прямой транспорт без первого парсинга) — закрывать нечего
+        if self._loop is None:
+            return
+        for _ in self._procs:
+            self._jobs.put(None)
+        await asyncio.to_thread(self._join)
+        self._results.put(None)
+        for future in self._futures.values():
+            if not future.done():
+                future.set_result({"success": False, "error": "Парсер остановлен"})
+        self._futures.clear()
+        self._procs = []
+        self._loop = self._jobs = self._results = self._reader = None
+
+    def _join(self):
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+
+    def _read_results(self):
+        # свои ссылки: close() обнуляет атрибуты, пока поток дочитывает очередь
+        results, loop = self._results, self._loop
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            job_id, result = item
+            loop.call_soon_threadsafe(self._resolve, job_id, result)
+
+    def _resolve(self, job_id: int, result: Dict[str, Any]):
+        future = self._futures.pop(job_id, None)
+        if result.get("success"):
+            # история цен воркеров живёт в их памяти — сохраняем точку на стороне API, откуда она сбрасывается в БД
+            price_history.record(result.get("articul"), result.get("price"), result.get("basic_price"), result.get("stocks"))
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _revive(self):
+        # упавший воркер (OOM, segfault) заменяем новым; его задачи отвалятся по job_timeout
+        for i, proc in enumerate(self._procs):
+            if not proc.is_alive():
+                logger.warning(f"⚠️ Воркер парсинга {proc.pid} завершился (код {proc.exitcode}), перезапускаем")
+                self._procs[i] = self._spawn()
+                self.restarted += 1
+
+    async def add_backfill_listener(self, listener: BackfillListener):
+        self._backfill_listeners.append(listener)
+
+    async def _notify_backfill(self, future: asyncio.Future):
+        result = future.result()
+        articul = result.get("articul")
+        if not result.get("success") or not articul:
+            return
+        for listener in self._backfill_listeners:
+            try:
+                await listener(articul, result)
+            except Exception as e:
+                logger.error(f"❌ Ошибка backfill-обработчика для {articul}: {e}", exc_info=True)
+
+    def _backfill_when_done(self, future: asyncio.Future):
+        def on_done(done: asyncio.Future):
+            if done.cancelled():
+                return
+            task = asyncio.create_task(self._notify_backfill(done))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+        future.add_done_callback(on_done)
+
+    async def submit(self, url: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Ставит парсинг в очередь и ждёт результат. С deadline воркер всё равно парсит до конца,
+        а API по истечении срока отвечает partial — полный результат уйдёт в backfill-обработчики.
+        """
+        if self._loop is None:
+            # start() из startup мог не выполниться — поднимаем воркеры при первом задании
+            await self.start()
+        if len(self._futures) >= self.max_pending:
+            self.rejected += 1
+            return {"success": False, "error": "Очередь парсинга переполнена, попробуйте позже"}
+        self._revive()
+
+        job_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[job_id] = future
+        self._jobs.put((job_id, url))
+
+        timeout = self.job_timeout if deadline is None else min(deadline, self.job_timeout)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if deadline is None or deadline >= self.job_timeout:
+                self._futures.pop(job_id, None)
+                return {"success": False, "error": "Парсинг не уложился в отведённое время"}
+            self._backfill_when_done(future)
+            self._loop.call_later(self.job_timeout, self._resolve, job_id, {"success": False, "error": "timeout"})
+            return {
+                "success": False,
+                "partial": True,
+                "missing": ["card", "detail", "images"],
+                "error": "Данные о товаре ещё загружаются",
+                "articul": _load_parser_module().WBParser.extract_articul(url),
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "process",
+            "workers": sum(1 for proc in self._procs if proc.is_alive()),
+            "in_flight": len(self._futures),
+            "rejected": self.rejected,
+            "restarted": self.restarted,
+        }
+
+
+def create_parse_queue(backend: str = PARSE_BACKEND):
+    if backend == "process":
+        return ProcessPoolParseQueue()
+    return InlineParseQueue()
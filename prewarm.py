@@ -0,0 +1,104 @@
+# prewarm.py
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 1 — после старта в фоне прогреваем пул БД, сессию парсера и соединения к WB/YooKassa/Telegram
+PREWARM = os.getenv("PREWARM", "1").lower() not in ("0", "false", "no", "off")
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "10"))
+# Сколько соединений пула БД открыть заранее
+PREWARM_DB_CONNECTIONS = int(os.getenv("PREWARM_DB_CONNECTIONS", "4"))
+
+WarmTarget = Callable[[], Awaitable[Any]]
+
+
+class Readiness:
+    """
+    Готовность процесса для /readyz: набор проверок-прогревов со статусом pending/ok/failed.
+    Готов, когда не осталось pending, а обязательные (БД) прошли; остальные при ошибке не блокируют —
+    без прогрева первый запрос просто заплатит за DNS/TLS сам.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self.checks: Dict[str, Dict[str, Any]] = {}
+        self._required: set = set()
+
+    def expect(self, name: str, required: bool = False):
+        self.checks[name] = {"status": "pending"}
+        if required:
+            self._required.add(name)
+
+    def done(self, name: str, ok: bool, elapsed: float, error: str = None):
+        check = {"status": "ok" if ok else "failed", "ms": round(elapsed * 1000, 1)}
+        if error:
+            check["error"] = error
+        self.checks[name] = check
+        if self.ready_after is None and self.ready:
+            self.ready_after = time.monotonic() - self.started
+
+    @property
+    def ready(self) -> bool:
+        return all(
+            check["status"] == "ok" or (check["status"] == "failed" and name not in self._required)
+            for name, check in self.checks.items()
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "ready_after_ms": round(self.ready_after * 1000, 1) if self.ready_after is not None else None,
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "checks": self.checks,
+        }
+
+
+readiness = Readiness()
+_tasks: set = set()
+
+
+async def _run(name: str, target: WarmTarget, timeout: float):
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(target(), timeout=timeout)
+    except Exception as e:
+        readiness.done(name, False, time.monotonic() - started, f"{type(e).__name__}: {e}")
+        logger.warning(f"⚠️ Прогрев {name} не удался: {type(e).__name__}: {e}")
+    else:
+        readiness.done(name, True, time.monotonic() - started)
+
+
+async def prewarm(targets: Dict[str, WarmTarget], timeout: float = PREWARM_TIMEOUT):
+    """Все прогревы параллельно, каждый со своим таймаутом."""
+    await asyncio.gather(*(_run(name, target, timeout) for name, target in targets.items()))
+    state = "готов" if readiness.ready else "не готов"
+    logger.info(f"🔥 Прогрев завершён, процесс {state} через {time.monotonic() - readiness.started:.2f}s")
+
+
+def start_prewarm(targets: Dict[str, WarmTarget], required: tuple = ()):
+    """Запускает прогрев в фоне: приложение уже принимает запросы, /readyz отвечает 503 до его окончания."""
+    for name in targets:
+        readiness.expect(name, required=name in required)
+    if not PREWARM:
+        for name in targets:
+            readiness.done(name, True, 0.0)
+        return None
+    task = asyncio.create_task(prewarm(targets))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def warm_db(session_factory, statement, connections: int = PREWARM_DB_CONNECTIONS):
+    """Открывает connections соединений пула сразу: параллельные сессии не могут делить одно соединение."""
+
+    async def probe():
+        async with session_factory() as session:
+            await session.execute(statement)
+
+    await asyncio.gather(*(probe() for _ in range(max(1, connections))))
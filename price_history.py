@@ -0,0 +1,411 @@
+# price_history.py
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import BigInteger, Column, DateTime, LargeBinary, MetaData, Table, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Сырые точки живут PRICE_HISTORY_RAW_HOURS, дальше — часовые корзины, ещё дальше — суточные
+PRICE_HISTORY_RAW_HOURS = int(os.getenv("PRICE_HISTORY_RAW_HOURS", "48"))
+PRICE_HISTORY_HOURLY_DAYS = int(os.getenv("PRICE_HISTORY_HOURLY_DAYS", "60"))
+PRICE_HISTORY_DAILY_DAYS = int(os.getenv("PRICE_HISTORY_DAILY_DAYS", "730"))
+# Неизменившуюся цену повторно пишем не чаще раза в HEARTBEAT секунд
+PRICE_HISTORY_HEARTBEAT = int(os.getenv("PRICE_HISTORY_HEARTBEAT", "3600"))
+PRICE_HISTORY_MAX_SERIES = int(os.getenv("PRICE_HISTORY_MAX_SERIES", "100000"))
+
+_MAGIC = b"WBPH1\0"
+_INT32_MAX = 2 ** 31 - 1
+
+# (ts, min, max, last, basic, stocks) — сырая точка это корзина, где min = max = last
+Bucket = Tuple[int, int, int, int, int, int]
+
+
+def _kop(value: Any) -> int:
+    try:
+        return max(0, min(_INT32_MAX, int(round(float(value or 0) * 100))))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Points:
+    """Сырые наблюдения: четыре параллельных массива, 16 байт на точку."""
+
+    __slots__ = ("ts", "price", "basic", "stocks")
+
+    def __init__(self):
+        self.ts = array("I")
+        self.price = array("i")
+        self.basic = array("i")
+        self.stocks = array("i")
+
+    def __len__(self):
+        return len(self.ts)
+
+    def arrays(self):
+        return self.ts, self.price, self.basic, self.stocks
+
+    def append(self, ts: int, price: int, basic: int, stocks: int):
+        self.ts.append(ts)
+        self.price.append(price)
+        self.basic.append(basic)
+        self.stocks.append(stocks)
+
+    def buckets(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Bucket]:
+        for i in range(start, len(self.ts) if stop is None else stop):
+            p = self.price[i]
+            yield self.ts[i], p, p, p, self.basic[i], self.stocks[i]
+
+    def cut(self, n: int) -> List[Bucket]:
+        """Отрезает n самых старых точек и отдаёт их корзинами."""
+        head = list(self.buckets(0, n))
+        for arr in self.arrays():
+            del arr[:n]
+        return head
+
+
+class _Buckets:
+    """Агрегированный слой: на корзину — начало, min, max, последняя цена, базовая цена и остаток."""
+
+    __slots__ = ("size", "ts", "lo", "hi", "last", "basic", "stocks")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.ts = array("I")
+        self.lo = array("i")
+        self.hi = array("i")
+        self.last = array("i")
+        self.basic = array("i")
+        self.stocks = array("i")
+
+    def __len__(self):
+        return len(self.ts)
+
+    def arrays(self):
+        return self.ts, self.lo, self.hi, self.last, self.basic, self.stocks
+
+    def add(self, bucket: Bucket):
+        """Вливает корзину/точку; входные данные идут по возрастанию времени."""
+        ts, lo, hi, last, basic, stocks = bucket
+        start = ts - ts % self.size
+        if self.ts and self.ts[-1] == start:
+            if lo < self.lo[-1]:
+                self.lo[-1] = lo
+            if hi > self.hi[-1]:
+                self.hi[-1] = hi
+            self.last[-1] = last
+            self.basic[-1] = basic
+            self.stocks[-1] = stocks
+            return
+        self.ts.append(start)
+        self.lo.append(lo)
+        self.hi.append(hi)
+        self.last.append(last)
+        self.basic.append(basic)
+        self.stocks.append(stocks)
+
+    def buckets(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Bucket]:
+        for i in range(start, len(self.ts) if stop is None else stop):
+            yield self.ts[i], self.lo[i], self.hi[i], self.last[i], self.basic[i], self.stocks[i]
+
+    def cut(self, n: int) -> List[Bucket]:
+        head = list(self.buckets(0, n))
+        for arr in self.arrays():
+            del arr[:n]
+        return head
+
+
+class PriceSeries:
+    """
+    История цены одного артикула. Новые точки пишутся в сырой слой, а при записи
+    всё, что старше порога, сворачивается в часовые и суточные корзины (min/max/last).
+    Исторический минимум и максимум поддерживаются на лету, последние N точек — срез хвоста массива.
+    """
+
+    __slots__ = ("raw", "hourly", "daily", "min_kop", "max_kop", "min_ts", "max_ts", "dirty", "synced")
+
+    def __init__(self):
+        self.raw = _Points()
+        self.hourly = _Buckets(3600)
+        self.daily = _Buckets(86400)
+        self.min_kop = _INT32_MAX
+        self.max_kop = 0
+        self.min_ts = 0
+        self.max_ts = 0
+        self.dirty = False
+        self.synced = False  # сведена ли с тем, что уже лежит в БД
+
+    def __len__(self):
+        return len(self.raw) + len(self.hourly) + len(self.daily)
+
+    def tiers(self):
+        return self.daily, self.hourly, self.raw
+
+    def first_ts(self) -> Optional[int]:
+        for tier in self.tiers():
+            if tier.ts:
+                return tier.ts[0]
+        return None
+
+    def record(self, price: int, basic: int, stocks: int, ts: Optional[int] = None) -> bool:
+        """Добавляет наблюдение; повтор без изменений в пределах HEARTBEAT пропускается."""
+        ts = int(ts or time.time())
+        raw = self.raw
+        if raw.ts:
+            if ts < raw.ts[-1]:
+                return False
+            if (
+                raw.price[-1] == price and raw.basic[-1] == basic and raw.stocks[-1] == stocks
+                and ts - raw.ts[-1] < PRICE_HISTORY_HEARTBEAT
+            ):
+                return False
+        raw.append(ts, price, basic, stocks)
+        if price and price < self.min_kop:
+            self.min_kop, self.min_ts = price, ts
+        if price > self.max_kop:
+            self.max_kop, self.max_ts = price, ts
+        self.dirty = True
+        self.downsample(ts)
+        return True
+
+    def downsample(self, now: Optional[int] = None):
+        now = int(now or time.time())
+        raw_cut = self._count_before(self.raw.ts, now - PRICE_HISTORY_RAW_HOURS * 3600)
+        for bucket in self.raw.cut(raw_cut) if raw_cut else ():
+            self.hourly.add(bucket)
+
+        hourly_cut = self._count_before(self.hourly.ts, now - PRICE_HISTORY_HOURLY_DAYS * 86400)
+        for bucket in self.hourly.cut(hourly_cut) if hourly_cut else ():
+            self.daily.add(bucket)
+
+        daily_cut = self._count_before(self.daily.ts, now - PRICE_HISTORY_DAILY_DAYS * 86400)
+        if daily_cut:
+            self.daily.cut(daily_cut)
+
+    @staticmethod
+    def _count_before(ts: array, border: int) -> int:
+        return bisect_left(ts, border)
+
+    def last(self, n: int = 20) -> List[Bucket]:
+        """Последние n наблюдений (с добором из корзин, если сырых не хватает), от новых к старым."""
+        out: List[Bucket] = []
+        for tier in reversed(self.tiers()):
+            take = min(n - len(out), len(tier))
+            if take <= 0:
+                break
+            out.extend(reversed(list(tier.buckets(len(tier) - take))))
+        return out
+
+    def points(self, since: int = 0) -> Iterator[Bucket]:
+        """Вся история по возрастанию времени: суточные, часовые, затем сырые точки."""
+        for tier in self.tiers():
+            for bucket in tier.buckets():
+                if bucket[0] >= since:
+                    yield bucket
+
+    def absorb(self, older: "PriceSeries"):
+        """Подклеивает спереди историю из БД (всё, что раньше наших собственных точек)."""
+        border = self.first_ts()
+        for mine, theirs in zip(self.tiers(), older.tiers()):
+            keep = len(theirs) if border is None else self._count_before(theirs.ts, border)
+            if not keep:
+                continue
+            for dst, src in zip(mine.arrays(), theirs.arrays()):
+                dst[:0] = src[:keep]
+        if older.min_kop < self.min_kop:
+            self.min_kop, self.min_ts = older.min_kop, older.min_ts
+        if older.max_kop > self.max_kop:
+            self.max_kop, self.max_ts = older.max_kop, older.max_ts
+        self.synced = True
+        self.dirty = True
+        self.downsample()
+
+    # --- Упаковка для БД ---
+    def pack(self) -> bytes:
+        header = array("I", [len(self.raw), len(self.hourly), len(self.daily), self.min_kop, self.max_kop, self.min_ts, self.max_ts])
+        parts = [_MAGIC, header.tobytes()]
+        for tier in self.tiers():
+            parts.extend(arr.tobytes() for arr in tier.arrays())
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> "PriceSeries":
+        if not blob.startswith(_MAGIC):
+            raise ValueError("Неизвестный формат истории цен")
+        series = cls()
+        pos = len(_MAGIC)
+        header = array("I", blob[pos:pos + 28])
+        pos += 28
+        n_raw, n_hourly, n_daily = header[:3]
+        series.min_kop, series.max_kop, series.min_ts, series.max_ts = header[3:]
+        for tier, n in zip(series.tiers(), (n_daily, n_hourly, n_raw)):
+            for arr in tier.arrays():
+                arr.frombytes(blob[pos:pos + n * arr.itemsize])
+                pos += n * arr.itemsize
+        series.synced = True
+        return series
+
+    # --- Ответ API ---
+    def summary(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"points": len(self)}
+        if self.max_kop:
+            result["min"] = {"price": self.min_kop / 100, "at": datetime.fromtimestamp(self.min_ts).isoformat()}
+            result["max"] = {"price": self.max_kop / 100, "at": datetime.fromtimestamp(self.max_ts).isoformat()}
+        return result
+
+
+def bucket_to_dict(bucket: Bucket) -> Dict[str, Any]:
+    ts, lo, hi, last, basic, stocks = bucket
+    item = {
+        "at": datetime.fromtimestamp(ts).isoformat(),
+        "price": last / 100,
+        "basic_price": basic / 100,
+        "discount": int(100 - last / basic * 100) if basic else 0,
+        "stocks": stocks,
+    }
+    if lo != hi:
+        item["min"] = lo / 100
+        item["max"] = hi / 100
+    return item
+
+
+class PriceHistory:
+    """Истории цен всех артикулов в памяти процесса; изменённые серии периодически сбрасываются в БД."""
+
+    def __init__(self, max_series: int = PRICE_HISTORY_MAX_SERIES):
+        self.max_series = max_series
+        self._series: "OrderedDict[int, PriceSeries]" = OrderedDict()
+        # Пишет только процесс, который сбрасывает историю в БД (бэкенд включает в start_background);
+        # в боте и воркерах парсинга record ничего не делает — иначе их память копила бы несохраняемые серии
+        self.recording = False
+
+    def __len__(self):
+        return len(self._series)
+
+    def get(self, articul: Any) -> Optional[PriceSeries]:
+        return self._series.get(int(articul))
+
+    def _touch(self, articul: int) -> PriceSeries:
+        series = self._series.get(articul)
+        if series is None:
+            series = self._series[articul] = PriceSeries()
+            while len(self._series) > self.max_series:
+                evicted, old = self._series.popitem(last=False)
+                if old.dirty:
+                    logger.warning(f"⚠️ История цен {evicted} вытеснена до сохранения в БД")
+        else:
+            self._series.move_to_end(articul)
+        return series
+
+    def record(self, articul: Any, price: Any, basic_price: Any = None, stocks: Any = 0, ts: Optional[int] = None) -> bool:
+        """Записывает наблюдение из парсинга (цены в рублях, как их отдаёт WBParser)."""
+        if not self.recording:
+            return False
+        try:
+            key = int(articul)
+        except (TypeError, ValueError):
+            return False
+        price_kop = _kop(price)
+        if not price_kop:
+            return False
+        return self._touch(key).record(price_kop, _kop(basic_price) or price_kop, int(stocks or 0), ts)
+
+    def put(self, articul: int, series: PriceSeries):
+        self._series[int(articul)] = series
+
+    def dirty(self) -> List[Tuple[int, PriceSeries]]:
+        return [(articul, series) for articul, series in self._series.items() if series.dirty]
+
+
+price_history = PriceHistory()
+
+
+# --- Хранение в БД: одна строка на артикул, серия целиком упакована в bytea ---
+metadata = MetaData()
+
+price_history_table = Table(
+    "price_history",
+    metadata,
+    Column("articul", BigInteger, primary_key=True),
+    Column("series", LargeBinary, nullable=False),
+    Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+async def ensure_price_history(session: AsyncSession):
+    await session.run_sync(lambda sync_session: metadata.create_all(sync_session.connection()))
+    await session.commit()
+
+
+async def _load_packed(session: AsyncSession, articuls: Iterable[int]) -> Dict[int, PriceSeries]:
+    result = await session.execute(
+        select(price_history_table.c.articul, price_history_table.c.series).where(
+            price_history_table.c.articul.in_(list(articuls))
+        )
+    )
+    loaded = {}
+    for articul, blob in result.all():
+        try:
+            loaded[articul] = PriceSeries.unpack(blob)
+        except ValueError as e:
+            logger.warning(f"⚠️ История цен {articul} не читается: {e}")
+    return loaded
+
+
+async def load_series(session: AsyncSession, articul: Any, store: PriceHistory = price_history) -> Optional[PriceSeries]:
+    """Серия для API: из памяти, при первом обращении сведённая с тем, что лежит в БД."""
+    key = int(articul)
+    series = store.get(key)
+    if series is not None and series.synced:
+        return series
+    stored = (await _load_packed(session, [key])).get(key)
+    if series is None:
+        if stored is not None:
+            store.put(key, stored)
+        return stored
+    if stored is not None:
+        series.absorb(stored)
+    series.synced = True
+    return series
+
+
+async def flush_price_history(session: AsyncSession, store: PriceHistory = price_history, batch_size: int = 500) -> int:
+    """Сохраняет изменённые серии upsert'ом пачками; серии, созданные после рестарта, сначала сводятся с БД."""
+    dirty = store.dirty()
+    for i in range(0, len(dirty), batch_size):
+        chunk = dirty[i:i + batch_size]
+        unsynced = [articul for articul, series in chunk if not series.synced]
+        if unsynced:
+            stored = await _load_packed(session, unsynced)
+            for articul, series in chunk:
+                if not series.synced:
+                    if articul in stored:
+                        series.absorb(stored[articul])
+                    series.synced = True
+
+        rows = [{"articul": articul, "series": series.pack(), "updated_at": datetime.utcnow()} for articul, series in chunk]
+        # снимок уже в rows: сбрасываем dirty до await, чтобы точки, записанные во время upsert'а,
+        # снова пометили серию и ушли следующим сбросом
+        for _, series in chunk:
+            series.dirty = False
+        stmt = pg_insert(price_history_table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["articul"],
+            set_={"series": stmt.excluded.series, "updated_at": stmt.excluded.updated_at},
+        )
+        try:
+            await session.execute(stmt)
+            await session.commit()
+        except BaseException:
+            for _, series in chunk:
+                series.dirty = True
+            raise
+    return len(dirty)
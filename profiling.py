@@ -0,0 +1,209 @@
+# profiling.py
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+if __package__:
+    from . import metrics
+else:
+    import metrics
+
+# Доля запросов, профилируемых без запроса админа (0 — только по заголовку/флагу)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUFFER = int(os.getenv("PROFILE_BUFFER", "50"))
+# Период сэмплирования стека потока event loop, секунды
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SPANS = 200
+PROFILE_STACK_DEPTH = 30
+
+# Метрика -> вид спана в профиле
+_SPAN_KINDS = {
+    metrics.WB_LATENCY.name: "wb",
+    metrics.YOOKASSA_LATENCY.name: "yookassa",
+    metrics.TELEGRAM_LATENCY.name: "telegram",
+    metrics.DB_LATENCY.name: "db",
+}
+
+
+class RequestProfile:
+    """Профиль одного запроса: спаны (DB, WB, YooKassa, Telegram, ...) и сэмплы стека event loop."""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.status: Optional[int] = None
+        self.spans: List[Tuple[str, str, float, float]] = []
+        # (вид, имя) -> [кол-во, сумма, максимум]
+        self.totals: Dict[Tuple[str, str], List[float]] = {}
+        self.samples: Dict[str, int] = {}
+        self.sample_count = 0
+
+    def add_span(self, kind: str, name: str, started: Optional[float], duration: float):
+        total = self.totals.setdefault((kind, name), [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += duration
+        total[2] = max(total[2], duration)
+        if len(self.spans) < PROFILE_MAX_SPANS:
+            offset = (started if started is not None else time.perf_counter() - duration) - self.started
+            self.spans.append((kind, name, offset, duration))
+
+    def summary(self) -> Dict[str, Any]:
+        by_kind: Dict[str, float] = {}
+        for (kind, _), (_, total, _) in self.totals.items():
+            by_kind[kind] = by_kind.get(kind, 0.0) + total
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "span_ms": {kind: round(v * 1000, 2) for kind, v in by_kind.items()},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        top = sorted(self.samples.items(), key=lambda item: item[1], reverse=True)[:50]
+        return {
+            **self.summary(),
+            "totals": [
+                {"kind": kind, "name": name, "count": int(c), "total_ms": round(t * 1000, 2), "max_ms": round(m * 1000, 2)}
+                for (kind, name), (c, t, m) in sorted(self.totals.items(), key=lambda item: -item[1][1])
+            ],
+            "spans": [
+                {"kind": kind, "name": name, "at_ms": round(at * 1000, 2), "duration_ms": round(d * 1000, 2)}
+                for kind, name, at, d in self.spans
+            ],
+            # сэмплы — стек потока event loop за время запроса (туда попадают и соседние задачи)
+            "samples": self.sample_count,
+            "interval_ms": PROFILE_INTERVAL * 1000,
+            "stacks": [{"stack": stack, "count": count} for stack, count in top],
+        }
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def _observe_span(metric_name: str, labels: Tuple[Any, ...], started: Optional[float], duration: float):
+    profile = _current.get()
+    if profile is not None:
+        profile.add_span(_SPAN_KINDS.get(metric_name, metric_name), ":".join(map(str, labels)) or "-", started, duration)
+
+
+@contextmanager
+def span(kind: str, name: str):
+    """Спан без метрики (парсинг, планировщик); вне профилируемого запроса почти ничего не стоит."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(kind, name, started, time.perf_counter() - started)
+
+
+class _StackSampler:
+    """
+    Поток, который раз в PROFILE_INTERVAL снимает стек потока event loop через sys._current_frames().
+    Работает, только пока есть хотя бы один профилируемый запрос.
+    """
+
+    def __init__(self):
+        self._active: Dict[str, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread_id: Optional[int] = None
+
+    def attach(self, profile: RequestProfile):
+        with self._lock:
+            self._active[profile.id] = profile
+            self._target_thread_id = threading.get_ident()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def detach(self, profile: RequestProfile):
+        with self._lock:
+            self._active.pop(profile.id, None)
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        parts = []
+        while frame is not None and len(parts) < PROFILE_STACK_DEPTH:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _run(self):
+        while True:
+            time.sleep(PROFILE_INTERVAL)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                profiles = list(self._active.values())
+                target = self._target_thread_id
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            stack = self._collapse(frame)
+            for profile in profiles:
+                profile.samples[stack] = profile.samples.get(stack, 0) + 1
+                profile.sample_count += 1
+
+
+class Profiler:
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, buffer_size: int = PROFILE_BUFFER):
+        self.sample_rate = sample_rate
+        self.buffer: "deque[RequestProfile]" = deque(maxlen=buffer_size)
+        self._sampler = _StackSampler()
+        metrics.span_observers.append(_observe_span)
+
+    def trigger(self, request, is_admin: Callable[[Any], bool]) -> Optional[str]:
+        """Причина профилирования запроса или None. Без флага — одна проверка random()."""
+        flag = request.headers.get("X-Profile") or request.query_params.get("__profile")
+        if flag and is_admin(request):
+            return "requested"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    @contextmanager
+    def profile(self, method: str, path: str, reason: str):
+        profile = RequestProfile(method, path, reason)
+        token = _current.set(profile)
+        self._sampler.attach(profile)
+        try:
+            yield profile
+        finally:
+            self._sampler.detach(profile)
+            _current.reset(token)
+            profile.duration = time.perf_counter() - profile.started
+            self.buffer.append(profile)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        for profile in self.buffer:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [profile.summary() for profile in reversed(self.buffer)]
+
+
+profiler = Profiler()
@@ -0,0 +1,84 @@
+# raw_store.py
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import BigInteger, Column, DateTime, LargeBinary, MetaData, String, Table, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Отдельная таблица для сырых снимков парсинга: строка Product хранит только ссылку (articul, hash)
+metadata = MetaData()
+
+raw_snapshots = Table(
+    "product_raw_snapshots",
+    metadata,
+    Column("articul", BigInteger, primary_key=True),
+    Column("content_hash", String(32), primary_key=True),
+    Column("payload", LargeBinary, nullable=False),  # zlib(json)
+    Column("created_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+PackedRaw = Tuple[int, str, bytes]
+
+
+async def ensure_raw_store(session: AsyncSession):
+    """Создаёт таблицу снимков, если её ещё нет."""
+    await session.run_sync(lambda sync_session: metadata.create_all(sync_session.connection()))
+    await session.commit()
+
+
+def pack_raw(parsed: Dict[str, Any]) -> Optional[PackedRaw]:
+    """Сжимает снимок парсинга; одинаковые снимки одного артикула получают одинаковый hash."""
+    articul = parsed.get("articul") or parsed.get("id")
+    if not parsed or not articul:
+        return None
+    body = json.dumps(parsed, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    content_hash = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return int(articul), content_hash, zlib.compress(body, 6)
+
+
+def raw_ref(packed: Optional[PackedRaw]) -> Dict[str, Any]:
+    """То, что кладём в Product.info вместо полного parsed_raw."""
+    if not packed:
+        return {}
+    articul, content_hash, _ = packed
+    return {"raw": {"articul": articul, "hash": content_hash}}
+
+
+async def save_raw_snapshots(session: AsyncSession, packed: Iterable[Optional[PackedRaw]]):
+    """Пишет снимки в текущей транзакции; уже сохранённые (articul, hash) пропускаются."""
+    rows = {}
+    for item in packed:
+        if item:
+            articul, content_hash, payload = item
+            rows[(articul, content_hash)] = {"articul": articul, "content_hash": content_hash, "payload": payload}
+    if not rows:
+        return
+    stmt = pg_insert(raw_snapshots).values(list(rows.values())).on_conflict_do_nothing(
+        index_elements=["articul", "content_hash"]
+    )
+    await session.execute(stmt)
+
+
+async def load_raw_snapshot(session: AsyncSession, info: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Лениво поднимает снимок по ссылке из Product.info (старые строки с parsed_raw тоже понимает)."""
+    if not info:
+        return None
+    if "parsed_raw" in info:
+        return info["parsed_raw"]
+    ref = info.get("raw")
+    if not ref:
+        return None
+    result = await session.execute(
+        select(raw_snapshots.c.payload).where(
+            raw_snapshots.c.articul == int(ref["articul"]),
+            raw_snapshots.c.content_hash == ref["hash"],
+        )
+    )
+    payload = result.scalar_one_or_none()
+    if payload is None:
+        return None
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
@@ -0,0 +1,111 @@
+# runtime.py
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+# default — стандартные asyncio/h11/json; fast — uvloop, httptools и orjson (если установлены)
+RUNTIME_PROFILE = os.getenv("RUNTIME_PROFILE", "default").lower()
+FAST = RUNTIME_PROFILE == "fast"
+
+try:
+    import orjson
+except ImportError:  # без orjson профиль fast работает на стандартном json
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import httptools  # noqa: F401 — нужен только uvicorn'у
+    HTTPTOOLS = True
+except ImportError:
+    HTTPTOOLS = False
+
+USE_ORJSON = FAST and orjson is not None
+# datetime, UUID и numpy orjson сериализует сам; ключи-числа (articul) тоже разрешаем
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+
+def _default(value: Any) -> Any:
+    """То, что jsonable_encoder FastAPI делает с типами, которые json не знает."""
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (UUID, bytes)):
+        return value.hex() if isinstance(value, bytes) else str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def json_dumps(data: Any) -> bytes:
+    """Сразу bytes: orjson пишет UTF-8 без промежуточной str и без лишнего encode()."""
+    if USE_ORJSON:
+        return orjson.dumps(data, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def json_loads(data: Any) -> Any:
+    """Принимает str или bytes; orjson разбирает bytes без декодирования в str."""
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _make_response_class():
+    from fastapi.responses import JSONResponse
+
+    class FastJSONResponse(JSONResponse):
+        """
+        JSONResponse через json_dumps. Если эндпоинт возвращает FastJSONResponse сам, FastAPI пропускает
+        jsonable_encoder: datetime/Enum/Decimal кодируются за один проход, а готовые bytes уходят в ответ как есть.
+        """
+
+        def render(self, content: Any) -> bytes:
+            return json_dumps(content)
+
+    return FastJSONResponse
+
+
+def __getattr__(name: str):
+    # fastapi подтягиваем только по требованию: runtime импортирует и бот, где его нет
+    if name == "FastJSONResponse":
+        globals()[name] = _make_response_class()
+        return globals()[name]
+    raise AttributeError(name)
+
+
+def install_event_loop() -> str:
+    """Для процессов без uvicorn (бот): uvloop как политика event loop — до создания цикла."""
+    if FAST and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return "uvloop"
+    return "asyncio"
+
+
+def uvicorn_options() -> Dict[str, str]:
+    """--loop/--http для uvicorn: в профиле fast — uvloop и httptools, если они есть."""
+    if not FAST:
+        return {"loop": "asyncio", "http": "h11"}
+    return {"loop": "uvloop" if uvloop is not None else "asyncio", "http": "httptools" if HTTPTOOLS else "h11"}
+
+
+def describe() -> Dict[str, Any]:
+    return {
+        "profile": RUNTIME_PROFILE,
+        "json": "orjson" if USE_ORJSON else "json",
+        **uvicorn_options(),
+    }
@@ -0,0 +1,85 @@
+# slot_allocator.py
+import math
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+
+class SlotAllocator:
+    """
+    Индекс запланированных постов канала: отсортированный список моментов публикации.
+    Слот свободен, если ближайший пост дальше, чем 3600 / posts_per_hour секунд —
+    так посты равномерно раскладываются по часу, а не собираются на «круглых» минутах.
+    Поиск соседей — бинарный (O(log n)).
+    Время наивное локальное, как у normalize_datetime и scheduled_date в БД.
+    """
+
+    def __init__(self, channel_id: str, posts_per_hour: int = 4):
+        self.channel_id = channel_id
+        self.posts_per_hour = max(1, posts_per_hour)
+        self.gap = 3600.0 / self.posts_per_hour
+        self._times: List[float] = []
+
+    def __len__(self):
+        return len(self._times)
+
+    def load(self, scheduled: Iterable[datetime]):
+        """Пересобирает индекс (например, из БД при старте)."""
+        self._times = sorted(dt.timestamp() for dt in scheduled if dt)
+
+    def _prune(self, now: float):
+        # прошедшие посты больше не мешают — отрезаем префикс
+        cut = bisect_right(self._times, now - self.gap)
+        if cut:
+            del self._times[:cut]
+
+    def _align(self, ts: float) -> float:
+        return math.ceil(ts / self.gap) * self.gap
+
+    def _conflict(self, ts: float) -> Optional[float]:
+        """Ближайший пост, который ближе gap к ts, или None."""
+        i = bisect_right(self._times, ts - self.gap)
+        if i < len(self._times) and self._times[i] < ts + self.gap:
+            return self._times[i]
+        return None
+
+    def is_free(self, dt: datetime) -> bool:
+        return self._conflict(dt.timestamp()) is None
+
+    def _next_free_ts(self, start: float) -> float:
+        ts = self._align(start)
+        while True:
+            busy = self._conflict(ts)
+            if busy is None:
+                return ts
+            ts = self._align(busy + self.gap)
+
+    def suggest(self, start: Optional[datetime] = None, count: int = 1) -> List[datetime]:
+        """Следующие свободные слоты начиная со start, без резервирования."""
+        now = time.time()
+        self._prune(now)
+        ts = max(start.timestamp() if start else now, now)
+        slots: List[datetime] = []
+        for _ in range(max(0, count)):
+            ts = self._next_free_ts(ts)
+            slots.append(datetime.fromtimestamp(ts))
+            ts += self.gap
+        return slots
+
+    def allocate(self, start: Optional[datetime] = None) -> datetime:
+        """Выбирает ближайший свободный слот не раньше start и сразу резервирует его."""
+        slot = self.suggest(start, 1)[0]
+        self.reserve(slot)
+        return slot
+
+    def reserve(self, dt: datetime):
+        insort(self._times, dt.timestamp())
+
+    def release(self, dt: Optional[datetime]):
+        if not dt:
+            return
+        ts = dt.timestamp()
+        i = bisect_left(self._times, ts)
+        if i < len(self._times) and self._times[i] == ts:
+            del self._times[i]
@@ -0,0 +1,222 @@
+# subject_index.py
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from array import array
+from typing import Any, Iterator, List, Optional, Tuple
+
+import aiohttp
+
+if __package__:
+    from .metrics import WB_LATENCY, timed
+else:
+    from metrics import WB_LATENCY, timed
+
+logger = logging.getLogger(__name__)
+
+# Источник справочника предметов WB (JSON); пусто — справочник выключен, категории из него не заполняются
+WB_SUBJECTS_URL = os.getenv("WB_SUBJECTS_URL", "")
+WB_SUBJECTS_CACHE = os.getenv("WB_SUBJECTS_CACHE", os.path.join(tempfile.gettempdir(), "wb_subjects.bin"))
+WB_SUBJECTS_REFRESH = float(os.getenv("WB_SUBJECTS_REFRESH_HOURS", "24")) * 3600
+
+# Прямая адресация по subject_id: выше этого id записи не индексируем
+MAX_SUBJECT_ID = 1_000_000
+# uint32: позиции в таблице строк не упираются в 65535 названий
+_INDEX_TYPE = "I"
+_INDEX_SIZE = array(_INDEX_TYPE).itemsize
+_MAGIC = b"WBSUBJ2\0"
+
+# (названия, subject, parent, число предметов, loaded_at) — собирается в потоке, подменяется целиком
+_IndexState = Tuple[List[str], array, array, int, float]
+
+
+def _iter_subject_records(data: Any, parent: Optional[str] = None) -> Iterator[Tuple[int, str, Optional[str]]]:
+    """
+    Достаёт (id, name, parent_name) из справочника предметов WB.
+    Понимает и плоский список, и дерево категорий с childs/children.
+    """
+    if isinstance(data, dict):
+        for key in ("data", "subjects", "items"):
+            if isinstance(data.get(key), list):
+                yield from _iter_subject_records(data[key], parent)
+                return
+        raw_id = data.get("id") or data.get("subjectID") or data.get("subjectId")
+        name = data.get("name") or data.get("subjectName")
+        own_parent = data.get("parentName") or data.get("parent_name") or parent
+        if raw_id and name:
+            try:
+                yield int(raw_id), str(name), own_parent
+            except (TypeError, ValueError):
+                pass
+        children = data.get("childs") or data.get("children")
+        if isinstance(children, list):
+            yield from _iter_subject_records(children, name or parent)
+    elif isinstance(data, list):
+        for item in data:
+            yield from _iter_subject_records(item, parent)
+
+
+class SubjectIndex:
+    """
+    Локальный справочник subject_id → (предмет, родительская категория).
+    Хранится в двух компактных массивах uint32 с прямой адресацией по id (поиск O(1))
+    и общей таблице строк; на диск пишется в бинарном виде и поднимается при старте без сети.
+    Разбор JSON, сборка массивов и работа с диском идут в потоке — event loop их не ждёт.
+    """
+
+    def __init__(self, source_url: str = WB_SUBJECTS_URL, cache_path: str = WB_SUBJECTS_CACHE, refresh_interval: float = WB_SUBJECTS_REFRESH):
+        self.source_url = source_url
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self._names: List[str] = [""]  # 0 — «нет значения»
+        self._subject = array(_INDEX_TYPE)
+        self._parent = array(_INDEX_TYPE)
+        self._count = 0
+        self.loaded_at = 0.0
+        self._disk_checked = False
+        self._retry_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _compile(records: Iterator[Tuple[int, str, Optional[str]]]) -> _IndexState:
+        names: List[str] = [""]
+        positions = {"": 0}
+
+        def intern(value: Optional[str]) -> int:
+            if not value:
+                return 0
+            pos = positions.get(value)
+            if pos is None:
+                pos = positions[value] = len(names)
+                names.append(value)
+            return pos
+
+        pairs = [(sid, intern(name), intern(parent)) for sid, name, parent in records if 0 < sid < MAX_SUBJECT_ID]
+        size = max((sid for sid, _, _ in pairs), default=0) + 1
+        if len(names) >= 1 << (8 * _INDEX_SIZE):
+            raise ValueError(f"Слишком много названий для индекса: {len(names)}")
+
+        subject = array(_INDEX_TYPE, bytes(_INDEX_SIZE * size))
+        parent = array(_INDEX_TYPE, bytes(_INDEX_SIZE * size))
+        for sid, name_pos, parent_pos in pairs:
+            subject[sid] = name_pos
+            parent[sid] = parent_pos
+        return names, subject, parent, sum(1 for pos in subject if pos), time.time()
+
+    @classmethod
+    def _compile_json(cls, raw: bytes) -> _IndexState:
+        return cls._compile(_iter_subject_records(json.loads(raw)))
+
+    def _apply(self, state: _IndexState):
+        self._names, self._subject, self._parent, self._count, self.loaded_at = state
+
+    def build(self, records: Iterator[Tuple[int, str, Optional[str]]]):
+        self._apply(self._compile(records))
+
+    def lookup(self, subject_id: Any) -> Optional[Tuple[str, Optional[str]]]:
+        """(название предмета, родительская категория) или None."""
+        try:
+            sid = int(subject_id)
+        except (TypeError, ValueError):
+            return None
+        if sid <= 0 or sid >= len(self._subject) or not self._subject[sid]:
+            return None
+        return self._names[self._subject[sid]], (self._names[self._parent[sid]] or None)
+
+    # --- Диск ---
+    def save(self):
+        names_blob = "\0".join(self._names).encode("utf-8")
+        header = array("d", [self.loaded_at]).tobytes() + array("I", [len(self._subject), len(names_blob)]).tobytes()
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC + header + self._subject.tobytes() + self._parent.tobytes() + names_blob)
+        os.replace(tmp_path, self.cache_path)
+
+    def _read_disk(self) -> Optional[_IndexState]:
+        try:
+            with open(self.cache_path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return None
+        if not blob.startswith(_MAGIC):
+            return None
+        try:
+            pos = len(_MAGIC)
+            loaded_at = array("d", blob[pos:pos + 8])[0]
+            size, names_len = array("I", blob[pos + 8:pos + 16])
+            pos += 16
+            subject = array(_INDEX_TYPE, blob[pos:pos + _INDEX_SIZE * size])
+            pos += _INDEX_SIZE * size
+            parent = array(_INDEX_TYPE, blob[pos:pos + _INDEX_SIZE * size])
+            pos += _INDEX_SIZE * size
+            if len(subject) != size or len(parent) != size:
+                raise ValueError("файл обрезан")
+            names = blob[pos:pos + names_len].decode("utf-8").split("\0")
+        except Exception as e:
+            logger.warning(f"⚠️ Кэш справочника предметов повреждён: {e}")
+            return None
+        return names, subject, parent, sum(1 for pos in subject if pos), loaded_at
+
+    async def load(self) -> bool:
+        state = await asyncio.to_thread(self._read_disk)
+        if state is None:
+            return False
+        self._apply(state)
+        logger.info(f"📚 Справочник предметов загружен с диска: {len(self)} предметов")
+        return True
+
+    # --- Обновление ---
+    async def refresh(self, session: aiohttp.ClientSession) -> bool:
+        try:
+            with timed(WB_LATENCY, "subjects"):
+                async with session.get(self.source_url, timeout=30) as resp:
+                    if resp.status != 200:
+                        logger.warning(f"⚠️ Справочник предметов: статус {resp.status}")
+                        return False
+                    raw = await resp.read()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось обновить справочник предметов: {e}")
+            return False
+
+        try:
+            state = await asyncio.to_thread(self._compile_json, raw)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось разобрать справочник предметов: {e}")
+            return False
+        self._apply(state)
+        logger.info(f"📚 Справочник предметов обновлён: {len(self)} предметов")
+        try:
+            await asyncio.to_thread(self.save)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить справочник предметов: {e}")
+        return True
+
+    async def _update(self, session: aiohttp.ClientSession):
+        if not self._disk_checked:
+            self._disk_checked = True
+            await self.load()
+        now = time.time()
+        if now - self.loaded_at > self.refresh_interval and now >= self._retry_at:
+            # не чаще раза в 15 минут, даже если источник недоступен
+            self._retry_at = now + 900
+            await self.refresh(session)
+
+    def ensure_fresh(self, session: aiohttp.ClientSession):
+        """Не блокирует парсинг: чтение диска и обновление устаревшего справочника — в фоновой задаче."""
+        if not self.source_url:
+            return
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        now = time.time()
+        stale = now - self.loaded_at > self.refresh_interval
+        if not self._disk_checked or (stale and now >= self._retry_at):
+            self._refresh_task = asyncio.create_task(self._update(session))
+
+
+subject_index = SubjectIndex()
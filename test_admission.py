@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def _controller(**kwargs):
+    options = {"max_in_flight": 1, "max_queue": 1, "queue_timeout": 0.05, "per_user": 2}
+    options.update(kwargs)
+    return AdmissionController("test", **options)
+
+
+def test_check_rejects_user_over_limit_without_taking_a_slot():
+    async def scenario():
+        admission = _controller(max_in_flight=4)
+        async with admission.admit("tg:1"), admission.admit("tg:1"):
+            with pytest.raises(AdmissionRejected) as rejected:
+                admission.check("tg:1")
+            assert rejected.value.status == 429
+            admission.check("tg:2")
+            assert admission.in_flight == 2
+        assert admission.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_check_rejects_when_queue_is_full():
+    async def scenario():
+        admission = _controller()
+        gate = asyncio.Event()
+
+        async def hold(key):
+            async with admission.admit(key):
+                await gate.wait()
+
+        running = asyncio.create_task(hold("tg:1"))
+        queued = asyncio.create_task(hold("tg:2"))
+        await asyncio.sleep(0)
+        assert admission.waiting == 1
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            admission.check("tg:3")
+        assert rejected.value.status == 503
+        assert rejected.value.retry_after >= 1
+
+        gate.set()
+        await asyncio.gather(running, queued)
+        assert admission.in_flight == 0 and admission.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_releases_user_slot():
+    async def scenario():
+        admission = _controller()
+        gate = asyncio.Event()
+
+        async def hold():
+            async with admission.admit("tg:1"):
+                await gate.wait()
+
+        running = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            async with admission.admit("tg:2"):
+                pass
+        assert admission.waiting == 0
+        assert admission.stats()["users"] == 1
+
+        gate.set()
+        await running
+        assert admission.stats()["users"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        admission = _controller(queue_timeout=10)
+        gate = asyncio.Event()
+
+        async def hold(key):
+            async with admission.admit(key):
+                await gate.wait()
+
+        running = asyncio.create_task(hold("tg:1"))
+        queued = asyncio.create_task(hold("tg:2"))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+        gate.set()
+        await running
+        assert admission.in_flight == 0
+        async with admission.admit("tg:3"):
+            assert admission.in_flight == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,24 @@
+from parse_snapshot import sign_snapshot, verify_snapshot
+
+PARSED = {"success": True, "articul": "123456", "name": "Кроссовки", "price": 2599.0, "images": ["a.webp"]}
+
+
+def test_full_result_roundtrips():
+    token = sign_snapshot(PARSED)
+    snapshot = verify_snapshot(token, articul="123456")
+    assert snapshot["name"] == "Кроссовки"
+    assert snapshot["price"] == 2599.0
+
+
+def test_partial_result_gets_no_token():
+    assert sign_snapshot({**PARSED, "partial": True, "missing": ["images"]}) is None
+
+
+def test_token_for_another_articul_is_rejected():
+    assert verify_snapshot(sign_snapshot(PARSED), articul="654321") is None
+
+
+def test_tampered_token_is_rejected():
+    body, sig = sign_snapshot(PARSED).split(".", 1)
+    assert verify_snapshot(f"{body}A.{sig}") is None
+    assert verify_snapshot("garbage") is None
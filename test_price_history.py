@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from price_history import PriceHistory, flush_price_history
+
+
+class FakeSession:
+    """AsyncSession для flush: execute ждёт gate (в это время пишем новые точки) и может упасть."""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.started = asyncio.Event()
+        self.executed = 0
+        self.commits = 0
+
+    async def execute(self, stmt):
+        self.executed += 1
+        self.started.set()
+        await self.gate.wait()
+        if self.fail:
+            raise ConnectionError("db down")
+
+    async def commit(self):
+        self.commits += 1
+
+
+def _store(*articuls):
+    store = PriceHistory()
+    store.recording = True
+    for articul in articuls:
+        store.record(articul, 100, ts=1_700_000_000)
+        store.get(articul).synced = True  # без запроса в БД за старой историей
+    return store
+
+
+def test_record_is_noop_until_recording_enabled():
+    store = PriceHistory()
+    assert store.record(1, 100) is False
+    assert len(store) == 0
+
+    store.recording = True
+    assert store.record(1, 100) is True
+    assert [articul for articul, _ in store.dirty()] == [1]
+
+
+def test_flush_clears_dirty():
+    async def scenario():
+        store = _store(1, 2)
+        session = FakeSession()
+        assert await flush_price_history(session, store) == 2
+        assert session.commits == 1
+        assert store.dirty() == []
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_series_dirty():
+    async def scenario():
+        store = _store(1)
+        with pytest.raises(ConnectionError):
+            await flush_price_history(FakeSession(fail=True), store)
+        assert [articul for articul, _ in store.dirty()] == [1]
+
+    asyncio.run(scenario())
+
+
+def test_point_recorded_during_flush_stays_dirty():
+    async def scenario():
+        store = _store(1)
+        session = FakeSession()
+        session.gate.clear()
+
+        flush = asyncio.create_task(flush_price_history(session, store))
+        await session.started.wait()
+        store.record(1, 90, ts=1_700_000_100)
+        session.gate.set()
+        await flush
+
+        assert [articul for articul, _ in store.dirty()] == [1]
+        assert await flush_price_history(FakeSession(), store) == 1
+        assert store.dirty() == []
+
+    asyncio.run(scenario())
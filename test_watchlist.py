@@ -0,0 +1,109 @@
+import asyncio
+
+from watchlist import WatchlistEngine
+
+
+class SlowFetch:
+    """fetch_batch, который отвечает только после release(): в это время меняем подписки."""
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+        self.calls = []
+
+    async def __call__(self, articuls):
+        self.calls.append(list(articuls))
+        self.started.set()
+        await self.gate.wait()
+        return {a: {"price": self.prices.get(a, 100), "stocks": 5} for a in articuls}
+
+
+def _engine(fetch, notified):
+    async def notify(tg_ids, articul, event, old, new):
+        notified.append((articul, event, old, new))
+
+    # interval=0: опрошенный артикул сразу снова в очереди — следующий poll_once покажет, что туда попало
+    return WatchlistEngine(fetch, notify, interval=0, batch_size=10, rps=0)
+
+
+def test_removed_during_fetch_is_not_requeued():
+    async def scenario():
+        fetch = SlowFetch({"111": 100})
+        engine = _engine(fetch, [])
+        engine.add(1, 111, due=0)
+
+        poll = asyncio.create_task(engine.poll_once())
+        await fetch.started.wait()
+        engine.remove(1, 111)
+        fetch.gate.set()
+        await poll
+
+        assert len(engine) == 0
+        assert await engine.poll_once() == 0
+        assert fetch.calls == [["111"]]
+
+    asyncio.run(scenario())
+
+
+def test_reused_slot_does_not_inherit_old_price():
+    async def scenario():
+        notified = []
+        fetch = SlowFetch({"111": 500, "222": 100})
+        engine = _engine(fetch, notified)
+        engine.add(1, 111, due=0)
+
+        poll = asyncio.create_task(engine.poll_once())
+        await fetch.started.wait()
+        engine.remove(1, 111)
+        engine.add(2, 222, due=0)
+        fetch.gate.set()
+        await poll
+
+        # цена 111 не стала базой для 222
+        assert engine.watched_by(2) == [{"articul": 222, "price": None, "stocks": None}]
+
+        assert await engine.poll_once() == 1
+        await asyncio.sleep(0)
+        assert fetch.calls[-1] == ["222"]
+        assert engine.watched_by(2) == [{"articul": 222, "price": 100.0, "stocks": 5}]
+        assert notified == []
+
+    asyncio.run(scenario())
+
+
+def test_readded_same_articul_is_polled_once():
+    async def scenario():
+        fetch = SlowFetch({"111": 100})
+        engine = _engine(fetch, [])
+        engine.add(1, 111, due=0)
+
+        poll = asyncio.create_task(engine.poll_once())
+        await fetch.started.wait()
+        engine.remove(1, 111)
+        engine.add(1, 111, due=0)
+        fetch.gate.set()
+        await poll
+
+        assert await engine.poll_once() == 1
+        assert fetch.calls[-1] == ["111"]
+
+    asyncio.run(scenario())
+
+
+def test_price_drop_notifies_watchers():
+    async def scenario():
+        notified = []
+        fetch = SlowFetch({"111": 500})
+        fetch.gate.set()
+        engine = _engine(fetch, notified)
+        engine.add(1, 111, due=0)
+
+        await engine.poll_once()
+        fetch.prices["111"] = 400
+        await engine.poll_once()
+        await asyncio.sleep(0)
+
+        assert notified == [(111, "price_drop", 500.0, 400.0)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+from webapp_auth import verify_init_data
+
+BOT_TOKEN = "123456:TEST"
+
+
+def _init_data(user_id=42, auth_date=None, token=BOT_TOKEN):
+    fields = {
+        "auth_date": str(int(auth_date if auth_date is not None else time.time())),
+        "query_id": "AAH",
+        "user": json.dumps({"id": user_id, "first_name": "Тест"}, ensure_ascii=False),
+    }
+    check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    secret = hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def test_valid_init_data_returns_user_id():
+    assert verify_init_data(_init_data(42), BOT_TOKEN) == 42
+
+
+def test_signature_from_another_bot_is_rejected():
+    assert verify_init_data(_init_data(42, token="999:OTHER"), BOT_TOKEN) is None
+
+
+def test_tampered_user_is_rejected():
+    forged = _init_data(42).replace("%3A+42", "%3A+43")
+    assert forged != _init_data(42)
+    assert verify_init_data(forged, BOT_TOKEN) is None
+
+
+def test_expired_init_data_is_rejected():
+    assert verify_init_data(_init_data(42, auth_date=time.time() - 7200), BOT_TOKEN, max_age=3600) is None
+
+
+def test_missing_init_data_or_token():
+    assert verify_init_data(None, BOT_TOKEN) is None
+    assert verify_init_data(_init_data(42), None) is None
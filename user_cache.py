@@ -0,0 +1,79 @@
+# user_cache.py
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from database.models import User
+
+if __package__:
+    from .metrics import cache_result
+else:
+    from metrics import cache_result
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    tg_id: str
+    name: Optional[str] = None
+
+
+class UserCache:
+    """
+    Кэш tg_id → пользователь (только положительные результаты).
+    Регистрация почти не меняется, поэтому повторные проверки отдаются из памяти;
+    /api/users/register сбрасывает запись.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_size: int = 50_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[str, tuple[float, CachedUser]]" = OrderedDict()
+
+    def get(self, tg_id) -> Optional[CachedUser]:
+        key = str(tg_id)
+        item = self._items.get(key)
+        if item is None:
+            return None
+        ts, user = item
+        if time.monotonic() - ts > self.ttl:
+            self._items.pop(key, None)
+            return None
+        self._items.move_to_end(key)
+        return user
+
+    def put(self, user: CachedUser):
+        self._items[user.tg_id] = (time.monotonic(), user)
+        self._items.move_to_end(user.tg_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, tg_id):
+        self._items.pop(str(tg_id), None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+user_cache = UserCache()
+
+
+async def get_user_cached(session: AsyncSession, tg_id) -> Optional[CachedUser]:
+    """Находит пользователя по tg_id: сначала в кэше, затем в БД (результат кладётся в кэш)."""
+    cached = user_cache.get(tg_id)
+    cache_result("user", cached is not None)
+    if cached is not None:
+        return cached
+
+    result = await session.execute(select(User.id, User.tg_id, User.name).where(User.tg_id == str(tg_id)))
+    row = result.first()
+    if row is None:
+        return None
+
+    user = CachedUser(id=row.id, tg_id=str(row.tg_id), name=row.name)
+    user_cache.put(user)
+    return user
@@ -0,0 +1,284 @@
+# watchlist.py
+import asyncio
+import heapq
+import logging
+import os
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import BigInteger, Column, DateTime, MetaData, Table, delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Базовый период опроса; высокий приоритет сокращает его до interval / (1 + priority)
+WATCHLIST_INTERVAL = float(os.getenv("WATCHLIST_INTERVAL", "900"))
+WATCHLIST_BATCH_SIZE = int(os.getenv("WATCHLIST_BATCH_SIZE", "100"))
+# Запросов к WB в секунду — ровный поток вместо всплесков
+WATCHLIST_RPS = float(os.getenv("WATCHLIST_RPS", "2"))
+WATCHLIST_MAX_PRIORITY = 3
+
+metadata = MetaData()
+
+watchlist_items = Table(
+    "watchlist_items",
+    metadata,
+    Column("tg_id", BigInteger, primary_key=True),
+    Column("articul", BigInteger, primary_key=True),
+    Column("created_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+BatchFetcher = Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]]
+# (подписчики, артикул, событие, старое значение, новое значение)
+Notifier = Callable[[List[int], int, str, float, float], Awaitable[None]]
+
+
+class WatchlistEngine:
+    """
+    Опрос отслеживаемых артикулов пакетами по 100 nm за запрос.
+    Состояние — параллельные компактные массивы по слотам (артикул, последняя цена в копейках,
+    остаток, приоритет), очередь — куча (срок, слот). Уведомления уходят только при изменении:
+    цена снизилась или товар снова появился в наличии.
+    """
+
+    def __init__(
+        self,
+        fetch_batch: BatchFetcher,
+        notify: Notifier,
+        interval: float = WATCHLIST_INTERVAL,
+        batch_size: int = WATCHLIST_BATCH_SIZE,
+        rps: float = WATCHLIST_RPS,
+    ):
+        self.fetch_batch = fetch_batch
+        self.notify = notify
+        self.interval = interval
+        self.batch_size = batch_size
+        self.min_gap = 1.0 / rps if rps > 0 else 0.0
+
+        self._articul = array("q")
+        self._price = array("i")     # копейки, -1 — ещё не опрашивали
+        self._stocks = array("i")
+        self._priority = array("b")
+        self._gen = array("I")       # поколение слота: устаревшие записи кучи отбрасываются
+        self._slot: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._watchers: Dict[int, Set[int]] = {}
+        self._heap: List[Tuple[float, int, int]] = []
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._notify_tasks: set = set()
+        self.stats = {"requests": 0, "polled": 0, "changes": 0, "notified": 0, "errors": 0}
+
+    def __len__(self):
+        return len(self._slot)
+
+    # --- Подписки ---
+    def add(self, tg_id: int, articul: int, due: Optional[float] = None):
+        articul = int(articul)
+        self._watchers.setdefault(articul, set()).add(int(tg_id))
+        slot = self._slot.get(articul)
+        if slot is None:
+            slot = self._free.pop() if self._free else len(self._articul)
+            if slot == len(self._articul):
+                self._articul.append(articul)
+                self._price.append(-1)
+                self._stocks.append(0)
+                self._priority.append(0)
+                self._gen.append(0)
+            else:
+                self._articul[slot] = articul
+                self._price[slot] = -1
+                self._stocks[slot] = 0
+                self._priority[slot] = 0
+            self._slot[articul] = slot
+            heapq.heappush(self._heap, (due if due is not None else time.monotonic(), slot, self._gen[slot]))
+            self._wakeup.set()
+        self._bump_priority(slot)
+
+    def remove(self, tg_id: int, articul: int):
+        articul = int(articul)
+        watchers = self._watchers.get(articul)
+        if watchers is None:
+            return
+        watchers.discard(int(tg_id))
+        if watchers:
+            return
+        del self._watchers[articul]
+        slot = self._slot.pop(articul)
+        self._gen[slot] += 1
+        self._articul[slot] = 0
+        self._free.append(slot)
+
+    def watched_by(self, tg_id: int) -> List[Dict[str, Any]]:
+        tg_id = int(tg_id)
+        items = []
+        for articul, watchers in self._watchers.items():
+            if tg_id in watchers:
+                slot = self._slot[articul]
+                price = self._price[slot]
+                items.append({
+                    "articul": articul,
+                    "price": price / 100 if price >= 0 else None,
+                    "stocks": self._stocks[slot] if price >= 0 else None,
+                })
+        return items
+
+    def _bump_priority(self, slot: int):
+        # чем больше подписчиков, тем чаще опрашиваем
+        watchers = len(self._watchers.get(self._articul[slot], ()))
+        base = min(WATCHLIST_MAX_PRIORITY, max(0, watchers - 1))
+        if self._priority[slot] < base:
+            self._priority[slot] = base
+
+    def _next_due(self, slot: int, now: float) -> float:
+        return now + self.interval / (1 + self._priority[slot])
+
+    # --- Опрос ---
+    def _take_due(self, now: float) -> List[int]:
+        slots: List[int] = []
+        while self._heap and len(slots) < self.batch_size:
+            due, slot, gen = self._heap[0]
+            if gen != self._gen[slot]:
+                heapq.heappop(self._heap)
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            slots.append(slot)
+        return slots
+
+    def _seconds_to_next(self, now: float) -> float:
+        while self._heap and self._heap[0][2] != self._gen[self._heap[0][1]]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return 60.0
+        return max(0.0, self._heap[0][0] - now)
+
+    async def poll_once(self) -> int:
+        """Опрашивает одну пачку самых просроченных артикулов; возвращает её размер."""
+        now = time.monotonic()
+        slots = self._take_due(now)
+        if not slots:
+            return 0
+
+        articuls = [str(self._articul[slot]) for slot in slots]
+        # пока ждём WB, слот могут удалить или отдать другому артикулу — тогда поколение сменится
+        gens = [self._gen[slot] for slot in slots]
+        self.stats["requests"] += 1
+        try:
+            details = await self.fetch_batch(articuls)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"⚠️ Watchlist: пакет из {len(slots)} не опрошен: {e}")
+            details = {}
+
+        now = time.monotonic()
+        for slot, articul, gen in zip(slots, articuls, gens):
+            if gen != self._gen[slot]:
+                continue
+            detail = details.get(articul)
+            if detail:
+                self.stats["polled"] += 1
+                self._apply(slot, detail)
+            heapq.heappush(self._heap, (self._next_due(slot, now), slot, gen))
+        return len(slots)
+
+    def _apply(self, slot: int, detail: Dict[str, Any]):
+        price = int(round(float(detail.get("price") or 0) * 100))
+        stocks = int(detail.get("stocks") or 0)
+        old_price, old_stocks = self._price[slot], self._stocks[slot]
+        self._price[slot] = price
+        self._stocks[slot] = stocks
+        if old_price < 0:
+            return  # первый опрос — только запоминаем
+
+        changed = False
+        if price and old_price and price < old_price and stocks > 0:
+            changed = True
+            self._emit(slot, "price_drop", old_price / 100, price / 100)
+        elif old_stocks == 0 and stocks > 0:
+            changed = True
+            self._emit(slot, "back_in_stock", old_stocks, stocks)
+
+        # изменившиеся товары ненадолго поднимаем в приоритете, спокойные постепенно опускаем
+        if changed or price != old_price:
+            self._priority[slot] = min(WATCHLIST_MAX_PRIORITY, self._priority[slot] + 1)
+        elif self._priority[slot] > 0:
+            self._priority[slot] -= 1
+            self._bump_priority(slot)
+
+    def _emit(self, slot: int, event: str, old: float, new: float):
+        articul = self._articul[slot]
+        watchers = list(self._watchers.get(articul, ()))
+        if not watchers:
+            return
+        self.stats["changes"] += 1
+        self.stats["notified"] += len(watchers)
+        task = asyncio.create_task(self.notify(watchers, articul, event, old, new))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def run(self):
+        """Бесконечный цикл: не больше WATCHLIST_RPS пакетов в секунду, между пачками ждём ближайший срок."""
+        logger.info(f"👀 Watchlist запущен: {len(self)} артикулов")
+        while True:
+            started = time.monotonic()
+            try:
+                polled = await self.poll_once()
+            except Exception as e:
+                logger.error(f"❌ Watchlist: ошибка цикла опроса: {e}", exc_info=True)
+                polled = 0
+
+            if polled:
+                await asyncio.sleep(max(0.0, self.min_gap - (time.monotonic() - started)))
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_to_next(time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    # --- БД ---
+    async def load(self, session: AsyncSession):
+        """Поднимает подписки из БД; первые опросы размазываем по интервалу, чтобы не бить WB залпом."""
+        result = await session.execute(select(watchlist_items.c.tg_id, watchlist_items.c.articul))
+        rows = result.all()
+        now = time.monotonic()
+        spread = self.interval / max(1, len(rows))
+        for i, (tg_id, articul) in enumerate(rows):
+            self.add(tg_id, articul, due=now + i * spread)
+        logger.info(f"👀 Watchlist: загружено {len(rows)} подписок, {len(self)} артикулов")
+
+
+async def ensure_watchlist_table(session: AsyncSession):
+    await session.run_sync(lambda sync_session: metadata.create_all(sync_session.connection()))
+    await session.commit()
+
+
+async def save_watch(session: AsyncSession, tg_id: int, articul: int):
+    stmt = pg_insert(watchlist_items).values(tg_id=int(tg_id), articul=int(articul)).on_conflict_do_nothing(
+        index_elements=["tg_id", "articul"]
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def delete_watch(session: AsyncSession, tg_id: int, articul: int):
+    await session.execute(
+        delete(watchlist_items).where(watchlist_items.c.tg_id == int(tg_id), watchlist_items.c.articul == int(articul))
+    )
+    await session.commit()
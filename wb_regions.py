@@ -0,0 +1,171 @@
+# wb_regions.py
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+if __package__:
+    from .metrics import cache_result
+else:
+    from metrics import cache_result
+
+logger = logging.getLogger(__name__)
+
+# Регионы доставки (dest) через запятую; первый — основной, по нему считается карточка товара
+WB_DEST_REGIONS = [int(x) for x in os.getenv("WB_DEST_REGIONS", "-1257786").split(",") if x.strip()]
+PRIMARY_DEST = WB_DEST_REGIONS[0]
+WB_REGION_TTL = float(os.getenv("WB_REGION_TTL", "600"))
+# Свой TTL для отдельных регионов: "dest:секунды,dest:секунды"
+WB_REGION_TTLS = {
+    int(dest): float(ttl)
+    for dest, ttl in (item.split(":", 1) for item in os.getenv("WB_REGION_TTLS", "").split(",") if ":" in item)
+}
+# Сколько артикулов держать в кэше одного региона; сверх — вытесняем давно не запрошенные
+WB_REGION_CACHE_SIZE = int(os.getenv("WB_REGION_CACHE_SIZE", "5000"))
+
+BatchFetcher = Callable[[List[str], int], Awaitable[Dict[str, Dict[str, Any]]]]
+
+
+class RegionOffer:
+    """Цена и остаток товара в одном регионе: цены в копейках, всё в int — строка занимает пару слов."""
+
+    __slots__ = ("price_kop", "basic_kop", "stocks", "ts")
+
+    def __init__(self, price_kop: int, basic_kop: int, stocks: int, ts: float):
+        self.price_kop = price_kop
+        self.basic_kop = basic_kop
+        self.stocks = stocks
+        self.ts = ts
+
+    @classmethod
+    def from_detail(cls, detail: Dict[str, Any]) -> "RegionOffer":
+        return cls(
+            int(round((detail.get("price") or 0) * 100)),
+            int(round((detail.get("basic_price") or 0) * 100)),
+            int(detail.get("stocks") or 0),
+            time.monotonic(),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"price": self.price_kop / 100, "basic_price": self.basic_kop / 100, "stocks": self.stocks}
+
+
+class RegionalPrices:
+    """
+    Цены и остатки по регионам с отдельным TTL на каждый регион.
+    Запросы разных парсингов к одному региону склеиваются в один multi-nm вызов card.wb.ru
+    (окно batch_window секунд или max_batch артикулов).
+    """
+
+    def __init__(
+        self,
+        fetch_batch: BatchFetcher,
+        dests: List[int] = WB_DEST_REGIONS,
+        ttl: float = WB_REGION_TTL,
+        ttl_by_dest: Optional[Dict[int, float]] = None,
+        batch_window: float = 0.05,
+        max_batch: int = 100,
+        max_entries: int = WB_REGION_CACHE_SIZE,
+    ):
+        self.fetch_batch = fetch_batch
+        self.dests = list(dests)
+        self.ttl = ttl
+        self.ttl_by_dest = WB_REGION_TTLS if ttl_by_dest is None else ttl_by_dest
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_entries = max_entries
+        self._cache: Dict[int, "OrderedDict[str, RegionOffer]"] = {dest: OrderedDict() for dest in self.dests}
+        self._pending: Dict[int, Dict[str, asyncio.Future]] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+
+    @property
+    def secondary_dests(self) -> List[int]:
+        return self.dests[1:]
+
+    def _fresh(self, dest: int, articul: str) -> Optional[RegionOffer]:
+        cache = self._cache.get(dest)
+        offer = cache.get(articul) if cache else None
+        if offer is None:
+            return None
+        if time.monotonic() - offer.ts > self.ttl_by_dest.get(dest, self.ttl):
+            cache.pop(articul, None)
+            return None
+        cache.move_to_end(articul)
+        return offer
+
+    def store(self, dest: int, articul: str, detail: Dict[str, Any]) -> Optional[RegionOffer]:
+        """Кладём в кэш уже полученные данные (например, основной регион из обычного парсинга)."""
+        if not detail:
+            return None
+        offer = RegionOffer.from_detail(detail)
+        cache = self._cache.setdefault(dest, OrderedDict())
+        cache[articul] = offer
+        cache.move_to_end(articul)
+        # в начале — давно не запрошенные: снимаем протухшие и всё, что сверх max_entries
+        ttl = self.ttl_by_dest.get(dest, self.ttl)
+        while len(cache) > 1:
+            oldest = next(iter(cache.values()))
+            if len(cache) <= self.max_entries and offer.ts - oldest.ts <= ttl:
+                break
+            cache.popitem(last=False)
+        return offer
+
+    def snapshot(self, articul: str) -> Dict[str, Dict[str, Any]]:
+        """Свежие данные по всем регионам, какие есть в кэше, без сетевых запросов."""
+        result = {}
+        for dest in self.dests:
+            offer = self._fresh(dest, articul)
+            if offer is not None:
+                result[str(dest)] = offer.to_dict()
+        return result
+
+    async def get(self, articul: str, dest: int) -> Optional[RegionOffer]:
+        offer = self._fresh(dest, articul)
+        cache_result("region", offer is not None)
+        if offer is not None:
+            return offer
+
+        loop = asyncio.get_running_loop()
+        pending = self._pending.setdefault(dest, {})
+        future = pending.get(articul)
+        if future is None:
+            future = pending[articul] = loop.create_future()
+            if len(pending) >= self.max_batch:
+                self._flush(dest)
+            elif dest not in self._timers:
+                self._timers[dest] = loop.call_later(self.batch_window, self._flush, dest)
+        return await asyncio.shield(future)
+
+    def prefetch(self, articul: str):
+        """Фоном подтягивает второстепенные регионы — основной парсинг их не ждёт."""
+        for dest in self.secondary_dests:
+            if self._fresh(dest, articul) is None:
+                task = asyncio.create_task(self.get(articul, dest))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def _flush(self, dest: int):
+        timer = self._timers.pop(dest, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(dest, None)
+        if batch:
+            task = asyncio.create_task(self._run_batch(dest, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, dest: int, batch: Dict[str, asyncio.Future]):
+        details: Dict[str, Dict[str, Any]] = {}
+        try:
+            details = await self.fetch_batch(list(batch), dest)
+        except Exception as e:
+            logger.warning(f"⚠️ Регион {dest}: пакетный запрос не удался: {e}")
+        finally:
+            # и при отмене задачи (shutdown, дедлайн) ждущие get() получают ответ — хотя бы None
+            for articul, future in batch.items():
+                offer = self.store(dest, articul, details.get(articul))
+                if not future.done():
+                    future.set_result(offer)
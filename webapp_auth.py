@@ -0,0 +1,35 @@
+# webapp_auth.py
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+# Сколько секунд после auth_date принимаем initData мини-приложения
+WEBAPP_INIT_MAX_AGE = int(os.getenv("WEBAPP_INIT_MAX_AGE", "86400"))
+
+
+def verify_init_data(init_data: Optional[str], bot_token: Optional[str], max_age: int = WEBAPP_INIT_MAX_AGE) -> Optional[int]:
+    """
+    Проверяет Telegram.WebApp.initData и возвращает id пользователя или None.
+    Подпись — HMAC-SHA256 от отсортированных «ключ=значение» без hash, ключ — HMAC-SHA256("WebAppData", токен бота):
+    подделать её без токена бота нельзя, в отличие от tg_id в теле запроса.
+    """
+    if not init_data or not bot_token:
+        return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop("hash", "")
+    check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received, expected):
+        return None
+    try:
+        if max_age and time.time() - int(fields.get("auth_date", 0)) > max_age:
+            return None
+        user_id = int(json.loads(fields.get("user", "{}")).get("id"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return user_id if user_id > 0 else None